@@ -0,0 +1,345 @@
+"""
+Asyncio serving mode (aiohttp) for the same API as the Flask app in main.py.
+
+Inference stays on the scheduler's worker threads. Each stream gets a
+bounded StreamBuffer: the decode thread never waits for a slow reader, it
+just coalesces text deltas into the buffer until the writer catches up.
+Streaming is available as NDJSON (default), SSE and WebSocket.
+"""
+import json
+import time
+import asyncio
+import threading
+from collections import deque
+
+from aiohttp import web, WSMsgType
+
+from backend import config
+from backend.core import engine, request_options
+from backend.grammar import grammar_cache, GrammarError
+from backend.response_cache import response_cache
+from backend.batch import run_batch, parse_jsonl
+from backend.registry import model_registry
+from backend import metrics
+from backend import tracing
+from backend.tracing import Trace, NULL_TRACE
+from backend import streaming
+from backend.streaming import to_wire
+
+STREAM_BUFFER_SIZE = 64 # Events per stream before deltas are coalesced
+
+class StreamBuffer:
+    """
+    Bounded hand-off between a decode worker thread and one asyncio writer.
+    put() never blocks: once `maxsize` events are queued, new content deltas
+    are merged into the last queued one.
+    """
+    def __init__(self, loop, maxsize=STREAM_BUFFER_SIZE):
+        self.loop = loop
+        self.maxsize = maxsize
+        self.items = deque()
+        self.lock = threading.Lock()
+        self.wakeup = asyncio.Event()
+        self.done = False
+
+    def put(self, event):
+        # Called from the worker thread (Job.put / Job.finish)
+        with self.lock:
+            if event is None:
+                self.done = True
+            elif (
+                len(self.items) >= self.maxsize
+                and event["type"] == "content"
+                and self.items[-1]["type"] == "content"
+            ):
+                last = self.items[-1]
+                self.items[-1] = {"type": "content", "data": last["data"] + event["data"]}
+            else:
+                self.items.append(event)
+        try:
+            self.loop.call_soon_threadsafe(self.wakeup.set)
+        except RuntimeError:
+            pass # Event loop already closed (server shutting down)
+
+    async def drain(self, timeout=None):
+        """Returns the queued events, [] once the job is finished, None if `timeout` passed first."""
+        while True:
+            self.wakeup.clear()
+            with self.lock:
+                if self.items:
+                    items = list(self.items)
+                    self.items.clear()
+                    return items
+                if self.done:
+                    return []
+            if timeout is None:
+                await self.wakeup.wait()
+                continue
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                return None
+
+async def iter_job(message, session_id, options=None, trace=NULL_TRACE, coalescer=None):
+    """Submit a chat turn and yield wire events as they are produced (coalesced if asked)."""
+    loop = asyncio.get_running_loop()
+    buffer = StreamBuffer(loop)
+    with trace.span("submit"):
+        job = engine.submit(message, session_id, events=buffer, options=options, trace=trace)
+    if job is None:
+        yield {"type": "token", "content": "Error: Neural Core not active."}
+        return
+    try:
+        if coalescer is None:
+            while True:
+                events = await buffer.drain()
+                if not events:
+                    return
+                for event in events:
+                    yield to_wire(event)
+        while True:
+            events = await buffer.drain(coalescer.timeout())
+            if events is None: # Time window passed while the decoder was quiet
+                ready = coalescer.flush()
+            elif events:
+                ready = [out for event in events for out in coalescer.add(event)]
+            else:
+                for event in coalescer.flush():
+                    yield to_wire(event)
+                return
+            for event in ready:
+                yield to_wire(event)
+    finally:
+        # Client went away (or we are done): stop decoding for this job
+        job.cancelled = True
+
+# ==================================================
+# ROUTES
+# ==================================================
+async def chat(request):
+    t_parse = time.perf_counter()
+    data = await request.json()
+    user_message = data.get('message', '')
+    stream_mode = data.get('stream', False)
+    session_id = data.get('session_id')
+    options = request_options(data)
+    if request.headers.get('X-Lumino-Trace'):
+        options["trace"] = True
+    trace = tracing.for_request(options) # NULL_TRACE unless asked for
+    if trace:
+        trace.complete("parse_json", Trace.at(t_parse), Trace.at(time.perf_counter()))
+
+    if not user_message:
+        return web.json_response({"error": "Message is required"}, status=400)
+    try:
+        settings = streaming.stream_settings(data) # stream_format / flush_ms / flush_tokens
+        # Compiling a new schema is pure Python: keep it off the event loop
+        grammar = await asyncio.get_running_loop().run_in_executor(None, grammar_cache.get, options)
+    except (GrammarError, streaming.StreamFormatError) as e:
+        return web.json_response({"error": str(e)}, status=400)
+    if grammar[0] is not None:
+        options["_grammar"] = grammar # (grammar, usage info): the slot uses this compile
+
+    if not stream_mode:
+        response = ""
+        usage = None
+        files_read = []
+        context = []
+        async for event in iter_job(user_message, session_id, options, trace):
+            if event["type"] == "token":
+                response += event["content"]
+            elif event["type"] == "usage":
+                usage = event["stats"]
+            elif event["type"] == "info":
+                files_read = event["files"]
+                context = event.get("context", [])
+        body = {"response": response, "usage": usage, "files_read": files_read, "context": context}
+        if trace:
+            body["trace_file"] = str(trace.path)
+            trace.save()
+        return web.json_response(body)
+
+    sse = "text/event-stream" in request.headers.get("Accept", "")
+    if sse:
+        settings["format"] = "sse" # Text protocol: no compact frames, coalescing still applies
+        content_type = "text/event-stream"
+    elif settings["format"] == "compact":
+        content_type = streaming.COMPACT_MIMETYPE
+    else:
+        content_type = "application/json"
+    resp = web.StreamResponse(headers={
+        "Content-Type": content_type,
+        "Cache-Control": "no-cache",
+        "X-Lumino-Stream": streaming.describe(settings),
+    })
+    await resp.prepare(request)
+
+    # write() awaits the socket drain, so a slow reader only slows its own
+    # coroutine; the StreamBuffer absorbs the decoder meanwhile
+    if sse:
+        def encode(event):
+            return f"event: {event['type']}\ndata: {json.dumps(event)}\n\n".encode('utf-8')
+    else:
+        encode = streaming.encoder(settings)
+
+    coalescer = streaming.Coalescer.from_settings(settings)
+    if not trace:
+        async for event in iter_job(user_message, session_id, options, coalescer=coalescer):
+            await resp.write(encode(event))
+    else:
+        # Traced: one span per serialize / socket write (per frame)
+        async for event in iter_job(user_message, session_id, options, trace, coalescer):
+            with trace.span("serialize"):
+                payload = encode(event)
+            with trace.span("write"):
+                await resp.write(payload)
+        await resp.write(encode({"type": "trace", "file": trace.save()}))
+    await resp.write_eof()
+    return resp
+
+async def chat_ws(request):
+    """WebSocket: send {"message", "session_id", options...}, receive token/usage events then {"type": "done"}."""
+    ws = web.WebSocketResponse(heartbeat=30)
+    await ws.prepare(request)
+
+    async for msg in ws:
+        if msg.type != WSMsgType.TEXT:
+            continue
+        try:
+            data = json.loads(msg.data)
+        except json.JSONDecodeError:
+            await ws.send_json({"type": "error", "error": "Invalid JSON"})
+            continue
+        if not data.get('message'):
+            await ws.send_json({"type": "error", "error": "Message is required"})
+            continue
+        options = request_options(data)
+        try:
+            # WebSocket messages are already framed: only flush_ms / flush_tokens apply
+            coalescer = streaming.Coalescer.from_settings(streaming.stream_settings(data))
+            grammar = await asyncio.get_running_loop().run_in_executor(None, grammar_cache.get, options)
+        except (GrammarError, streaming.StreamFormatError) as e:
+            await ws.send_json({"type": "error", "error": str(e)})
+            continue
+        if grammar[0] is not None:
+            options["_grammar"] = grammar
+        if request.headers.get('X-Lumino-Trace'):
+            options["trace"] = True
+        trace = tracing.for_request(options) # NULL_TRACE unless asked for
+
+        async for event in iter_job(data['message'], data.get('session_id'), options, trace, coalescer):
+            await ws.send_json(event)
+        if trace:
+            await ws.send_json({"type": "trace", "file": trace.save()})
+        await ws.send_json({"type": "done"})
+
+    return ws
+
+async def batch(request):
+    """Independent prompts, results as JSONL in completion order (see backend/batch.py)."""
+    body = await request.text()
+    try:
+        data = json.loads(body)
+        items = data.get('items', []) if isinstance(data, dict) else data
+    except json.JSONDecodeError:
+        items = parse_jsonl(body.splitlines())
+
+    if not items or not isinstance(items, list):
+        return web.json_response({"error": "Items are required"}, status=400)
+    if engine.scheduler is None:
+        return web.json_response({"error": "Neural Core not active"}, status=503)
+
+    resp = web.StreamResponse(headers={"Content-Type": "application/x-ndjson", "Cache-Control": "no-cache"})
+    await resp.prepare(request)
+    # run_batch blocks while waiting for the next result: step it on the executor.
+    # If the client goes away, items not yet queued are simply never submitted.
+    loop = asyncio.get_running_loop()
+    results = run_batch(engine, items)
+    while True:
+        result = await loop.run_in_executor(None, next, results, None)
+        if result is None:
+            break
+        await resp.write((json.dumps(result) + "\n").encode('utf-8'))
+    await resp.write_eof()
+    return resp
+
+async def set_model(request):
+    data = await request.json()
+    model_name = data.get('model')
+    if not model_name:
+        return web.json_response({"error": "Model name required"}, status=400)
+    if model_name not in config.get_available_models():
+        return web.json_response({"error": f"Model {model_name} not found"}, status=404)
+
+    state = engine.switch_model(model_name)
+    if state == "ready":
+        return web.json_response({"status": "success", "message": f"Switched to {model_name}"})
+    return web.json_response({"status": "loading", "message": f"Loading {model_name}"}, status=202)
+
+async def model_status(request):
+    return web.json_response(engine.model_status())
+
+async def list_models(request):
+    return web.json_response({"models": config.get_available_models(), "details": model_registry.describe()})
+
+async def scheduler_status(request):
+    if engine.scheduler is None:
+        return web.json_response({"error": "Neural Core not active"}, status=503)
+    return web.json_response(engine.scheduler.status())
+
+async def sessions_status(request):
+    return web.json_response(engine.sessions.status())
+
+async def health(request):
+    return web.json_response({"status": "ok", "uptime": round(time.time() - engine.started_at, 2)})
+
+async def ready(request):
+    info = engine.readiness()
+    return web.json_response(info, status=200 if info["ready"] else 503)
+
+async def metrics_endpoint(request):
+    return web.Response(text=metrics.registry.render(), content_type="text/plain") # Prometheus text format 0.0.4
+
+async def cache_status(request):
+    return web.json_response({**response_cache.status(), "grammar": grammar_cache.status()})
+
+@web.middleware
+async def cors(request, handler):
+    if request.method == "OPTIONS":
+        resp = web.Response()
+    else:
+        resp = await handler(request)
+    resp.headers["Access-Control-Allow-Origin"] = "*"
+    resp.headers["Access-Control-Allow-Headers"] = "Content-Type"
+    return resp
+
+def create_app():
+    app = web.Application(middlewares=[cors])
+    app.router.add_post('/chat', chat)
+    app.router.add_get('/ws', chat_ws)
+    app.router.add_post('/batch', batch)
+    app.router.add_post('/model/set', set_model)
+    app.router.add_get('/model/status', model_status)
+    app.router.add_get('/models', list_models)
+    app.router.add_get('/scheduler', scheduler_status)
+    app.router.add_get('/sessions', sessions_status)
+    app.router.add_get('/cache', cache_status)
+    app.router.add_get('/health', health)
+    app.router.add_get('/ready', ready)
+    app.router.add_get('/metrics', metrics_endpoint)
+    return app
+
+async def serve(host, port):
+    runner = web.AppRunner(create_app(), handle_signals=False, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    # Socket is listening: now load the model in the background (/ready reports progress)
+    engine.start()
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+
+def run(host='127.0.0.1', port=5000):
+    """Blocking; safe to call from a non-main thread (no signal handlers)."""
+    asyncio.run(serve(host, port))
@@ -0,0 +1,91 @@
+"""
+Offline batch inference: many independent prompts, results in completion order.
+
+Every item runs in a throwaway Conversation (nothing is added to any chat
+session). Items are submitted longest first so the slots finish together,
+and only a small window is queued at a time, so interactive /chat requests
+still get a slot between batch items. All prompts share the same rendered
+system prompt, which stays in each slot's KV cache and is never evaluated
+twice.
+"""
+import json
+import queue
+import uuid
+
+from backend import config
+from backend.core import Job, request_options
+from backend.sessions import Conversation
+
+class BatchSink:
+    """Job.events that collects one reply and reports it when the job ends."""
+    def __init__(self, item_id, results):
+        self.item_id = item_id
+        self.results = results
+        self.chunks = []
+        self.usage = None
+
+    def put(self, event):
+        if event is None:
+            self.results.put({"id": self.item_id, "response": "".join(self.chunks), "usage": self.usage})
+        elif event["type"] == "content":
+            self.chunks.append(event["data"])
+        elif event["type"] == "usage":
+            self.usage = event["data"]
+
+def parse_jsonl(lines):
+    """Batch items from JSONL lines: {"id"?, "message", options...} or a bare string. Bad lines become errors."""
+    items = []
+    for n, line in enumerate(lines):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            item = json.loads(line)
+        except json.JSONDecodeError as e:
+            item = {"id": n, "error": f"Invalid JSON: {e}"}
+        items.append(item)
+    return items
+
+def run_batch(engine, items, window=None):
+    """Yields one result dict per item, in completion order."""
+    results = queue.Queue()
+    batch_id = uuid.uuid4().hex[:8]
+    todo = []
+    for n, item in enumerate(items):
+        if isinstance(item, str):
+            item = {"message": item} # Bare prompt
+        elif not isinstance(item, dict):
+            yield {"id": n, "error": "Item must be an object"}
+            continue
+        item_id = item.get("id", n)
+        message = item.get("message") or item.get("prompt")
+        if not isinstance(message, str):
+            message = None
+        if item.get("error") or not message:
+            yield {"id": item_id, "error": item.get("error", "Message is required")}
+            continue
+        todo.append((item_id, message, item))
+
+    # Longest first: the long tail does not end up on a single slot
+    todo.sort(key=lambda entry: len(entry[1]), reverse=True)
+    todo.reverse() # pop() from the end
+
+    scheduler = engine.scheduler
+    if scheduler is None:
+        for item_id, _, _ in todo:
+            yield {"id": item_id, "error": "Neural Core not active."}
+        return
+    window = window or config.DEFAULT_BATCH_PARAMS["window_per_slot"] * scheduler.status()["slots"]
+
+    in_flight = 0
+    while todo or in_flight:
+        while todo and in_flight < window:
+            item_id, message, item = todo.pop()
+            options = {"retrieve": False}
+            options.update(request_options(item))
+            conversation = Conversation(f"batch-{batch_id}-{item_id}")
+            scheduler.submit(Job(conversation, message, events=BatchSink(item_id, results), options=options))
+            in_flight += 1
+        result = results.get()
+        in_flight -= 1
+        yield result
@@ -8,6 +8,16 @@ BACKEND_DIR = Path(__file__).resolve().parent
 ROOT_DIR = BACKEND_DIR.parent
 MODELS_DIR = ROOT_DIR / "models"
 PROJECT_DIR = ROOT_DIR
+SESSIONS_DIR = ROOT_DIR / "sessions"
+INDEX_DIR = ROOT_DIR / "index"
+TUNING_FILE = ROOT_DIR / "tuning.json"
+CACHE_FILE = ROOT_DIR / "cache.sqlite"
+MODEL_INDEX_FILE = ROOT_DIR / "model_index.json" # GGUF header cache (backend/registry.py)
+TRACES_DIR = ROOT_DIR / "traces" # Per-request Chrome traces (backend/tracing.py)
+
+# Benchmarks: LUMINO_FAKE_LLAMA=1 swaps llama_cpp for benchmarks/fake_llama.py
+USE_FAKE_LLAMA = os.environ.get("LUMINO_FAKE_LLAMA") == "1"
+FAKE_MODELS = ["fake-qwen2.5-instruct.gguf"]
 
 # ==================================================
 # 2. DEFAULT PARAMETERS
@@ -23,6 +33,128 @@ DEFAULT_INIT_PARAMS = {
     "rope_freq_base": 1000000
 }
 
+# Concurrent serving: every slot is an independent llama_cpp context.
+# Weights are shared between slots through mmap, the CPU cores are split.
+# mmap only shares CPU RAM: with layers offloaded every slot would upload its
+# own copy of the weights to VRAM, so offloaded models run gpu_slots slots.
+# out_of_process: every warm model runs in its own worker process
+# (backend/workers.py) on its own share of the cores.
+DEFAULT_SCHEDULER_PARAMS = {
+    "n_slots": 2,
+    "gpu_slots": 1,          # Slots per model when layers are offloaded (see scheduler_slots)
+    "n_cores": os.cpu_count() or 8,
+    "out_of_process": os.environ.get("LUMINO_PROCESS_WORKERS") == "1",
+}
+
+# Warm model pool: models kept loaded at the same time (LRU beyond that)
+DEFAULT_POOL_PARAMS = {
+    "max_models": 2,
+    "ram_budget_gb": 24,
+    "kv_bytes_per_token": 131072, # f16 K+V, ~8B model with GQA
+}
+
+# Conversations kept in RAM; colder ones are compressed to SESSIONS_DIR
+DEFAULT_SESSION_PARAMS = {
+    "max_resident": 256,
+}
+
+# Context window budgeting (see backend/context.py)
+# policy: "drop" removes the oldest turns, "compress" first shrinks them
+DEFAULT_CONTEXT_PARAMS = {
+    "policy": "drop",
+    "keep_last": 4,          # Latest messages that are never trimmed
+    "low_water": 0.75,       # Trim down to this fraction of the budget
+    "compact_chars": 600,    # Size of a compressed message
+}
+
+# /read file inclusion (see backend/utils.py)
+DEFAULT_READ_PARAMS = {
+    "max_file_tokens": 4096,       # Upper bound per message, also capped by the context budget
+    "mmap_threshold": 1024 * 1024, # Files above this are read through mmap, windowed
+    "cache_entries": 128,
+}
+
+# Project retrieval index (see backend/index.py)
+DEFAULT_INDEX_PARAMS = {
+    "extensions": [".py", ".js", ".ts", ".tsx", ".jsx", ".html", ".css", ".md", ".txt",
+                   ".json", ".toml", ".yaml", ".yml", ".ini", ".cfg", ".sh", ".sql",
+                   ".c", ".h", ".cpp", ".rs", ".go", ".java"],
+    "skip_dirs": ["models", "sessions", "index", "traces", "__pycache__", "node_modules", "venv", "env", "build", "dist"],
+    "max_file_bytes": 512 * 1024,
+    "chunk_lines": 40,        # Lines per chunk
+    "rescan_interval": 30,    # Seconds between mtime scans
+    "bm25_k1": 1.2,
+    "bm25_b": 0.75,
+    "top_k": 4,               # Chunks considered per message
+    "min_score": 2.0,         # Weaker matches are not injected
+    "max_context_tokens": 1024, # Also capped to a quarter of the context budget
+}
+
+# Semantic index (see backend/vectors.py), needs an embedding GGUF in models/
+DEFAULT_VECTOR_PARAMS = {
+    "model": None,            # None = first file that looks like an embedding model
+    "n_ctx": 512,             # Per chunk; longer chunks are truncated
+    "n_threads": 2,           # Keep most cores for chat decoding
+    "batch_size": 32,         # Chunks per embed() call
+    "grow_rows": 4096,        # Matrix growth step
+    "rescan_interval": 30,
+    "top_k": 4,
+    "min_similarity": 0.45,   # Cosine; weaker hits are ignored
+    "recall_chars": 400,      # Size of a recalled old message
+}
+
+EMBEDDING_MODEL_HINTS = ("embed", "bge", "e5-", "minilm", "gte-")
+
+# Per-host autotune of threads / n_batch / GPU layers (see backend/tuning.py).
+# Results are always reused once stored; the sweep itself is opt-in.
+DEFAULT_TUNING_PARAMS = {
+    "autotune": os.environ.get("LUMINO_AUTOTUNE") == "1",
+    "n_ctx": 2048,           # Context used while benchmarking
+    "prompt_tokens": 512,
+    "decode_tokens": 32,
+    "batch_sizes": [128, 256, 512, 1024],
+}
+
+# Speculative decoding (see backend/drafting.py)
+# strategy: None, "prompt_lookup" (n-grams from the prompt) or "model" (small GGUF in models/)
+DEFAULT_DRAFT_PARAMS = {
+    "strategy": None,
+    "model": None,           # Draft GGUF filename for strategy "model" (same vocabulary)
+    "max_ngram_size": 3,
+    "num_pred_tokens": 10,   # Tokens proposed per step
+    "min_acceptance": 0.3,   # Below this (over `window` drafted tokens) drafting pauses
+    "window": 64,
+    "cooldown": 4,           # Requests decoded without drafting before retrying
+}
+
+# Reply cache for deterministic requests (temperature 0 or a fixed seed)
+DEFAULT_CACHE_PARAMS = {
+    "enabled": True,
+    "max_mb": 64,            # LRU eviction beyond this
+}
+
+# Constrained decoding ("json_schema" / "grammar" on /chat, see backend/grammar.py)
+DEFAULT_GRAMMAR_PARAMS = {
+    "cache_size": 64,        # Compiled grammars kept (LRU)
+}
+
+# Stream framing of /chat (per request: "stream_format", "flush_ms", "flush_tokens", see backend/streaming.py)
+DEFAULT_STREAM_PARAMS = {
+    "flush_ms": 0,           # Default: no time window...
+    "flush_tokens": 1,       # ...and one event per token (plain NDJSON, as before)
+    "max_flush_ms": 250,     # Upper bound a client may ask for
+}
+
+# Opt-in request tracing ("trace": true / X-Lumino-Trace: 1, "profile": true for stack samples)
+DEFAULT_TRACE_PARAMS = {
+    "sample_interval_ms": 1,  # Python stack sampling period of the decode thread
+}
+
+# Offline batch inference (/batch, main.py --batch)
+DEFAULT_BATCH_PARAMS = {
+    "window_per_slot": 2,    # Batch jobs queued per slot; /chat still gets a turn in between
+}
+
 DEFAULT_GEN_PARAMS = {
     "max_tokens": 4096,
     "temperature": 0.7,
@@ -53,29 +185,78 @@ ATURAN:
 3. ANALISIS: To-the-point, jelaskan root cause dan solusi.
 """
 
+# Templates split per message: the engine tokenizes every message once and
+# assembles prompts from the cached token arrays (see TemplateTokenizer in
+# backend/core.py). The format_* functions render the same text in one go.
+CHATML_TEMPLATE = {
+    "system": "<|im_start|>system\n{content}<|im_end|>\n",
+    "message": "<|im_start|>{role}\n{content}<|im_end|>\n",
+    "assistant": "<|im_start|>assistant\n",
+}
+
+LLAMA3_TEMPLATE = {
+    "system": "<|start_header_id|>system<|end_header_id|>\n\n{content}<|eot_id|>",
+    "message": "<|start_header_id|>{role}<|end_header_id|>\n\n{content}<|eot_id|>",
+    "assistant": "<|start_header_id|>assistant<|end_header_id|>\n\n",
+}
+
+GENERIC_TEMPLATE = {
+    "system": "System: {content}\n\n",
+    "message": "{Role}: {content}\n",
+    "assistant": "Assistant: ",
+}
+
+def render_message(template, role, content):
+    return template["message"].format(role=role, Role=role.capitalize(), content=content)
+
+def render_prompt(template, system, messages):
+    parts = [template["system"].format(content=system)]
+    for msg in messages:
+        parts.append(render_message(template, msg.get("role", "user"), msg.get("content", "")))
+    parts.append(template["assistant"])
+    return "".join(parts)
+
 def format_chatml(system, messages):
     """Format for Qwen/ChatML models"""
-    prompt = f"<|im_start|>system\n{system}<|im_end|>\n"
-    for msg in messages:
-        role = msg.get("role", "user")
-        content = msg.get("content", "")
-        prompt += f"<|im_start|>{role}\n{content}<|im_end|>\n"
-    prompt += "<|im_start|>assistant\n"
-    return prompt
+    return render_prompt(CHATML_TEMPLATE, system, messages)
 
 def format_llama3(system, messages):
     """Format for Llama 3 models"""
-    prompt = f"<|start_header_id|>system<|end_header_id|>\n\n{system}<|eot_id|>"
-    for msg in messages:
-        role = msg.get("role", "user")
-        content = msg.get("content", "")
-        prompt += f"<|start_header_id|>{role}<|end_header_id|>\n\n{content}<|eot_id|>"
-    prompt += "<|start_header_id|>assistant<|end_header_id|>\n\n"
-    return prompt
+    return render_prompt(LLAMA3_TEMPLATE, system, messages)
 
 # ==================================================
 # 4. MODEL CONFIGURATIONS
 # ==================================================
+# Per model type (see detect_model_type); others use DEFAULT_INIT_PARAMS / GENERIC_TEMPLATE
+MODEL_N_CTX = {"qwen_coder": 16384, "qwen_instruct": 8192}
+MODEL_TEMPLATES = {"qwen_coder": "chatml", "qwen_instruct": "chatml", "llama3": "llama3"}
+
+def detect_model_type(filename, meta=None):
+    """Model family from the filename (+ the name stored in the GGUF header)."""
+    lower_name = filename.lower()
+    if meta and meta["name"]:
+        lower_name += " " + meta["name"].lower()
+    if "coder" in lower_name:
+        return "qwen_coder"
+    if "qwen" in lower_name and "instruct" in lower_name:
+        return "qwen_instruct"
+    if "llama-3" in lower_name:
+        return "llama3"
+    return "generic"
+
+def model_context(filename, meta=None):
+    """(n_ctx, template name) ModelConfig would pick, from an already scanned header."""
+    model_type = detect_model_type(filename, meta)
+    n_ctx = MODEL_N_CTX.get(model_type, DEFAULT_INIT_PARAMS["n_ctx"])
+    template = MODEL_TEMPLATES.get(model_type, "generic")
+    if meta:
+        # Same precedence as ModelConfig._apply_metadata
+        if meta["chat_format"] in ("chatml", "llama3"):
+            template = meta["chat_format"]
+        if meta["context_length"]:
+            n_ctx = min(n_ctx, meta["context_length"])
+    return n_ctx, template
+
 class ModelConfig:
     def __init__(self, filename):
         self.filename = filename
@@ -85,12 +266,18 @@ class ModelConfig:
         self.description = "General Purpose AI"
         self.icon = "🧠"
         self.name = filename.replace(".gguf", "").replace("-", " ").title()
+        self.context_params = DEFAULT_CONTEXT_PARAMS.copy()
+        self.auto_retrieve = False # Inject relevant project chunks into each message
+        self.draft_params = DEFAULT_DRAFT_PARAMS.copy()
         
-        # Detect type based on filename
-        lower_name = filename.lower()
+        # GGUF header facts (None for unreadable files and the fake backend)
+        from backend.registry import model_registry
+        self.meta = None if USE_FAKE_LLAMA else model_registry.get(filename)
+
+        # Detect type based on filename (+ the name stored in the GGUF)
+        self.type = detect_model_type(filename, self.meta)
         
-        if "coder" in lower_name:
-            self.type = "qwen_coder"
+        if self.type == "qwen_coder":
             self.name = "Qwen 2.5 Coder"
             self.description = "Coding & Arsitektur"
             self.icon = "💻"
@@ -98,13 +285,15 @@ class ModelConfig:
             self.stop_tokens = ["<|im_end|>", "<|endoftext|>"]
             self.format_func = format_chatml
             self.init_params = DEFAULT_INIT_PARAMS.copy()
-            self.init_params["n_ctx"] = 16384 
+            self.init_params["n_ctx"] = MODEL_N_CTX["qwen_coder"]
             self.gen_params = DEFAULT_GEN_PARAMS.copy()
             self.gen_params["temperature"] = 0.1 # Precise for coding
+            self.context_params["policy"] = "compress" # Keep old code around in short form
+            self.auto_retrieve = True
+            self.draft_params["strategy"] = "prompt_lookup" # Answers often copy code from the prompt
             self.gen_params["stop"] = self.stop_tokens
             
-        elif "qwen" in lower_name and "instruct" in lower_name:
-            self.type = "qwen_instruct"
+        elif self.type == "qwen_instruct":
             self.name = "Qwen 2.5 Instruct"
             self.description = "Asisten Serbaguna & Cepat"
             self.icon = "🚀"
@@ -112,13 +301,12 @@ class ModelConfig:
             self.stop_tokens = ["<|im_end|>", "<|endoftext|>"]
             self.format_func = format_chatml
             self.init_params = DEFAULT_INIT_PARAMS.copy()
-            self.init_params["n_ctx"] = 8192
+            self.init_params["n_ctx"] = MODEL_N_CTX["qwen_instruct"]
             self.gen_params = DEFAULT_GEN_PARAMS.copy()
             self.gen_params["temperature"] = 0.7
             self.gen_params["stop"] = self.stop_tokens
 
-        elif "llama-3" in lower_name:
-            self.type = "llama3"
+        elif self.type == "llama3":
             self.name = "Llama 3.1 Instruct" 
             self.description = "Pengetahuan Umum & Logika"
             self.icon = "📚"
@@ -132,7 +320,6 @@ class ModelConfig:
             
         else:
             # Fallback / Generic
-            self.type = "generic"
             self.description = "Model Generik"
             self.icon = "🤖"
             self.system_prompt = SYSTEM_PROMPT_GENERAL
@@ -141,22 +328,79 @@ class ModelConfig:
             self.init_params = DEFAULT_INIT_PARAMS.copy()
             self.gen_params = DEFAULT_GEN_PARAMS.copy()
 
+        if self.meta:
+            self._apply_metadata(self.meta)
+
         # CRITICAL FIX: Add model_path to init_params
         self.init_params["model_path"] = self.path
 
+    def _apply_metadata(self, meta):
+        """The GGUF header wins over filename guesses: template, context length, RoPE base."""
+        chat_format = meta["chat_format"]
+        if chat_format == "chatml" and self.format_func is not format_chatml:
+            self.format_func = format_chatml
+            self.stop_tokens = ["<|im_end|>", "<|endoftext|>"]
+            self.gen_params["stop"] = self.stop_tokens
+        elif chat_format == "llama3" and self.format_func is not format_llama3:
+            self.format_func = format_llama3
+            self.stop_tokens = ["<|eot_id|>", "<|end_of_text|>", "assistant\n\n"]
+            self.gen_params["stop"] = self.stop_tokens
+        if meta["context_length"]:
+            self.init_params["n_ctx"] = min(self.init_params["n_ctx"], meta["context_length"])
+        if meta["rope_freq_base"]:
+            self.init_params["rope_freq_base"] = meta["rope_freq_base"]
+
+    def apply_tuning(self, max_threads):
+        """Use the stored autotune result for this host, if any. Returns it (or None)."""
+        from backend import tuning
+        tuned = tuning.lookup(self.path, max_threads)
+        if tuned:
+            self.init_params.update(tuned)
+        return tuned
+
+    @property
+    def template(self):
+        """Per-message template matching format_func (GENERIC_TEMPLATE for the fallback format)."""
+        if self.format_func is format_chatml:
+            return CHATML_TEMPLATE
+        if self.format_func is format_llama3:
+            return LLAMA3_TEMPLATE
+        return GENERIC_TEMPLATE
+
     def make_prompt(self, messages):
-        if self.format_func:
-            return self.format_func(self.system_prompt, messages)
-        else:
-            # Fallback simple format
-            prompt = f"System: {self.system_prompt}\n\n"
-            for msg in messages:
-                prompt += f"{msg['role'].capitalize()}: {msg['content']}\n"
-            prompt += "Assistant: "
-            return prompt
+        return render_prompt(self.template, self.system_prompt, messages)
+
+def gpu_offload(init_params):
+    """True when llama_cpp will really put layers on a GPU (never with the fake backend)."""
+    if USE_FAKE_LLAMA or not init_params.get("n_gpu_layers"):
+        return False
+    try:
+        import llama_cpp
+        return bool(llama_cpp.llama_supports_gpu_offload())
+    except Exception:
+        return False
+
+def scheduler_slots(init_params, n_slots=None):
+    """Slots a scheduler starts for a model (capped to gpu_slots when offloading)."""
+    n_slots = max(1, n_slots or DEFAULT_SCHEDULER_PARAMS["n_slots"])
+    if gpu_offload(init_params):
+        return min(n_slots, DEFAULT_SCHEDULER_PARAMS["gpu_slots"])
+    return n_slots
+
+def is_embedding_model(filename):
+    lower_name = filename.lower()
+    return any(hint in lower_name for hint in EMBEDDING_MODEL_HINTS)
 
 def get_available_models():
-    """Scan models directory for .gguf files"""
-    if not MODELS_DIR.exists():
+    """Chat models in the models directory (from the cached GGUF headers)"""
+    if USE_FAKE_LLAMA:
+        return list(FAKE_MODELS)
+    from backend.registry import model_registry
+    return model_registry.chat_models()
+
+def get_embedding_models():
+    """Embedding models in the models directory (from the cached GGUF headers)"""
+    if USE_FAKE_LLAMA:
         return []
-    return [f.name for f in MODELS_DIR.glob("*.gguf")]
\ No newline at end of file
+    from backend.registry import model_registry
+    return model_registry.embedding_models()
\ No newline at end of file
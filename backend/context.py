@@ -0,0 +1,94 @@
+class ContextOverflowError(Exception):
+    pass
+
+def compact_text(text, max_chars):
+    """Keep the head and tail of a long message, drop the middle."""
+    if len(text) <= max_chars:
+        return text
+    half = max_chars // 2
+    return f"{text[:half]}\n[... {len(text) - max_chars} karakter dipotong ...]\n{text[-half:]}"
+
+class ContextBudget:
+    """
+    Keeps the rendered prompt inside n_ctx with room left for max_tokens.
+
+    The system prompt and the last `keep_last` messages are pinned. When the
+    window overflows, older turns are compacted ("compress" policy) and/or
+    dropped from the front until the prompt is back under the low-water mark.
+    The cut point is stored on the conversation (context_start), so the
+    prompt prefix stays stable between trims and the KV cache keeps hitting.
+    """
+    def __init__(self, model_config, message_ids, system_tokens):
+        params = model_config.context_params
+        self.message_ids = message_ids # Templated ids of a message (cached on it)
+        self.n_ctx = model_config.init_params["n_ctx"]
+        self.reserve = model_config.gen_params.get("max_tokens", 0)
+        self.policy = params["policy"]
+        self.keep_last = params["keep_last"]
+        self.low_water = params["low_water"]
+        self.compact_chars = params["compact_chars"]
+        self.system_tokens = system_tokens # BOS + system turn + assistant header
+
+    @property
+    def budget(self):
+        return self.n_ctx - self.reserve - self.system_tokens
+
+    def message_tokens(self, msg):
+        """Exact token count of one message: the same ids go into the prompt."""
+        return len(self.message_ids(msg))
+
+    def fit(self, conversation, reserve=0):
+        """
+        Returns the messages to render, trimming conversation.history's window if needed.
+        `reserve` keeps extra room for text added to this turn only (retrieved context).
+        """
+        history = conversation.history
+        budget = self.budget - reserve
+        start = min(conversation.context_start, len(history) - 1)
+        total = sum(self.message_tokens(m) for m in history[start:])
+
+        if total > budget:
+            start, total = self._trim(history, start, total, budget)
+            conversation.context_start = start
+            if total > budget:
+                raise ContextOverflowError(
+                    f"Pesan terlalu panjang untuk context window ({total} > {budget} tokens)"
+                )
+
+        return [
+            {"role": m["role"], "content": m.get("compact", m["content"])}
+            for m in history[start:]
+        ]
+
+    def _trim(self, history, start, total, budget):
+        target = int(budget * self.low_water)
+        pinned_from = max(start, len(history) - self.keep_last)
+
+        # 1. Compress: shrink old unpinned turns in place, oldest first
+        if self.policy == "compress":
+            for msg in history[start:pinned_from]:
+                if total <= target:
+                    break
+                if "compact" in msg:
+                    continue
+                before = self.message_tokens(msg)
+                msg["compact"] = compact_text(msg["content"], self.compact_chars)
+                total += self.message_tokens(msg) - before
+
+        # 2. Drop: slide the window start forward over unpinned turns
+        while total > target and start < pinned_from:
+            total -= self.message_tokens(history[start])
+            start += 1
+
+        # 3. Pinned tail alone overflows: give up older pinned turns too,
+        #    never the latest message
+        while total > budget and start < len(history) - 1:
+            total -= self.message_tokens(history[start])
+            start += 1
+
+        # Start the window on a user turn
+        while start < len(history) - 1 and history[start]["role"] != "user":
+            total -= self.message_tokens(history[start])
+            start += 1
+
+        return start, total
@@ -2,11 +2,34 @@ import time
 import sys
 import os
 import gc
-from llama_cpp import Llama
+import codecs
+import queue
+import threading
+import atexit
+from array import array
+from collections import OrderedDict
+from contextlib import nullcontext
 
 # --- IMPORT KONFIGURASI BARU ---
 from backend import config
+if config.USE_FAKE_LLAMA:
+    from benchmarks.fake_llama import FakeLlama as Llama
+else:
+    from llama_cpp import Llama
 from backend.config import ModelConfig
+from backend.sessions import SessionStore
+from backend.context import ContextBudget, compact_text
+from backend.utils import expand_read_commands
+from backend.index import project_index
+from backend.vectors import vector_index, session_key
+from backend.workers import ProcessScheduler
+from backend import tuning
+from backend.drafting import make_draft
+from backend.response_cache import response_cache
+from backend.registry import estimate_ram
+from backend import metrics
+from backend.grammar import grammar_cache
+from backend.tracing import Trace, StackSampler, NULL_TRACE, for_request as trace_for_request
 
 # --- PEREDAM SUARA ---
 class SuppressFactory:
@@ -36,138 +59,985 @@ class SuppressFactory:
         sys.stderr = self._original_stderr
         self._devnull.close()
 
-class AIEngine:
-    def __init__(self):
-        self.model = None
-        self.active_config = None
-        self.history = [] # Context Memory
-        
-        # Auto-load first available model by default
-        available_models = config.get_available_models()
-        if available_models:
-            self.switch_model(available_models[0])
-        else:
-            print("Error: No models found.")
+DEFAULT_SESSION = "default"
+
+class Job:
+    """One /chat request, bound to its conversation. Events flow back through a queue."""
+    def __init__(self, conversation, user_input, on_finish=None, events=None, options=None, trace=None):
+        self.conversation = conversation
+        self.on_finish = on_finish
+        self.user_input = user_input
+        self.options = options or {} # Per-request overrides (e.g. "retrieve")
+        self.files_read = []
+        self.events = events if events is not None else queue.Queue() # Anything with put()
+        self.cancelled = False
+        self.submitted_at = time.time()
+        self.submitted_perf = time.perf_counter()
+        self.trace = trace if trace is not None else trace_for_request(self.options) # NULL_TRACE if off
+        self.model = None # Set by the scheduler on submit (metrics label)
+        self.usage = None
 
-    def switch_model(self, model_filename):
+    def put(self, event):
+        if event["type"] == "usage":
+            self.usage = event["data"] # The only per-event work metrics need
+        self.events.put(event)
+
+    def finish(self):
+        if self.model is not None:
+            metrics.active_requests.dec()
+            metrics.observe_job(self.model, self.usage, self.cancelled)
+        if self.on_finish is not None:
+            self.on_finish(self.conversation)
+        self.events.put(None)
+
+    def stream(self, poll=None):
         """
-        Switch the active model to the specified filename.
-        Returns True if successful, False otherwise.
+        Yield events until the worker finishes (or the consumer goes away).
+        With `poll` (seconds), yields None whenever nothing arrived for that
+        long (stream coalescing checks its time window on it).
         """
         try:
-            self.active_config = ModelConfig(model_filename)
-            self.load_model()
-            self.history = [] # Reset history on model switch
-            return True
-        except Exception as e:
-            print(f"Error switching model: {e}")
-            return False
+            while True:
+                try:
+                    event = self.events.get(timeout=poll)
+                except queue.Empty:
+                    yield None
+                    continue
+                if event is None:
+                    return
+                yield event
+        finally:
+            self.cancelled = True
 
-    def load_model(self):
-        # CLEANUP MEMORY
-        if self.model is not None:
-            del self.model
-            self.model = None
-            gc.collect()
-            time.sleep(1)
+class TextTokenizer:
+    """str <-> token ids for one Llama (plain text, no BOS, no special tokens)."""
+    def __init__(self, model):
+        self.model = model
+
+    def tokenize(self, text):
+        return self.model.tokenize(text.encode('utf-8'), add_bos=False, special=False)
+
+    def detokenize(self, ids):
+        return self.model.detokenize(ids).decode('utf-8', errors='ignore')
+
+class TemplateTokenizer:
+    """
+    Chat template at token level. Every history message keeps its templated
+    ids in an array('i') (msg["_tok"], per model), computed once; a prompt is
+    the concatenation of those arrays, so old turns are never rendered or
+    tokenized again. Template parts end on special tokens, which the
+    tokenizer splits on anyway: the result equals tokenizing the whole prompt.
+    /read blocks reuse the ids from the file cache (msg["_read"], first turn
+    only) and are spliced in at the block boundaries.
+    """
+    def __init__(self, model, model_config):
+        self.model = model
+        self.key = model_config.filename
+        self.template = model_config.template
+        self.bos = self.model.tokenize(b"", add_bos=True, special=True) # [] if the vocab adds no BOS
+        self.system = self.ids(self.template["system"].format(content=model_config.system_prompt))
+        self.assistant = self.ids(self.template["assistant"])
+
+    def ids(self, text):
+        return array('i', self.model.tokenize(text.encode('utf-8'), add_bos=False, special=True))
 
+    def message_ids(self, msg, extra=""):
+        """Templated ids of one message. `extra` (this turn only) bypasses the cache."""
+        if extra:
+            return self._render_ids(msg, extra)
+        compact = "compact" in msg
+        cached = msg.get("_tok")
+        if cached is not None and cached[0] == self.key and cached[1] == compact:
+            return cached[2]
+        ids = self._render_ids(msg)
+        msg["_tok"] = (self.key, compact, ids)
+        msg.pop("_read", None) # The file blocks' ids live on in _tok
+        return ids
+
+    def _render_ids(self, msg, extra=""):
+        read = msg.get("_read")
+        if read is None or read[0] != self.key or "compact" in msg:
+            content = msg.get("compact", msg["content"])
+            return self.ids(config.render_message(self.template, msg["role"], content + extra))
+        # /read message: splice in the file cache's block ids, only typed text is tokenized
+        head, tail = config.render_message(self.template, msg["role"], "\0").split("\0")
+        ids = self.ids(head)
+        for text, block_ids in read[1]:
+            ids += block_ids if block_ids is not None else self.ids(text)
+        ids += self.ids(extra + tail)
+        return ids
+
+    @property
+    def fixed_tokens(self):
+        """Prompt tokens outside the window: BOS, system turn, assistant header."""
+        return len(self.bos) + len(self.system) + len(self.assistant)
+
+    def prompt(self, window, extra=""):
+        """BOS + system + window (+ `extra` on the last message) + assistant header."""
+        ids = array('i', self.bos)
+        ids += self.system
+        for msg in window[:-1]:
+            ids += self.message_ids(msg)
+        ids += self.message_ids(window[-1], extra)
+        ids += self.assistant
+        return ids
+
+class InferenceSlot:
+    """
+    One llama_cpp context with its own KV cache. All slots of a scheduler load
+    the same GGUF with use_mmap, so the weights live once in the page cache
+    (VRAM is not shared: offloaded models get one slot, see scheduler_slots).
+    """
+    def __init__(self, index, model_config, n_threads, n_threads_batch=None):
+        self.index = index
+        self.config = model_config
+        self.kv_tokens = [] # Tokens currently held in the llama_cpp context
+        self.conversation_id = None # Conversation whose KV cache is resident
+        self.decode_ms_per_token = None # Moving average without grammar (baseline for grammar overhead)
+
+        params = model_config.init_params.copy()
+        params["n_threads"] = n_threads
+        params["n_threads_batch"] = n_threads_batch or n_threads
+        with SuppressFactory():
+            self.model = Llama(**params)
+            # Speculative decoding: llama_cpp verifies the drafted tokens itself
+            self.draft = make_draft(model_config, self.model, Llama, n_threads)
+        self.model.draft_model = self.draft
+        self.stop_ids = self._stop_token_ids()
+        self.tokenizer = TextTokenizer(self.model)
+        self.template = TemplateTokenizer(self.model, model_config)
+        self.budget = ContextBudget(model_config, self.template.message_ids, self.template.fixed_tokens)
         try:
-            with SuppressFactory():
-                self.model = Llama(**self.active_config.init_params)
+            self.model_id = tuning.file_hash(model_config.path) # Response cache key part
+        except OSError:
+            self.model_id = model_config.filename
+
+    def count_tokens(self, text):
+        return len(self.tokenizer.tokenize(text))
+
+    def run(self, job):
+        # Queue wait ends here, before any preprocessing (/read, fit, retrieval, cache lookup)
+        queue_ms = (time.time() - job.submitted_at) * 1000
+        conversation = job.conversation
+        trace = job.trace
+        if trace:
+            trace.complete("queue_wait", Trace.at(job.submitted_perf), Trace.at(time.perf_counter()), slot=self.index)
+
+        # 1. Expand /read commands (cached per file + model), then update history
+        with trace.span("user_message"):
+            current_message = self._user_message(job)
+        conversation.history.append(current_message)
+        self.conversation_id = conversation.id
+
+        try:
+            # 2. Fit the conversation into n_ctx (max_tokens reserved)
+            with trace.span("fit_context", history=len(conversation.history)):
+                retrieve_tokens = self._retrieve_budget(job)
+                messages = self.budget.fit(conversation, reserve=retrieve_tokens)
+                window = conversation.history[-len(messages):]
+
+            # 3. Relevant project chunks go into this turn's prompt only (not
+            #    into history), so they never pile up in later prompts
+            extra, context_labels, context_tokens = "", [], 0
+            if retrieve_tokens:
+                with trace.span("retrieval"):
+                    extra, context_labels, context_tokens = self._retrieve(job, retrieve_tokens)
+            if job.files_read or context_labels:
+                job.put({"type": "info", "files": job.files_read, "context": context_labels})
+
+            # Prompt = cached token arrays of the window; only new text is tokenized
+            with trace.span("assemble_prompt"):
+                prompt_tokens = self.template.prompt(window, extra)
+
+            # 4. Deterministic settings: replay a cached reply if there is one
+            with trace.span("gen_params"):
+                gen_params, grammar_info = self._gen_params(job)
+            cache_key = None
+            cached = None
+            if response_cache.enabled and response_cache.cacheable(gen_params):
+                with trace.span("cache_lookup"):
+                    cache_key = response_cache.key(self.model_id, prompt_tokens, gen_params)
+                    cached = response_cache.get(cache_key)
+
+            # 5. Decode, reusing whatever prefix is already in the KV cache
+            decode_start_ms = (time.time() - job.submitted_at) * 1000 # Queue wait + preprocessing
+            events = self.replay(cached, len(prompt_tokens)) if cached else self.decode(prompt_tokens, gen_params, trace)
+            chunks = []
+            usage = None
+            # "profile": sample this thread's Python stack while decoding
+            sampler = StackSampler(trace, threading.get_ident()) if trace and job.options.get("profile") else nullcontext()
+            with sampler:
+                for event in events:
+                    if job.cancelled:
+                        break
+                    if event["type"] == "content":
+                        chunks.append(event["data"])
+                    elif event["type"] == "usage":
+                        usage = event["data"]
+                        usage["queue_ms"] = round(queue_ms, 1)
+                        usage["ttft_ms"] = round(decode_start_ms + usage["prompt_eval_ms"], 1)
+                        usage["context_tokens"] = context_tokens
+                        usage.update(grammar_info)
+                        if cache_key:
+                            # Lets a parent process count lookups made in a worker (see ProcessScheduler)
+                            usage["response_cache"] = "hit" if cached else "miss"
+                    job.put(event)
+
+            # Only complete replies are worth caching
+            if cache_key and not cached and usage is not None and not job.cancelled:
+                response_cache.put(cache_key, self.config.filename, chunks, usage)
+
+            # Append assistant response to history after decoding is done
+            conversation.history.append({"role": "assistant", "content": "".join(chunks)})
+
         except Exception as e:
-            print(f"Error loading model: {e}")
-            return 
+            self.kv_tokens = []
+            job.put({"type": "content", "data": f"Runtime Logic Error: {str(e)}"})
+
+    def _retrieve(self, job, retrieve_tokens):
+        """Recalled old turns + project chunks for this turn. Returns (text, labels, tokens)."""
+        extra = ""
+        context_labels = []
+        context_tokens = 0
+        semantic, recalled = self._semantic_hits(job)
+        if recalled:
+            block, labels, n_tokens = self._recall_block(job.conversation, recalled, retrieve_tokens // 2)
+            extra += block
+            context_labels += labels
+            context_tokens += n_tokens
+        block, labels, n_tokens = project_index.build_context(
+            job.user_input, self.count_tokens, retrieve_tokens - context_tokens, semantic
+        )
+        extra += block
+        context_labels += labels
+        context_tokens += n_tokens
+        return extra, context_labels, context_tokens
+
+    def _user_message(self, job):
+        user_input = job.user_input
+        if "/read" not in user_input:
+            return {"role": "user", "content": user_input}
+
+        max_file_tokens = min(
+            config.DEFAULT_READ_PARAMS["max_file_tokens"],
+            self.budget.budget // 2,
+        )
+        content, job.files_read, segments = expand_read_commands(
+            user_input, self.tokenizer, self.config.filename, max_file_tokens
+        )
+
+        message = {"role": "user", "content": content}
+        if any(ids is not None for _, ids in segments):
+            # Cached per-file token ids, spliced in by TemplateTokenizer.message_ids
+            message["_read"] = (self.config.filename, segments)
+        return message
+
+    def _retrieve_budget(self, job):
+        """Tokens reserved for retrieved context, 0 if retrieval is off for this job."""
+        enabled = job.options.get("retrieve")
+        if enabled is None:
+            enabled = self.config.auto_retrieve
+        if not enabled or job.files_read:
+            return 0 # Explicit /read wins over automatic context
+        project_index.refresh_async()
+        return min(
+            config.DEFAULT_INDEX_PARAMS["max_context_tokens"],
+            self.budget.budget // 4,
+        )
+
+    def _semantic_hits(self, job):
+        """
+        Vector search (if an embedding model is loaded). Returns project chunks
+        to fuse with BM25, and indices of this conversation's old messages
+        that already left the context window.
+        """
+        if not vector_index.ready:
+            return [], []
+        params = config.DEFAULT_VECTOR_PARAMS
+        key = session_key(job.conversation.id)
+        chunks = []
+        recalled = []
+        for score, meta in vector_index.search(job.user_input, params["top_k"] * 2):
+            if score < params["min_similarity"]:
+                break
+            if "path" in meta:
+                chunks.append((meta["path"], meta["start"], meta["end"]))
+            elif meta["session"] == key and meta["index"] < job.conversation.context_start:
+                recalled.append(meta["index"])
+        return chunks, recalled
+
+    def _recall_block(self, conversation, indices, max_tokens):
+        """Old turns brought back in short form, as long as they fit `max_tokens`."""
+        chars = config.DEFAULT_VECTOR_PARAMS["recall_chars"]
+        header = "\n\n--- PERCAKAPAN SEBELUMNYA (mungkin relevan) ---\n"
+        footer = "--- END OF PERCAKAPAN ---\n"
+        parts = []
+        labels = []
+        used = self.count_tokens(header + footer)
+        for i in sorted(indices):
+            msg = conversation.history[i]
+            part = f"[{msg['role']}] {compact_text(msg['content'], chars)}\n"
+            n_tokens = self.count_tokens(part)
+            if used + n_tokens > max_tokens:
+                continue
+            parts.append(part)
+            labels.append(f"chat#{i}")
+            used += n_tokens
+        if not parts:
+            return "", [], 0
+        return header + "".join(parts) + footer, labels, used
+
+    def _gen_params(self, job):
+        """Model defaults + per-request sampling overrides. Returns (gen_params, grammar usage info)."""
+        gen_params = dict(self.config.gen_params)
+        for key in ("temperature", "seed"):
+            if job.options.get(key) is not None:
+                gen_params[key] = job.options[key]
+        # json_schema / grammar: compiled once per distinct source (LRU). The
+        # HTTP routes validate (= compile) first and hand the result over in
+        # "_grammar", so the compile is reported for the request that paid it.
+        validated = job.options.get("_grammar")
+        if validated is not None:
+            grammar, grammar_info = validated
+        else:
+            grammar, grammar_info = grammar_cache.get(job.options)
+            parent_info = job.options.get("_grammar_info") # Validated in the parent process
+            if parent_info is not None:
+                grammar_info = dict(
+                    parent_info,
+                    grammar_cache_hit=parent_info["grammar_cache_hit"] and grammar_info["grammar_cache_hit"],
+                    grammar_compile_ms=round(parent_info["grammar_compile_ms"] + grammar_info["grammar_compile_ms"], 2),
+                )
+        if grammar is not None:
+            gen_params["grammar"] = grammar
+            gen_params["grammar_key"] = grammar_info["grammar_key"]
+        return gen_params, grammar_info
+
+    def replay(self, cached, prompt_count):
+        """Events of a cached reply, emitted at full speed. The KV cache is untouched."""
+        chunks, usage = cached
+        for chunk in chunks:
+            yield {"type": "content", "data": chunk}
+        usage = dict(usage)
+        usage.update(
+            prompt_tokens=prompt_count,
+            total_tokens=prompt_count + usage.get("completion_tokens", 0),
+            prompt_tokens_reused=0,
+            prompt_tokens_evaluated=0,
+            prompt_eval_ms=0.0,
+            prompt_eval_tps=0.0,
+            decode_ms=0.0,
+            decode_tps=0.0,
+            cached=True,
+        )
+        yield {"type": "usage", "data": usage}
 
-    def generate_response(self, user_input, stream=False):
-        if not self.model: return "Error: Neural Core not active."
+    def decode(self, prompt_tokens, gen_params=None, trace=NULL_TRACE):
+        """
+        Low-level decode loop on top of Llama.generate().
+        Only the part of `prompt_tokens` that is not already in the context
+        (usually the last assistant reply + the new user message) is evaluated.
+        """
+        gen_params = gen_params or self.config.gen_params
+        if gen_params.get("seed") is not None:
+            self.model.set_seed(int(gen_params["seed"]))
+        stops = [s for s in gen_params.get("stop", []) if s]
+        max_tokens = gen_params.get("max_tokens", 4096)
+        max_tokens = min(max_tokens, self.model.n_ctx() - len(prompt_tokens))
 
-        # 1. Update History
-        current_message = {"role": "user", "content": user_input}
-        
-        # 2. Prepare Messages for Chat Completion
-        messages = list(self.history) # Copy existing history
-        messages.append(current_message)
-        self.history.append(current_message)
+        # Find how much of the prompt is already cached. At least one token
+        # must be evaluated so that there are fresh logits to sample from.
+        reused = common_prefix_length(self.kv_tokens, prompt_tokens)
+        reused = min(reused, len(prompt_tokens) - 1)
+        self.model.n_tokens = reused
+
+        sequence = list(prompt_tokens)
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        pending = ""
+        completion_tokens = 0
+        t_start = time.perf_counter()
+        t_first = None
+        if self.draft is not None:
+            self.draft.begin()
 
-        # 3. Generate using create_chat_completion (High-level API)
         try:
-            # Filter out parameters not supported by create_chat_completion (like 'echo')
-            gen_params = self.active_config.gen_params.copy()
-            if "echo" in gen_params:
-                del gen_params["echo"]
+            for token in self.model.generate(
+                list(prompt_tokens[reused:]),
+                reset=False,
+                temp=gen_params.get("temperature", 0.8),
+                top_p=gen_params.get("top_p", 0.95),
+                top_k=gen_params.get("top_k", 40),
+                repeat_penalty=gen_params.get("repeat_penalty", 1.0),
+                grammar=gen_params.get("grammar"),
+            ):
+                if t_first is None:
+                    t_first = time.perf_counter() # Prompt eval done, first token sampled
+                sequence.append(token)
+                if token in self.stop_ids:
+                    break
+                completion_tokens += 1
 
-            # Calculate Prompt Tokens (Estimate)
-            prompt_tokens = 0
-            try:
-                for msg in messages:
-                    if isinstance(msg['content'], str):
-                        prompt_tokens += len(self.model.tokenize(msg['content'].encode('utf-8')))
-            except:
-                pass
-
-            output = self.model.create_chat_completion(
-                messages=messages,
-                stream=stream,
-                **gen_params
-            )
-            
-            if stream:
-                # Generator wrapper to capture full response for history
-                full_response = ""
-                completion_tokens = 0
-                
-                for chunk in output:
-                    delta = chunk['choices'][0]['delta']
-                    if 'content' in delta:
-                        text_chunk = delta['content']
-                        full_response += text_chunk
-                        completion_tokens += 1 # Rough count of chunks/tokens
-                        yield {"type": "content", "data": text_chunk}
-                
-                # Append assistant response to history after streaming is done
-                self.history.append({"role": "assistant", "content": full_response})
-                
-                # Yield Usage Stats
-                # Recalculate exact output tokens
-                try:
-                    completion_tokens = len(self.model.tokenize(full_response.encode('utf-8')))
-                except:
-                    pass
-                    
-                yield {
-                    "type": "usage", 
-                    "data": {
-                        "prompt_tokens": prompt_tokens,
-                        "completion_tokens": completion_tokens,
-                        "total_tokens": prompt_tokens + completion_tokens
-                    }
-                }
-                
+                pending += decoder.decode(self.model.detokenize([token]))
+                text, hit = split_at_stop(pending, stops)
+                if text:
+                    yield {"type": "content", "data": text}
+                pending = pending[len(text):]
+                if hit:
+                    pending = ""
+                    break
+                if completion_tokens >= max_tokens:
+                    break
+
+            pending += decoder.decode(b"", final=True)
+            if pending and not any(s in pending for s in stops):
+                yield {"type": "content", "data": pending}
+        finally:
+            # Whatever llama_cpp has evaluated is now our KV cache content.
+            # With a draft, positions from the last yielded token on may hold
+            # draft tokens that were evaluated ahead but never verified.
+            n_cached = min(self.model.n_tokens, len(sequence))
+            if self.draft is not None:
+                n_cached = min(n_cached, len(sequence) - 1)
+            self.model.n_tokens = n_cached
+            self.kv_tokens = sequence[:n_cached]
+
+        # Exact counts & timings straight from the decode loop
+        t_end = time.perf_counter()
+        if t_first is None:
+            t_first = t_end
+        prompt_count = len(prompt_tokens)
+        evaluated = prompt_count - reused
+        if trace:
+            trace.complete("prompt_eval", Trace.at(t_start), Trace.at(t_first), evaluated=evaluated, reused=reused)
+            trace.complete("decode", Trace.at(t_first), Trace.at(t_end), tokens=completion_tokens)
+        prompt_eval_s = t_first - t_start
+        decode_s = t_end - t_first
+        usage = {
+            "prompt_tokens": prompt_count,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_count + completion_tokens,
+            "prompt_tokens_reused": reused,
+            "prompt_tokens_evaluated": evaluated,
+            "prompt_eval_ms": round(prompt_eval_s * 1000, 1),
+            "prompt_eval_tps": round(evaluated / prompt_eval_s, 1) if prompt_eval_s > 0 else 0.0,
+            "decode_ms": round(decode_s * 1000, 1),
+            # First token belongs to prompt eval, the rest to decoding
+            "decode_tps": round((completion_tokens - 1) / decode_s, 1) if decode_s > 0 and completion_tokens > 1 else 0.0,
+        }
+        if completion_tokens > 1 and decode_s > 0:
+            # Constrained sampling cost: ms/token against this slot's recent unconstrained decodes
+            ms_per_token = decode_s * 1000 / (completion_tokens - 1)
+            if gen_params.get("grammar") is not None:
+                usage["decode_ms_per_token"] = round(ms_per_token, 3)
+                if self.decode_ms_per_token is not None:
+                    # Estimate: same slot, but different prompts / lengths
+                    usage["grammar_overhead_ms_per_token"] = round(ms_per_token - self.decode_ms_per_token, 3)
+            elif self.decode_ms_per_token is None:
+                self.decode_ms_per_token = ms_per_token
             else:
-                text_response = output['choices'][0]['message']['content']
-                self.history.append({"role": "assistant", "content": text_response})
-                
-                # Calculate tokens
-                completion_tokens = 0
-                try:
-                    completion_tokens = len(self.model.tokenize(text_response.encode('utf-8')))
-                except:
-                    pass
-                    
-                return {
-                    "content": text_response,
-                    "usage": {
-                        "prompt_tokens": prompt_tokens,
-                        "completion_tokens": completion_tokens,
-                        "total_tokens": prompt_tokens + completion_tokens
-                    }
-                }
+                self.decode_ms_per_token += 0.2 * (ms_per_token - self.decode_ms_per_token)
+        if self.draft is not None:
+            usage.update(self.draft.stats())
+        yield {"type": "usage", "data": usage}
+
+    def _stop_token_ids(self):
+        """Stop strings that map to a single special token (e.g. <|im_end|>) + EOS."""
+        stop_ids = {self.model.token_eos()}
+        for stop in self.config.gen_params.get("stop", []):
+            try:
+                ids = self.model.tokenize(stop.encode('utf-8'), add_bos=False, special=True)
+            except Exception:
+                continue
+            if len(ids) == 1:
+                stop_ids.add(ids[0])
+        return stop_ids
+
+class Scheduler:
+    """
+    Queues jobs and dispatches them to a pool of InferenceSlots, one worker
+    thread per slot. llama_cpp releases the GIL inside decode, so slots run
+    truly in parallel, each on its own share of the CPU cores.
+    """
+    def __init__(self, model_config, n_slots=None, n_cores=None, on_progress=None):
+        params = config.DEFAULT_SCHEDULER_PARAMS
+        n_slots = config.scheduler_slots(model_config.init_params, n_slots)
+        n_cores = n_cores or params["n_cores"]
+        n_threads = max(1, n_cores // n_slots)
+
+        # Per-host tuned threads / n_batch, measured once per model (opt-in)
+        tuned = model_config.apply_tuning(n_threads)
+        if tuned is None and config.DEFAULT_TUNING_PARAMS["autotune"]:
+            try:
+                tuned = tuning.autotune(model_config, n_threads, Llama)
+                model_config.init_params.update(tuned)
+            except Exception as e:
+                print(f"Error autotuning model: {e}")
+        n_threads_batch = n_threads
+        if tuned:
+            n_threads = tuned["n_threads"]
+            n_threads_batch = tuned["n_threads_batch"]
+
+        self.config = model_config
+        self.pending = []
+        self.busy = set() # Conversation ids currently being decoded
+        self.idle_slots = set()
+        self.closed = False
+        self.cond = threading.Condition()
 
+        self.slots = []
+        for i in range(n_slots):
+            self.slots.append(InferenceSlot(i, model_config, n_threads, n_threads_batch))
+            if on_progress is not None:
+                on_progress(i + 1, n_slots)
+
+        self.workers = []
+        for slot in self.slots:
+            worker = threading.Thread(target=self._worker, args=(slot,), daemon=True)
+            worker.start()
+            self.workers.append(worker)
+
+    @property
+    def queue_depth(self):
+        with self.cond:
+            return len(self.pending)
+
+    def status(self):
+        with self.cond:
+            return {
+                "queue_depth": len(self.pending),
+                "slots": len(self.slots),
+                "busy_slots": len(self.slots) - len(self.idle_slots),
+            }
+
+    def submit(self, job):
+        job.model = self.config.filename
+        metrics.active_requests.inc()
+        with self.cond:
+            closed = self.closed
+            if not closed:
+                self.pending.append(job)
+                self.cond.notify_all()
+        if closed:
+            # Evicted between lookup and submit: no worker would ever pick it up
+            job.put({"type": "content", "data": f"Error: {self.config.filename} di-unload dari memori."})
+            job.finish()
+        return job
+
+    def close(self):
+        """Stop accepting work. Returns jobs that never started so they can be re-queued."""
+        with self.cond:
+            self.closed = True
+            leftover, self.pending = self.pending, []
+            self.cond.notify_all()
+        return leftover
+
+    def _next_job(self, slot):
+        with self.cond:
+            self.idle_slots.add(slot.index)
+            try:
+                while not self.closed:
+                    job = self._pick(slot)
+                    if job is not None:
+                        self.pending.remove(job)
+                        self.busy.add(job.conversation.id)
+                        return job
+                    self.cond.wait()
+                return None
+            finally:
+                self.idle_slots.discard(slot.index)
+
+    def _pick(self, slot):
+        # Conversations that already own an idle slot should go back to it
+        # (their KV cache is there), so leave those jobs alone.
+        owned_elsewhere = {
+            s.conversation_id for s in self.slots
+            if s is not slot and s.index in self.idle_slots
+        }
+        fallback = None
+        for job in list(self.pending):
+            if job.cancelled:
+                # Consumer disconnected while still queued
+                self.pending.remove(job)
+                job.finish()
+                continue
+            conv_id = job.conversation.id
+            if conv_id in self.busy:
+                continue
+            if conv_id == slot.conversation_id:
+                return job
+            if fallback is None and conv_id not in owned_elsewhere:
+                fallback = job
+        return fallback
+
+    def _worker(self, slot):
+        while True:
+            job = self._next_job(slot)
+            if job is None:
+                return
+            try:
+                slot.run(job)
+            finally:
+                job.finish()
+                with self.cond:
+                    self.busy.discard(job.conversation.id)
+                    self.cond.notify_all()
+
+class ModelPool:
+    """
+    Keeps up to `max_models` models warm (each one is a Scheduler with its
+    slots) under a RAM budget, evicting the least recently used. Loading runs
+    in a background thread; status() reports per-model progress.
+    """
+    def __init__(self, max_models=None, ram_budget=None):
+        params = config.DEFAULT_POOL_PARAMS
+        self.max_models = max_models or params["max_models"]
+        self.ram_budget = ram_budget or int(params["ram_budget_gb"] * 1024**3)
+        self.kv_bytes_per_token = params["kv_bytes_per_token"]
+        self.entries = OrderedDict() # filename -> Scheduler (LRU order)
+        self.state = {} # filename -> {"state", "progress", "started_at", ...}
+        self.ready_events = {}
+        self.core_groups = {} # filename -> core group (out-of-process workers)
+        self.lock = threading.Lock()
+
+    def get(self, filename):
+        with self.lock:
+            scheduler = self.entries.get(filename)
+            if scheduler is not None:
+                self.entries.move_to_end(filename)
+            return scheduler
+
+    def preload(self, filename, protect=(), on_ready=None):
+        """
+        Start loading `filename` in the background (no-op if warm or already
+        loading). Models named in `protect` are never evicted to make room;
+        pass a callable to have it read at eviction time instead of now.
+        Returns a threading.Event that is set once the load ends.
+        """
+        with self.lock:
+            if filename in self.entries:
+                event = threading.Event()
+                event.set()
+                return event
+            if filename in self.ready_events:
+                return self.ready_events[filename]
+
+            event = threading.Event()
+            self.ready_events[filename] = event
+            self.state[filename] = {"state": "loading", "progress": 0.0, "started_at": time.time()}
+
+        thread = threading.Thread(
+            target=self._load, args=(filename, protect, on_ready, event), daemon=True
+        )
+        thread.start()
+        return event
+
+    def status(self):
+        with self.lock:
+            models = {}
+            for filename, info in self.state.items():
+                info = dict(info)
+                info["elapsed"] = round(info.pop("finished_at", time.time()) - info.pop("started_at"), 2)
+                models[filename] = info
+            return {
+                "warm": list(self.entries),
+                "max_models": self.max_models,
+                "ram_budget": self.ram_budget,
+                "models": models,
+            }
+
+    def idle(self):
+        """True when no warm model has queued or running jobs."""
+        with self.lock:
+            schedulers = list(self.entries.values())
+        for scheduler in schedulers:
+            status = scheduler.status()
+            if status["queue_depth"] or status["busy_slots"]:
+                return False
+        return True
+
+    def estimate_bytes(self, model_config):
+        """Weights (shared by all slots via mmap) + one KV cache per slot that will be started."""
+        try:
+            weights = os.path.getsize(model_config.path)
+        except OSError:
+            weights = 0
+        n_slots = config.scheduler_slots(model_config.init_params)
+        if model_config.meta and model_config.meta["kv_bytes_per_token"]:
+            # Exact per-model KV size from the GGUF header
+            return estimate_ram(model_config.meta, model_config.init_params["n_ctx"], n_slots)
+        return weights + n_slots * model_config.init_params["n_ctx"] * self.kv_bytes_per_token
+
+    def _load(self, filename, protect, on_ready, event):
+        def on_progress(done, total):
+            with self.lock:
+                self.state[filename]["progress"] = round(done / total, 2)
+
+        started = time.perf_counter()
+        try:
+            model_config = ModelConfig(filename)
+            self._make_room(self.estimate_bytes(model_config), protect)
+            scheduler = self._new_scheduler(model_config, on_progress)
         except Exception as e:
-            error_msg = f"Runtime Logic Error: {str(e)}"
+            print(f"Error loading model: {e}")
+            metrics.model_load_seconds.observe(time.perf_counter() - started, filename, "error")
+            with self.lock:
+                self.state[filename].update(state="error", error=str(e), finished_at=time.time())
+                del self.ready_events[filename]
+                self.core_groups.pop(filename, None)
+            event.set()
+            return
+
+        metrics.model_load_seconds.observe(time.perf_counter() - started, filename, "ok")
+        with self.lock:
+            self.entries[filename] = scheduler
+            self.state[filename].update(state="ready", progress=1.0, finished_at=time.time())
+            del self.ready_events[filename]
+        if on_ready is not None:
+            on_ready(filename, scheduler)
+        event.set()
+
+    def _new_scheduler(self, model_config, on_progress):
+        params = config.DEFAULT_SCHEDULER_PARAMS
+        if not params["out_of_process"]:
+            return Scheduler(model_config, on_progress=on_progress)
+
+        # One worker process per model, each pinned to its own slice of cores
+        share = max(1, params["n_cores"] // self.max_models)
+        with self.lock:
+            group = 0
+            while group in self.core_groups.values():
+                group += 1
+            self.core_groups[model_config.filename] = group
+        n_cpus = os.cpu_count() or share
+        cores = [c % n_cpus for c in range(group * share, (group + 1) * share)]
+        return ProcessScheduler(model_config, n_cores=share, on_progress=on_progress, cores=cores)
+
+    def _make_room(self, needed, protect):
+        """Evict LRU models until the new one fits the count and RAM budgets."""
+        evicted = []
+        if callable(protect):
+            protect = protect() # Current value, not the one from when the load started
+        with self.lock:
+            for filename in list(self.entries):
+                used = sum(self.estimate_bytes(s.config) for s in self.entries.values())
+                if len(self.entries) < self.max_models and used + needed <= self.ram_budget:
+                    break
+                if filename in protect:
+                    continue
+                evicted.append((filename, self.entries.pop(filename)))
+                self.state.pop(filename, None)
+                self.core_groups.pop(filename, None)
+
+        for filename, scheduler in evicted:
+            leftover = scheduler.close()
+            for job in leftover:
+                job.put({"type": "content", "data": f"Error: {filename} di-unload dari memori."})
+                job.finish()
+        if evicted:
+            gc.collect()
+
+class AIEngine:
+    def __init__(self):
+        self.active_model = None
+        self.target_model = None # Model requested by the last switch_model()
+        self.pool = ModelPool()
+        self.sessions = SessionStore()
+        atexit.register(self.sessions.flush)
+        self.vectors = vector_index
+        self.started_at = time.time()
+        self.switch_started = {} # filename -> perf_counter() of the switch request
+        metrics.registry.add_collector(self._collect_metrics)
+        # Nothing is loaded here: importing backend.core must stay cheap so the
+        # server socket is up right away. start() loads in the background.
+
+    def start(self, wait=False):
+        """
+        Begin loading the first available model (no-op once started).
+        Returns switch_model()'s state, or "error" if there are no models.
+        """
+        if self.target_model is None:
+            available_models = config.get_available_models()
+            if not available_models:
+                print("Error: No models found.")
+                return "error"
+            # Semantic index: embeds in the background, only while chat is idle
+            self.vectors.start(idle_check=self.pool.idle)
+            return self.switch_model(available_models[0], wait=wait)
+        if wait and self.active_model is None:
+            return self.switch_model(self.target_model, wait=True)
+        return "ready" if self.active_model is not None else "loading"
+
+    @property
+    def scheduler(self):
+        if self.active_model is None:
+            return None
+        return self.pool.get(self.active_model)
+
+    @property
+    def active_config(self):
+        scheduler = self.scheduler
+        return scheduler.config if scheduler is not None else None
+
+    @property
+    def history(self):
+        return self.sessions.get(DEFAULT_SESSION).history
+
+    def switch_model(self, model_filename, wait=False):
+        """
+        Switch the active model to the specified filename.
+        Warm models switch instantly; cold ones load in the background and
+        become active once ready (the previous model keeps serving meanwhile).
+        Returns "ready", "loading" or "error".
+        """
+        self.target_model = model_filename
+        if self.pool.get(model_filename) is not None:
+            self.active_model = model_filename
+            metrics.model_switch_seconds.observe(0.0, model_filename) # Warm: instant
+            return "ready"
+        self.switch_started.setdefault(model_filename, time.perf_counter())
+
+        event = self.pool.preload(
+            model_filename,
+            protect=lambda: {self.active_model}, # Read when room is made (may change during the load)
+            on_ready=self._on_model_ready,
+        )
+        if not wait:
+            return "loading"
+        event.wait()
+        return "ready" if self.active_model == model_filename else "error"
+
+    def _on_model_ready(self, filename, scheduler):
+        # Only activate if nobody asked for another model in the meantime
+        started = self.switch_started.pop(filename, None)
+        if self.target_model == filename:
+            self.active_model = filename
+            if started is not None:
+                metrics.model_switch_seconds.observe(time.perf_counter() - started, filename)
+        if scheduler.config.auto_retrieve:
+            project_index.refresh_async() # Warm the index before the first message
+
+    def readiness(self):
+        """Startup state for /ready: ready once a model can take requests."""
+        info = self.pool.status()["models"].get(self.target_model, {})
+        if self.active_model is not None:
+            state = "ready"
+        elif self.target_model is None:
+            state = "starting" if config.get_available_models() else "no_models"
+        else:
+            state = info.get("state", "loading")
+        return {
+            "ready": self.active_model is not None,
+            "state": state,
+            "model": self.active_model or self.target_model,
+            "progress": 1.0 if self.active_model is not None else info.get("progress", 0.0),
+            "error": info.get("error"),
+            "uptime": round(time.time() - self.started_at, 2),
+        }
+
+    def _collect_metrics(self):
+        """Scrape-time gauges: scheduler state, memory, cache counters."""
+        queue_depth, busy, slots, rss = [], [], [], [({"process": "main"}, metrics.rss_bytes())]
+        for filename in self.pool.status()["warm"]:
+            scheduler = self.pool.get(filename)
+            if scheduler is None:
+                continue
+            status = scheduler.status()
+            queue_depth.append(({"model": filename}, status["queue_depth"]))
+            busy.append(({"model": filename}, status["busy_slots"]))
+            slots.append(({"model": filename}, status["slots"]))
+            if "pid" in status:
+                rss.append(({"process": f"worker:{filename}"}, metrics.rss_bytes(status["pid"])))
+        cache = response_cache.stats
+        return [
+            ("lumino_model_ready", "1 once a model can take requests", "gauge", [({}, int(self.active_model is not None))]),
+            ("lumino_scheduler_queue_depth", "Jobs waiting for a slot", "gauge", queue_depth),
+            ("lumino_scheduler_busy_slots", "Slots decoding right now", "gauge", busy),
+            ("lumino_scheduler_slots", "Slots per warm model", "gauge", slots),
+            ("lumino_process_resident_memory_bytes", "Resident memory of the server and its worker processes", "gauge", rss),
+            ("lumino_sessions_resident", "Conversations held in RAM", "gauge", [({}, self.sessions.status()["resident"])]),
+            ("lumino_response_cache_hits_total", "Replies served from the response cache", "counter", [({}, cache["hits"])]),
+            ("lumino_response_cache_misses_total", "Cacheable requests that had to decode", "counter", [({}, cache["misses"])]),
+        ]
+
+    def model_status(self):
+        status = self.pool.status()
+        status["active"] = self.active_model
+        status["target"] = self.target_model
+        return status
+
+    def submit(self, user_input, session_id=None, events=None, options=None, trace=None):
+        """Queue a chat turn. Returns the Job, or None if no model is active."""
+        scheduler = self.scheduler
+        if scheduler is None:
+            return None
+        conversation = self.sessions.acquire(session_id or DEFAULT_SESSION)
+        job = Job(conversation, user_input, on_finish=self._finish_job, events=events, options=options, trace=trace)
+        return scheduler.submit(job)
+
+    def _finish_job(self, conversation):
+        self.vectors.add_conversation(conversation)
+        self.sessions.release(conversation)
+
+    def generate_response(self, user_input, stream=False, session_id=None, options=None, trace=NULL_TRACE, poll=None):
+        with trace.span("submit"):
+            job = self.submit(user_input, session_id, options=options, trace=trace)
+        if job is None:
             if stream:
-                yield {"type": "content", "data": error_msg}
-            else:
-                return {"content": error_msg}
+                return iter([{"type": "content", "data": "Error: Neural Core not active."}])
+            return "Error: Neural Core not active."
+
+        if stream:
+            return job.stream(poll)
+
+        # Non-streaming: drain the same event stream and collect the result
+        text_response = ""
+        usage = None
+        files_read = []
+        context = []
+        with trace.span("collect"):
+            for event in job.stream():
+                if event["type"] == "content":
+                    text_response += event["data"]
+                elif event["type"] == "usage":
+                    usage = event["data"]
+                elif event["type"] == "info":
+                    files_read = event["files"]
+                    context = event.get("context", [])
+        return {"content": text_response, "usage": usage, "files_read": files_read, "context": context}
+
+# Per-request fields of a /chat body that end up in Job.options
+REQUEST_OPTIONS = ("retrieve", "temperature", "seed", "trace", "profile", "json_schema", "grammar")
+
+def request_options(data):
+    return {key: data[key] for key in REQUEST_OPTIONS if data.get(key) is not None}
+
+def common_prefix_length(a, b):
+    """Number of leading tokens shared by two token sequences."""
+    n = 0
+    for x, y in zip(a, b):
+        if x != y:
+            break
+        n += 1
+    return n
+
+def split_at_stop(text, stops):
+    """
+    Returns (safe_text, stopped).
+    safe_text is the part of `text` that can be emitted: everything before a
+    complete stop string, minus any tail that could still become one.
+    """
+    for stop in stops:
+        idx = text.find(stop)
+        if idx != -1:
+            return text[:idx], True
+
+    hold = 0
+    for stop in stops:
+        for k in range(min(len(stop) - 1, len(text)), hold, -1):
+            if text.endswith(stop[:k]):
+                hold = k
+                break
+    return text[:len(text) - hold], False
 
-engine = AIEngine()
\ No newline at end of file
+# Worker processes (backend/workers.py) only need the classes above
+engine = AIEngine() if os.environ.get("LUMINO_WORKER") != "1" else None
\ No newline at end of file
@@ -0,0 +1,158 @@
+"""
+Speculative decoding for llama_cpp's `draft_model` hook.
+
+Llama.generate() calls draft_model(input_ids) after every verified step and
+evaluates the proposed tokens in the same forward pass; the ones the model
+agrees with are accepted for free. Two draft sources:
+
+  - PromptLookupDraft: n-gram lookup in the prompt itself (no extra model),
+    great when the answer copies code from the context.
+  - ModelDraft: greedy tokens from a small GGUF with the same vocabulary.
+
+DraftTracker wraps either one, measures the acceptance rate and switches
+drafting off for a few requests when it does not pay for itself.
+"""
+import numpy as np
+
+from backend import config
+
+NO_DRAFT = np.array([], dtype=np.intc)
+
+def _common_prefix(a, b):
+    n = min(len(a), len(b))
+    if n == 0:
+        return 0
+    mismatch = np.nonzero(np.asarray(a[:n]) != np.asarray(b[:n]))[0]
+    return int(mismatch[0]) if len(mismatch) else n
+
+class PromptLookupDraft:
+    """Propose what followed the most recent earlier occurrence of the last n tokens."""
+    def __init__(self, max_ngram_size=3, num_pred_tokens=10):
+        self.max_ngram_size = max_ngram_size
+        self.num_pred_tokens = num_pred_tokens
+
+    def __call__(self, input_ids):
+        length = len(input_ids)
+        for ngram_size in range(min(self.max_ngram_size, length - 1), 0, -1):
+            windows = np.lib.stride_tricks.sliding_window_view(input_ids, ngram_size)
+            # Last window is the n-gram itself
+            matches = np.nonzero(np.all(windows[:-1] == input_ids[-ngram_size:], axis=1))[0]
+            if len(matches):
+                start = int(matches[-1]) + ngram_size
+                return np.asarray(input_ids[start:start + self.num_pred_tokens], dtype=np.intc)
+        return NO_DRAFT
+
+class ModelDraft:
+    """Greedy draft from a small Llama; keeps its own KV cache and reuses the common prefix."""
+    def __init__(self, model, num_pred_tokens=4):
+        self.model = model
+        self.num_pred_tokens = num_pred_tokens
+        self.tokens = [] # Tokens currently evaluated in the draft context
+
+    def __call__(self, input_ids):
+        model = self.model
+        ids = [int(t) for t in input_ids]
+        if len(ids) + self.num_pred_tokens >= model.n_ctx():
+            return NO_DRAFT
+
+        reused = min(_common_prefix(self.tokens, ids), len(ids) - 1)
+        model.n_tokens = reused
+        model.eval(ids[reused:])
+        drafted = []
+        for i in range(self.num_pred_tokens):
+            # Greedy pick straight from the context's logits: model.scores only
+            # holds them with logits_all=True (n_ctx x n_vocab floats)
+            token = int(model.sample(temp=0.0, repeat_penalty=1.0))
+            drafted.append(token)
+            if i + 1 < self.num_pred_tokens:
+                model.eval([token])
+        self.tokens = ids + drafted[:-1]
+        return np.asarray(drafted, dtype=np.intc)
+
+class DraftTracker:
+    """
+    Counts drafted vs accepted tokens. Acceptance is inferred from how far
+    input_ids advanced between two calls: one sampled token + the accepted
+    part of the previous draft.
+    """
+    def __init__(self, source, strategy, params):
+        self.source = source
+        self.strategy = strategy
+        self.min_acceptance = params["min_acceptance"]
+        self.window = params["window"]
+        self.cooldown = params["cooldown"]
+        self.enabled = True
+        self.paused_for = 0 # Requests left before drafting is retried
+        self.window_drafted = 0
+        self.window_accepted = 0
+        self.begin()
+
+    def begin(self):
+        """Reset per-request counters (call before each generate())."""
+        self.drafted = 0
+        self.accepted = 0
+        self.last_len = None
+        self.last_draft = 0
+        if not self.enabled:
+            self.paused_for -= 1
+            if self.paused_for <= 0:
+                self.enabled = True
+
+    def __call__(self, input_ids, **kwargs):
+        length = len(input_ids)
+        if self.last_len is not None and self.last_draft:
+            self._account(min(max(0, length - self.last_len - 1), self.last_draft))
+        self.last_len = length
+        self.last_draft = 0
+        if not self.enabled:
+            return NO_DRAFT
+        draft = self.source(input_ids)
+        self.last_draft = len(draft)
+        return draft
+
+    def _account(self, accepted):
+        self.drafted += self.last_draft
+        self.accepted += accepted
+        self.window_drafted += self.last_draft
+        self.window_accepted += accepted
+        if self.window_drafted >= self.window:
+            rate = self.window_accepted / self.window_drafted
+            if rate < self.min_acceptance:
+                # Rejected drafts cost extra eval work: plain decoding for a while
+                self.enabled = False
+                self.paused_for = self.cooldown
+            self.window_drafted = 0
+            self.window_accepted = 0
+
+    def stats(self):
+        return {
+            "draft_strategy": self.strategy,
+            "draft_active": self.enabled,
+            "draft_tokens": self.drafted,
+            "draft_accepted": self.accepted,
+            "draft_acceptance": round(self.accepted / self.drafted, 3) if self.drafted else 0.0,
+        }
+
+def make_draft(model_config, model, llama_class, n_threads):
+    """DraftTracker for `model` as configured in model_config.draft_params, or None."""
+    params = model_config.draft_params
+    strategy = params["strategy"]
+    if strategy == "prompt_lookup":
+        source = PromptLookupDraft(params["max_ngram_size"], params["num_pred_tokens"])
+    elif strategy == "model" and params["model"]:
+        draft_model = llama_class(
+            model_path=str(config.MODELS_DIR / params["model"]),
+            n_ctx=model_config.init_params["n_ctx"],
+            n_batch=model_config.init_params["n_batch"],
+            n_threads=n_threads,
+            n_threads_batch=n_threads,
+            n_gpu_layers=model_config.init_params.get("n_gpu_layers", 0),
+            verbose=False,
+        )
+        if draft_model.n_vocab() != model.n_vocab():
+            print(f"Error: draft model {params['model']} has a different vocabulary, drafting off")
+            return None
+        source = ModelDraft(draft_model, params["num_pred_tokens"])
+    else:
+        return None
+    return DraftTracker(source, strategy, params)
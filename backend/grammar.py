@@ -0,0 +1,93 @@
+"""
+Constrained decoding for /chat: "json_schema" (a JSON Schema object) or
+"grammar" (GBNF text) becomes a llama_cpp LlamaGrammar.
+
+Converting a schema to GBNF and parsing it is pure Python and not free, so
+compiled grammars are kept in an LRU keyed by the hash of the canonical
+source. A LlamaGrammar only holds the parsed rules (the sampler is built per
+generate() call), so one compiled grammar is shared by all slots.
+"""
+import json
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+
+from backend import config
+if config.USE_FAKE_LLAMA:
+    from benchmarks.fake_llama import FakeGrammar as LlamaGrammar
+else:
+    from llama_cpp import LlamaGrammar
+
+class GrammarError(ValueError):
+    pass
+
+def grammar_source(options):
+    """(kind, canonical text) of the request's grammar, or None."""
+    schema = options.get("json_schema")
+    if schema is not None:
+        if isinstance(schema, str):
+            try:
+                schema = json.loads(schema)
+            except json.JSONDecodeError as e:
+                raise GrammarError(f"json_schema is not valid JSON: {e}")
+        return "json_schema", json.dumps(schema, sort_keys=True, separators=(",", ":"))
+    grammar = options.get("grammar")
+    if grammar:
+        return "gbnf", grammar
+    return None
+
+class GrammarCache:
+    def __init__(self, max_entries=None):
+        self.max_entries = max_entries or config.DEFAULT_GRAMMAR_PARAMS["cache_size"]
+        self.entries = OrderedDict() # key -> LlamaGrammar (LRU order)
+        self.lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0, "compile_ms": 0.0}
+
+    @staticmethod
+    def key(kind, text):
+        return hashlib.sha256(f"{kind}\0{text}".encode('utf-8')).hexdigest()[:16]
+
+    def get(self, options):
+        """
+        Compiled grammar for `options`, or (None, {}) without one.
+        Returns (grammar, info) where info goes into the usage stats.
+        Raises GrammarError for schemas / grammars that do not compile.
+        """
+        source = grammar_source(options)
+        if source is None:
+            return None, {}
+        kind, text = source
+        key = self.key(kind, text)
+        with self.lock:
+            grammar = self.entries.get(key)
+            if grammar is not None:
+                self.entries.move_to_end(key)
+                self.stats["hits"] += 1
+                return grammar, {"grammar": kind, "grammar_key": key, "grammar_cache_hit": True, "grammar_compile_ms": 0.0}
+
+        # Compile outside the lock: other schemas don't wait for this one
+        start = time.perf_counter()
+        try:
+            if kind == "json_schema":
+                grammar = LlamaGrammar.from_json_schema(text, verbose=False)
+            else:
+                grammar = LlamaGrammar.from_string(text, verbose=False)
+        except Exception as e:
+            raise GrammarError(f"Grammar gagal di-compile: {e}")
+        compile_ms = (time.perf_counter() - start) * 1000
+
+        with self.lock:
+            self.stats["misses"] += 1
+            self.stats["compile_ms"] += compile_ms
+            self.entries[key] = grammar
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.stats["evictions"] += 1
+        return grammar, {"grammar": kind, "grammar_key": key, "grammar_cache_hit": False, "grammar_compile_ms": round(compile_ms, 2)}
+
+    def status(self):
+        with self.lock:
+            return {"entries": len(self.entries), "max_entries": self.max_entries, **self.stats}
+
+grammar_cache = GrammarCache()
@@ -0,0 +1,253 @@
+import os
+import re
+import json
+import math
+import zlib
+import time
+import threading
+from collections import Counter, defaultdict
+
+from backend import config
+from backend.utils import file_cache
+
+WORD_PATTERN = re.compile(r"[A-Za-z_][A-Za-z0-9_]*|\d+")
+
+CONTEXT_HEADER = "\n\n--- KONTEKS PROJEK (otomatis, mungkin relevan) ---\n"
+CONTEXT_FOOTER = "--- END OF KONTEKS ---\n"
+
+def tokenize_terms(text):
+    """Kata + pecahan snake_case/camelCase, lowercase (untuk BM25, bukan token model)."""
+    terms = []
+    for word in WORD_PATTERN.findall(text):
+        lower = word.lower()
+        terms.append(lower)
+        parts = [p for p in re.split(r"_|(?<=[a-z0-9])(?=[A-Z])", word) if p]
+        if len(parts) > 1:
+            terms.extend(p.lower() for p in parts)
+    return terms
+
+class LexicalIndex:
+    """
+    Inverted index BM25 atas file-file di PROJECT_DIR, dipecah per blok baris.
+
+    refresh() hanya memproses file yang mtime/size-nya berubah (atau hilang),
+    jadi update-nya incremental. Index disimpan ke disk (zlib + JSON) agar
+    restart tidak perlu membangun ulang. Teks chunk tidak disimpan di index;
+    diambil dari file saat dibutuhkan.
+    """
+    def __init__(self, root=None, path=None, params=None):
+        self.params = params or config.DEFAULT_INDEX_PARAMS
+        self.root = str(root or config.PROJECT_DIR)
+        self.path = path or config.INDEX_DIR / "lexical.json.z"
+        self.files = {} # rel_path -> {"mtime_ns", "size", "chunks": [chunk_id]}
+        self.chunks = {} # chunk_id -> [rel_path, start_line, end_line, length, {term: tf}]
+        self.postings = defaultdict(dict) # term -> {chunk_id: tf}
+        self.total_length = 0
+        self.next_id = 0
+        self.last_scan = 0.0
+        self.lock = threading.RLock()
+        self.refreshing = False
+        self.loaded = False
+
+    # --- Persistence -------------------------------------------------------
+    def load(self):
+        with self.lock:
+            self.loaded = True
+            if not self.path.exists():
+                return False
+            try:
+                with open(self.path, 'rb') as f:
+                    data = json.loads(zlib.decompress(f.read()).decode('utf-8'))
+            except Exception as e:
+                print(f"Error loading index: {e}")
+                return False
+            self.files = data["files"]
+            self.next_id = data["next_id"]
+            self.chunks = {}
+            self.postings = defaultdict(dict)
+            self.total_length = 0
+            for chunk_id, chunk in data["chunks"].items():
+                self._add_chunk(int(chunk_id), chunk)
+            return True
+
+    def save(self):
+        with self.lock:
+            payload = json.dumps({
+                "files": self.files,
+                "chunks": self.chunks,
+                "next_id": self.next_id,
+            })
+        os.makedirs(self.path.parent, exist_ok=True)
+        tmp_path = self.path.with_suffix(f".{os.getpid()}.tmp") # Worker processes save too
+        with open(tmp_path, 'wb') as f:
+            f.write(zlib.compress(payload.encode('utf-8')))
+        os.replace(tmp_path, self.path)
+
+    # --- Incremental update ------------------------------------------------
+    def _walk(self):
+        skip_dirs = set(self.params["skip_dirs"])
+        extensions = set(self.params["extensions"])
+        max_size = self.params["max_file_bytes"]
+        for dirpath, dirnames, filenames in os.walk(self.root):
+            dirnames[:] = [d for d in dirnames if d not in skip_dirs and not d.startswith('.')]
+            for filename in filenames:
+                if os.path.splitext(filename)[1].lower() not in extensions:
+                    continue
+                full_path = os.path.join(dirpath, filename)
+                try:
+                    stat = os.stat(full_path)
+                except OSError:
+                    continue
+                if stat.st_size <= max_size:
+                    yield os.path.relpath(full_path, self.root).replace(os.sep, "/"), stat
+
+    def refresh(self):
+        """mtime scan: re-index changed files, drop deleted ones. Returns jumlah file berubah."""
+        seen = set()
+        changed = 0
+        for rel_path, stat in self._walk():
+            seen.add(rel_path)
+            known = self.files.get(rel_path)
+            if known and known["mtime_ns"] == stat.st_mtime_ns and known["size"] == stat.st_size:
+                continue
+            try:
+                with open(os.path.join(self.root, rel_path), 'r', encoding='utf-8') as f:
+                    lines = f.read().splitlines()
+            except (OSError, UnicodeDecodeError):
+                continue
+            with self.lock:
+                self._remove_file(rel_path)
+                self._add_file(rel_path, stat, lines)
+            changed += 1
+
+        with self.lock:
+            for rel_path in [p for p in self.files if p not in seen]:
+                self._remove_file(rel_path)
+                changed += 1
+            self.last_scan = time.time()
+
+        if changed:
+            self.save()
+        return changed
+
+    def refresh_async(self):
+        """Jalankan refresh() di background kalau scan terakhir sudah basi."""
+        with self.lock:
+            if not self.loaded:
+                self.load()
+            stale = time.time() - self.last_scan > self.params["rescan_interval"]
+            if not stale or self.refreshing:
+                return
+            self.refreshing = True
+
+        def run():
+            try:
+                self.refresh()
+            except Exception as e:
+                print(f"Error refreshing index: {e}")
+            finally:
+                self.refreshing = False
+
+        threading.Thread(target=run, daemon=True).start()
+
+    def _add_file(self, rel_path, stat, lines):
+        chunk_lines = self.params["chunk_lines"]
+        chunk_ids = []
+        for start in range(0, len(lines), chunk_lines):
+            terms = tokenize_terms("\n".join(lines[start:start + chunk_lines]))
+            if not terms:
+                continue
+            chunk_id = self.next_id
+            self.next_id += 1
+            end = min(start + chunk_lines, len(lines))
+            self._add_chunk(chunk_id, [rel_path, start + 1, end, len(terms), dict(Counter(terms))])
+            chunk_ids.append(chunk_id)
+        self.files[rel_path] = {"mtime_ns": stat.st_mtime_ns, "size": stat.st_size, "chunks": chunk_ids}
+
+    def _add_chunk(self, chunk_id, chunk):
+        self.chunks[chunk_id] = chunk
+        self.total_length += chunk[3]
+        for term, tf in chunk[4].items():
+            self.postings[term][chunk_id] = tf
+
+    def _remove_file(self, rel_path):
+        info = self.files.pop(rel_path, None)
+        if not info:
+            return
+        for chunk_id in info["chunks"]:
+            chunk = self.chunks.pop(chunk_id, None)
+            if chunk is None:
+                continue
+            self.total_length -= chunk[3]
+            for term in chunk[4]:
+                posting = self.postings.get(term)
+                if posting is not None:
+                    posting.pop(chunk_id, None)
+                    if not posting:
+                        del self.postings[term]
+
+    # --- Query -------------------------------------------------------------
+    def search(self, query, top_k=None):
+        """BM25 top-k. Returns [(score, rel_path, start_line, end_line)]."""
+        top_k = top_k or self.params["top_k"]
+        k1, b = self.params["bm25_k1"], self.params["bm25_b"]
+        with self.lock:
+            n_docs = len(self.chunks)
+            if not n_docs:
+                return []
+            avgdl = self.total_length / n_docs
+            scores = defaultdict(float)
+            for term in set(tokenize_terms(query)):
+                posting = self.postings.get(term)
+                if not posting:
+                    continue
+                idf = math.log(1 + (n_docs - len(posting) + 0.5) / (len(posting) + 0.5))
+                for chunk_id, tf in posting.items():
+                    length = self.chunks[chunk_id][3]
+                    scores[chunk_id] += idf * tf * (k1 + 1) / (tf + k1 * (1 - b + b * length / avgdl))
+
+            best = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:top_k]
+            return [(score, *self.chunks[chunk_id][:3]) for chunk_id, score in best]
+
+    def build_context(self, query, count_tokens, max_tokens, semantic=None):
+        """
+        Blok konteks dari chunk paling relevan, muat di `max_tokens`.
+        `semantic` = hasil vector search [(rel_path, start, end)], digabung dengan BM25.
+        Returns (block, labels, n_tokens); block kosong kalau tidak ada yang cocok.
+        """
+        candidates = [hit[1:] for hit in self.search(query) if hit[0] >= self.params["min_score"]]
+        if semantic:
+            candidates = fuse_rankings([candidates, semantic])
+
+        parts = []
+        labels = []
+        used = 0
+        for rel_path, start, end in candidates:
+            try:
+                entry = file_cache.get(os.path.join(self.root, rel_path))
+                content, _ = file_cache.read_window(entry, (start, end))
+            except (OSError, UnicodeDecodeError):
+                continue # File hilang/berubah sejak di-index; scan berikutnya membereskan
+            label = f"{rel_path}:{start}-{end}"
+            part = f"[{label}]\n```{rel_path.split('.')[-1]}\n{content.rstrip()}\n```\n"
+            n_tokens = count_tokens(part)
+            if used + n_tokens > max_tokens:
+                continue
+            parts.append(part)
+            labels.append(label)
+            used += n_tokens
+
+        if not parts:
+            return "", [], 0
+        used += count_tokens(CONTEXT_HEADER + CONTEXT_FOOTER)
+        return CONTEXT_HEADER + "".join(parts) + CONTEXT_FOOTER, labels, used
+
+def fuse_rankings(rankings, k=60):
+    """Reciprocal rank fusion of several ranked lists of (rel_path, start, end)."""
+    scores = defaultdict(float)
+    for ranking in rankings:
+        for rank, item in enumerate(ranking):
+            scores[tuple(item)] += 1.0 / (k + rank + 1)
+    return sorted(scores, key=scores.get, reverse=True)
+
+project_index = LexicalIndex()
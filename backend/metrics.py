@@ -0,0 +1,193 @@
+"""
+Minimal Prometheus metrics (text exposition format 0.0.4), no dependencies.
+
+Everything is recorded once per request or per model load, never per token:
+Job.put() only checks the event type, the numbers come from the usage dict
+the decode loop builds anyway. Gauges that describe current state (queue
+depth, RSS, cache counters) are read by collectors at scrape time.
+"""
+import sys
+import threading
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+TPS_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+LOAD_BUCKETS = (0.1, 0.5, 1, 2, 5, 10, 20, 30, 60, 120, 300)
+
+def _format_labels(names, values):
+    if not names:
+        return ""
+    pairs = []
+    for name, value in zip(names, values):
+        value = str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+        pairs.append(f'{name}="{value}"')
+    return "{" + ",".join(pairs) + "}"
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help = help_text
+        self.labels = labels
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1, *label_values):
+        with self.lock:
+            self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def samples(self):
+        with self.lock:
+            return [(self.name, _format_labels(self.labels, k), v) for k, v in self.values.items()]
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, value, *label_values):
+        with self.lock:
+            self.values[label_values] = value
+
+    def dec(self, amount=1, *label_values):
+        self.inc(-amount, *label_values)
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labels = labels
+        self.buckets = tuple(buckets)
+        self.values = {} # label values -> [bucket counts..., sum, count]
+        self.lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        with self.lock:
+            state = self.values.get(label_values)
+            if state is None:
+                state = self.values[label_values] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[i] += 1
+                    break
+            state[-2] += value
+            state[-1] += 1
+
+    def samples(self):
+        out = []
+        with self.lock:
+            items = [(k, list(v)) for k, v in self.values.items()]
+        for label_values, state in items:
+            cumulative = 0
+            for bound, n in zip(self.buckets, state):
+                cumulative += n
+                labels = _format_labels(self.labels + ("le",), label_values + (_format_value(bound),))
+                out.append((f"{self.name}_bucket", labels, cumulative))
+            labels = _format_labels(self.labels + ("le",), label_values + ("+Inf",))
+            out.append((f"{self.name}_bucket", labels, state[-1]))
+            plain = _format_labels(self.labels, label_values)
+            out.append((f"{self.name}_sum", plain, state[-2]))
+            out.append((f"{self.name}_count", plain, state[-1]))
+        return out
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+        self.collectors = [] # Callables returning [(name, help, kind, [(labels dict, value)])]
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, help_text, labels=()):
+        return self.register(Counter(name, help_text, labels))
+
+    def gauge(self, name, help_text, labels=()):
+        return self.register(Gauge(name, help_text, labels))
+
+    def histogram(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        return self.register(Histogram(name, help_text, labels, buckets))
+
+    def add_collector(self, collector):
+        self.collectors.append(collector)
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{labels} {_format_value(value)}")
+        for collector in self.collectors:
+            try:
+                families = collector()
+            except Exception as e:
+                print(f"Error collecting metrics: {e}")
+                continue
+            for name, help_text, kind, samples in families:
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {kind}")
+                for labels, value in samples:
+                    lines.append(f"{name}{_format_labels(tuple(labels), tuple(labels.values()))} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+def rss_bytes(pid=None):
+    """Resident set size (Linux /proc; peak RSS of this process elsewhere)."""
+    try:
+        with open(f"/proc/{pid or 'self'}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    if pid is None:
+        try:
+            import resource
+            peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            return peak if sys.platform == 'darwin' else peak * 1024
+        except ImportError:
+            pass
+    return 0
+
+# ==================================================
+# SERVING METRICS
+# ==================================================
+registry = Registry()
+
+requests_total = registry.counter("lumino_requests_total", "Finished chat requests", ("model", "status"))
+active_requests = registry.gauge("lumino_active_requests", "Requests submitted and not finished yet (queued or streaming)")
+queue_seconds = registry.histogram("lumino_queue_wait_seconds", "Time from submit to the start of processing", ("model",))
+ttft_seconds = registry.histogram("lumino_ttft_seconds", "Time from submit to the first generated token", ("model",))
+prompt_tps = registry.histogram("lumino_prompt_eval_tokens_per_second", "Prompt evaluation speed", ("model",), TPS_BUCKETS)
+decode_tps = registry.histogram("lumino_decode_tokens_per_second", "Decode speed", ("model",), TPS_BUCKETS)
+prompt_tokens = registry.counter("lumino_prompt_tokens_total", "Prompt tokens by how they were served", ("model", "kind"))
+generated_tokens = registry.counter("lumino_generated_tokens_total", "Completion tokens generated", ("model",))
+model_load_seconds = registry.histogram("lumino_model_load_seconds", "Model load duration", ("model", "result"), LOAD_BUCKETS)
+model_switch_seconds = registry.histogram("lumino_model_switch_seconds", "Time from a model switch request until the model is active", ("model",), LOAD_BUCKETS)
+
+def observe_job(model, usage, cancelled):
+    """Called once per finished Job with its usage dict (None if it never decoded)."""
+    model = model or "none"
+    if usage is None:
+        requests_total.inc(1, model, "cancelled" if cancelled else "error")
+        return
+    requests_total.inc(1, model, "cached" if usage.get("cached") else ("cancelled" if cancelled else "ok"))
+    if "queue_ms" in usage:
+        queue_seconds.observe(usage["queue_ms"] / 1000, model)
+    if "ttft_ms" in usage:
+        ttft_seconds.observe(usage["ttft_ms"] / 1000, model)
+    if usage.get("cached"):
+        prompt_tokens.inc(usage.get("prompt_tokens", 0), model, "cached_reply")
+        return
+    if usage.get("prompt_eval_tps"):
+        prompt_tps.observe(usage["prompt_eval_tps"], model)
+    if usage.get("decode_tps"):
+        decode_tps.observe(usage["decode_tps"], model)
+    prompt_tokens.inc(usage.get("prompt_tokens_evaluated", 0), model, "evaluated")
+    prompt_tokens.inc(usage.get("prompt_tokens_reused", 0), model, "reused")
+    generated_tokens.inc(usage.get("completion_tokens", 0), model)
@@ -0,0 +1,268 @@
+"""
+Model registry: what is in MODELS_DIR, read from the GGUF headers.
+
+Only the header is parsed (metadata key/values + tensor infos), never the
+weights, through mmap so untouched pages are not even read. Results are
+kept in MODEL_INDEX_FILE keyed by filename and revalidated with size +
+mtime, so listing a folder of big models costs one stat() per file.
+"""
+import os
+import json
+import mmap
+import struct
+import threading
+
+from backend import config
+
+GGUF_MAGIC = b"GGUF"
+
+# GGUF metadata value types -> struct format (8 = string, 9 = array)
+SCALAR_FORMATS = {0: "<B", 1: "<b", 2: "<H", 3: "<h", 4: "<I", 5: "<i", 6: "<f", 7: "<?", 10: "<Q", 11: "<q", 12: "<d"}
+STRING_TYPE = 8
+ARRAY_TYPE = 9
+
+# ggml tensor types: id -> (name, elements per block, bytes per block)
+GGML_TYPES = {
+    0: ("F32", 1, 4), 1: ("F16", 1, 2), 2: ("Q4_0", 32, 18), 3: ("Q4_1", 32, 20),
+    6: ("Q5_0", 32, 22), 7: ("Q5_1", 32, 24), 8: ("Q8_0", 32, 34), 9: ("Q8_1", 32, 36),
+    10: ("Q2_K", 256, 84), 11: ("Q3_K", 256, 110), 12: ("Q4_K", 256, 144), 13: ("Q5_K", 256, 176),
+    14: ("Q6_K", 256, 210), 15: ("Q8_K", 256, 292), 16: ("IQ2_XXS", 256, 66), 17: ("IQ2_XS", 256, 74),
+    18: ("IQ3_XXS", 256, 98), 19: ("IQ1_S", 256, 50), 20: ("IQ4_NL", 32, 18), 21: ("IQ3_S", 256, 110),
+    22: ("IQ2_S", 256, 82), 23: ("IQ4_XS", 256, 136), 24: ("I8", 1, 1), 25: ("I16", 1, 2),
+    26: ("I32", 1, 4), 27: ("I64", 1, 8), 28: ("F64", 1, 8), 29: ("IQ1_M", 256, 56), 30: ("BF16", 1, 2),
+}
+
+# general.file_type (llama_ftype) -> quantization name
+FILE_TYPES = {
+    0: "F32", 1: "F16", 2: "Q4_0", 3: "Q4_1", 7: "Q8_0", 8: "Q5_0", 9: "Q5_1", 10: "Q2_K",
+    11: "Q3_K_S", 12: "Q3_K_M", 13: "Q3_K_L", 14: "Q4_K_S", 15: "Q4_K_M", 16: "Q5_K_S",
+    17: "Q5_K_M", 18: "Q6_K", 19: "IQ2_XXS", 20: "IQ2_XS", 21: "Q2_K_S", 22: "IQ3_XS",
+    23: "IQ3_XXS", 24: "IQ1_S", 25: "IQ4_NL", 26: "IQ3_S", 27: "IQ3_M", 28: "IQ2_S",
+    29: "IQ2_M", 30: "IQ4_XS", 31: "IQ1_M", 32: "BF16",
+}
+
+EMBEDDING_ARCHS = ("bert", "nomic-bert", "jina-bert-v2", "t5encoder")
+
+class HeaderReader:
+    """Sequential little-endian reader over the mmapped file."""
+    def __init__(self, buf):
+        self.buf = buf
+        self.pos = 0
+
+    def scalar(self, fmt):
+        value = struct.unpack_from(fmt, self.buf, self.pos)[0]
+        self.pos += struct.calcsize(fmt)
+        return value
+
+    def string(self):
+        n = self.scalar("<Q")
+        raw = self.buf[self.pos:self.pos + n]
+        self.pos += n
+        return raw.decode('utf-8', errors='replace')
+
+    def skip_string(self):
+        self.pos += 8 + struct.unpack_from("<Q", self.buf, self.pos)[0]
+
+    def value(self, value_type, keep=True):
+        if value_type == STRING_TYPE:
+            if keep:
+                return self.string()
+            self.skip_string()
+            return None
+        if value_type == ARRAY_TYPE:
+            item_type = self.scalar("<I")
+            count = self.scalar("<Q")
+            if item_type == STRING_TYPE:
+                # Vocabularies: 100k+ strings, only their lengths are read
+                for _ in range(count):
+                    self.skip_string()
+            elif item_type in SCALAR_FORMATS:
+                self.pos += count * struct.calcsize(SCALAR_FORMATS[item_type])
+            else:
+                for _ in range(count):
+                    self.value(item_type, keep=False)
+            return count
+        return self.scalar(SCALAR_FORMATS[value_type])
+
+def read_header(path):
+    """Raw metadata dict (arrays replaced by their length) and tensor infos of a GGUF."""
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+        reader = HeaderReader(buf)
+        if buf[:4] != GGUF_MAGIC:
+            raise ValueError("not a GGUF file")
+        reader.pos = 4
+        version = reader.scalar("<I")
+        if version < 2:
+            raise ValueError(f"GGUF v{version} not supported")
+        n_tensors = reader.scalar("<Q")
+        n_kv = reader.scalar("<Q")
+
+        metadata = {"GGUF.version": version}
+        for _ in range(n_kv):
+            key = reader.string()
+            metadata[key] = reader.value(reader.scalar("<I"))
+
+        tensors = []
+        for _ in range(n_tensors):
+            name = reader.string()
+            n_dims = reader.scalar("<I")
+            shape = [reader.scalar("<Q") for _ in range(n_dims)]
+            ggml_type = reader.scalar("<I")
+            reader.scalar("<Q") # Data offset, not needed
+            tensors.append((name, shape, ggml_type))
+    return metadata, tensors
+
+def detect_chat_format(template):
+    if not template:
+        return None
+    if "<|im_start|>" in template:
+        return "chatml"
+    if "<|start_header_id|>" in template:
+        return "llama3"
+    return None
+
+def summarize(path):
+    """Registry entry for one GGUF: the fields the server and ModelConfig need."""
+    metadata, tensors = read_header(path)
+    arch = metadata.get("general.architecture", "")
+    get = lambda key: metadata.get(f"{arch}.{key}")
+
+    weights = 0
+    type_counts = {}
+    for _, shape, ggml_type in tensors:
+        name, block, block_bytes = GGML_TYPES.get(ggml_type, (f"type{ggml_type}", 0, 0))
+        type_counts[name] = type_counts.get(name, 0) + 1
+        n = 1
+        for dim in shape:
+            n *= dim
+        if block:
+            weights += n // block * block_bytes
+    if any(name.startswith("type") for name in type_counts):
+        weights = os.path.getsize(path) # Unknown tensor type: fall back to the file size
+
+    n_head = get("attention.head_count") or 0
+    n_embd = get("embedding_length") or 0
+    n_head_kv = get("attention.head_count_kv") or n_head
+    head_dim = get("attention.key_length") or (n_embd // n_head if n_head else 0)
+    # f16 K + V for every layer
+    kv_bytes_per_token = 2 * 2 * (get("block_count") or 0) * n_head_kv * head_dim
+
+    template = metadata.get("tokenizer.chat_template")
+    file_type = metadata.get("general.file_type")
+    return {
+        "architecture": arch,
+        "name": metadata.get("general.name"),
+        "context_length": get("context_length"),
+        "rope_freq_base": get("rope.freq_base"),
+        "chat_format": detect_chat_format(template),
+        "has_chat_template": bool(template),
+        "quantization": FILE_TYPES.get(file_type) or max(type_counts, key=type_counts.get, default=None),
+        "tensor_types": type_counts,
+        "n_tensors": len(tensors),
+        "weights_bytes": weights,
+        "kv_bytes_per_token": kv_bytes_per_token,
+        "embedding": arch in EMBEDDING_ARCHS or get("pooling_type") is not None,
+    }
+
+class ModelRegistry:
+    def __init__(self, models_dir=None, index_file=None):
+        self.models_dir = models_dir or config.MODELS_DIR
+        self.index_file = index_file or config.MODEL_INDEX_FILE
+        self.entries = None # filename -> {"size", "mtime_ns", "meta" | "error"}
+        self.lock = threading.Lock()
+
+    def _load(self):
+        if self.entries is not None:
+            return
+        self.entries = {}
+        if self.index_file.exists():
+            try:
+                with open(self.index_file, 'r', encoding='utf-8') as f:
+                    self.entries = json.load(f)
+            except Exception as e:
+                print(f"Error loading model index: {e}")
+
+    def _save(self):
+        tmp_path = self.index_file.with_suffix(f".{os.getpid()}.tmp")
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(self.entries, f, indent=2)
+            os.replace(tmp_path, self.index_file)
+        except OSError as e:
+            print(f"Error saving model index: {e}")
+
+    def scan(self):
+        """filename -> entry for every .gguf in the folder; only new/changed files are parsed."""
+        with self.lock:
+            self._load()
+            seen = {}
+            changed = False
+            try:
+                files = [e for e in os.scandir(self.models_dir) if e.name.endswith(".gguf") and e.is_file()]
+            except FileNotFoundError:
+                files = []
+            for entry in files:
+                stat = entry.stat()
+                cached = self.entries.get(entry.name)
+                if cached and cached["size"] == stat.st_size and cached["mtime_ns"] == stat.st_mtime_ns:
+                    seen[entry.name] = cached
+                    continue
+                record = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+                try:
+                    record["meta"] = summarize(entry.path)
+                except Exception as e:
+                    record["error"] = str(e) # Remembered too: broken files are not re-parsed
+                seen[entry.name] = record
+                changed = True
+            if changed or set(seen) != set(self.entries):
+                self.entries = seen
+                self._save()
+            return dict(seen)
+
+    def get(self, filename):
+        """Header summary for one model, or None (missing / unreadable)."""
+        return self.scan().get(filename, {}).get("meta")
+
+    def is_embedding(self, filename, record):
+        meta = record.get("meta")
+        if meta is not None:
+            return meta["embedding"]
+        return config.is_embedding_model(filename)
+
+    def chat_models(self):
+        return sorted(name for name, record in self.scan().items() if not self.is_embedding(name, record))
+
+    def embedding_models(self):
+        return sorted(name for name, record in self.scan().items() if self.is_embedding(name, record))
+
+    def describe(self):
+        """/models payload: header facts and the RAM a load would take with the current config."""
+        if config.USE_FAKE_LLAMA:
+            return {}
+        n_slots = config.scheduler_slots(config.DEFAULT_INIT_PARAMS)
+        details = {}
+        for name, record in self.scan().items():
+            meta = record.get("meta")
+            if meta is None:
+                details[name] = {"size": record["size"], "error": record.get("error")}
+                continue
+            n_ctx, template = config.model_context(name, meta) # No ModelConfig: it would rescan
+            details[name] = {
+                "size": record["size"],
+                "architecture": meta["architecture"],
+                "name": meta["name"],
+                "quantization": meta["quantization"],
+                "context_length": meta["context_length"],
+                "chat_format": meta["chat_format"],
+                "embedding": meta["embedding"],
+                "n_ctx": n_ctx,
+                "template": template,
+                "ram_estimate": estimate_ram(meta, n_ctx, n_slots),
+            }
+        return details
+
+def estimate_ram(meta, n_ctx, n_slots):
+    """Weights (mmapped once, shared by all slots) + one f16 KV cache per slot."""
+    return meta["weights_bytes"] + n_slots * n_ctx * meta["kv_bytes_per_token"]
+
+model_registry = ModelRegistry()
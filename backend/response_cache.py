@@ -0,0 +1,133 @@
+"""
+Persistent cache of complete replies for deterministic requests.
+
+Only used when sampling is reproducible (temperature 0 or a fixed seed).
+The key covers the model file, the prompt token ids (system prompt,
+history, injected context) and the generation params. Entries live in a
+SQLite file, bounded in size, evicted least recently used first.
+"""
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from array import array
+
+from backend import config
+
+# Generation params that change the output
+KEY_PARAMS = ("max_tokens", "temperature", "top_p", "top_k", "repeat_penalty", "stop", "seed", "grammar_key")
+
+class ResponseCache:
+    def __init__(self, path=None, max_bytes=None):
+        params = config.DEFAULT_CACHE_PARAMS
+        self.enabled = params["enabled"]
+        self.path = path or config.CACHE_FILE
+        self.max_bytes = max_bytes or int(params["max_mb"] * 1024 * 1024)
+        self.lock = threading.Lock()
+        self.db = None
+        self.stats = {"hits": 0, "misses": 0, "stores": 0, "evictions": 0}
+
+    def _conn(self):
+        # Opened lazily: worker processes and tools that never cache pay nothing
+        if self.db is None:
+            self.db = sqlite3.connect(str(self.path), check_same_thread=False, timeout=5)
+            self.db.execute("PRAGMA journal_mode=WAL")
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                " key TEXT PRIMARY KEY, model TEXT, chunks TEXT, usage TEXT,"
+                " size INTEGER, created REAL, last_used REAL, hits INTEGER DEFAULT 0)"
+            )
+            self.db.execute("CREATE INDEX IF NOT EXISTS responses_lru ON responses(last_used)")
+        return self.db
+
+    @staticmethod
+    def cacheable(gen_params):
+        return gen_params.get("temperature") == 0 or gen_params.get("seed") is not None
+
+    @staticmethod
+    def key(model_id, prompt_tokens, gen_params):
+        params = {k: gen_params.get(k) for k in KEY_PARAMS}
+        h = hashlib.sha256(json.dumps([model_id, params], sort_keys=True).encode('utf-8'))
+        h.update(array('i', prompt_tokens).tobytes())
+        return h.hexdigest()
+
+    def get(self, key):
+        """Returns (chunks, usage) or None."""
+        with self.lock:
+            try:
+                db = self._conn()
+                row = db.execute("SELECT chunks, usage FROM responses WHERE key = ?", (key,)).fetchone()
+                if row is None:
+                    self.stats["misses"] += 1
+                    return None
+                db.execute(
+                    "UPDATE responses SET last_used = ?, hits = hits + 1 WHERE key = ?",
+                    (time.time(), key),
+                )
+                db.commit()
+            except sqlite3.Error as e:
+                print(f"Error reading response cache: {e}")
+                return None
+            self.stats["hits"] += 1
+            return json.loads(row[0]), json.loads(row[1])
+
+    def record(self, result):
+        """Count a lookup done elsewhere ("hit" / "miss" from a worker process's usage)."""
+        counter = {"hit": "hits", "miss": "misses"}.get(result)
+        if counter is not None:
+            with self.lock:
+                self.stats[counter] += 1
+
+    def put(self, key, model, chunks, usage):
+        payload = json.dumps(chunks)
+        usage_json = json.dumps(usage)
+        size = len(payload) + len(usage_json)
+        if size > self.max_bytes:
+            return
+        now = time.time()
+        with self.lock:
+            try:
+                db = self._conn()
+                db.execute(
+                    "INSERT OR REPLACE INTO responses (key, model, chunks, usage, size, created, last_used)"
+                    " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (key, model, payload, usage_json, size, now, now),
+                )
+                self.stats["stores"] += 1
+                self._evict(db)
+                db.commit()
+            except sqlite3.Error as e:
+                print(f"Error writing response cache: {e}")
+
+    def _evict(self, db):
+        total = db.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        # Oldest first until back under the budget
+        for key, size in db.execute("SELECT key, size FROM responses ORDER BY last_used").fetchall():
+            if total <= self.max_bytes:
+                break
+            db.execute("DELETE FROM responses WHERE key = ?", (key,))
+            total -= size
+            self.stats["evictions"] += 1
+
+    def status(self):
+        with self.lock:
+            lookups = self.stats["hits"] + self.stats["misses"]
+            status = {
+                "enabled": self.enabled,
+                "max_bytes": self.max_bytes,
+                "hit_rate": round(self.stats["hits"] / lookups, 3) if lookups else 0.0,
+                **self.stats,
+            }
+            try:
+                entries, size, hits = self._conn().execute(
+                    "SELECT COUNT(*), COALESCE(SUM(size), 0), COALESCE(SUM(hits), 0) FROM responses"
+                ).fetchone()
+                status.update(entries=entries, bytes=size, total_hits=hits)
+            except sqlite3.Error:
+                pass
+            return status
+
+response_cache = ResponseCache()
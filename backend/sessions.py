@@ -0,0 +1,130 @@
+import os
+import json
+import zlib
+import hashlib
+import threading
+from collections import OrderedDict
+
+from backend import config
+
+class Conversation:
+    """A single chat thread. Only one job per conversation runs at a time."""
+    def __init__(self, conversation_id, history=None, context_start=0):
+        self.id = conversation_id
+        self.history = history or [] # Context Memory
+        self.context_start = context_start # First message inside the context window
+        self.active_jobs = 0 # Pinned in memory while > 0
+
+class SessionStore:
+    """
+    Bounded in-memory map of session id -> Conversation with LRU eviction.
+    Cold sessions are compressed and spilled to SESSIONS_DIR, then loaded
+    back lazily the next time they are requested.
+    """
+    def __init__(self, max_resident=None, spill_dir=None):
+        params = config.DEFAULT_SESSION_PARAMS
+        self.max_resident = max_resident or params["max_resident"]
+        self.spill_dir = spill_dir or config.SESSIONS_DIR
+        self.resident = OrderedDict()
+        self.lock = threading.Lock()
+        self.stats = {"hits": 0, "loads": 0, "spills": 0}
+
+    def get(self, session_id):
+        with self.lock:
+            return self._get(session_id)
+
+    def acquire(self, session_id):
+        """Like get(), but pins the session in memory until release()."""
+        with self.lock:
+            conversation = self._get(session_id)
+            conversation.active_jobs += 1
+            return conversation
+
+    def release(self, conversation):
+        with self.lock:
+            conversation.active_jobs -= 1
+            self._evict()
+
+    def _get(self, session_id):
+        conversation = self.resident.get(session_id)
+        if conversation is not None:
+            self.resident.move_to_end(session_id)
+            self.stats["hits"] += 1
+            return conversation
+
+        conversation = Conversation(session_id, **self._load(session_id))
+        self.resident[session_id] = conversation
+        self._evict()
+        return conversation
+
+    def flush(self):
+        """Spill every resident session (used on shutdown)."""
+        with self.lock:
+            for conversation in self.resident.values():
+                self._spill(conversation)
+
+    def status(self):
+        with self.lock:
+            return {
+                "resident": len(self.resident),
+                "max_resident": self.max_resident,
+                **self.stats,
+            }
+
+    def _evict(self):
+        # Oldest first; sessions with a job in flight (and the one just
+        # requested) stay pinned
+        for session_id in list(self.resident)[:-1]:
+            if len(self.resident) <= self.max_resident:
+                break
+            conversation = self.resident[session_id]
+            if conversation.active_jobs > 0:
+                continue
+            try:
+                self._spill(conversation)
+            except Exception as e:
+                print(f"Error spilling session {session_id}: {e}")
+                continue
+            del self.resident[session_id]
+
+    def _path(self, session_id):
+        # Hash the id so arbitrary client input never becomes a file path
+        digest = hashlib.sha1(session_id.encode('utf-8')).hexdigest()
+        return self.spill_dir / f"{digest}.json.z"
+
+    def _spill(self, conversation):
+        if not conversation.history:
+            return
+        os.makedirs(self.spill_dir, exist_ok=True)
+        path = self._path(conversation.id)
+        tmp_path = path.with_suffix(".tmp")
+        # Underscore keys are per-model caches (token counts), not worth persisting
+        history = [
+            {k: v for k, v in msg.items() if not k.startswith("_")}
+            for msg in conversation.history
+        ]
+        payload = json.dumps({
+            "id": conversation.id,
+            "history": history,
+            "context_start": conversation.context_start,
+        })
+        with open(tmp_path, 'wb') as f:
+            f.write(zlib.compress(payload.encode('utf-8')))
+        os.replace(tmp_path, path)
+        self.stats["spills"] += 1
+
+    def _load(self, session_id):
+        path = self._path(session_id)
+        if not path.exists():
+            return {}
+        try:
+            with open(path, 'rb') as f:
+                data = json.loads(zlib.decompress(f.read()).decode('utf-8'))
+            self.stats["loads"] += 1
+            return {
+                "history": data.get("history", []),
+                "context_start": data.get("context_start", 0),
+            }
+        except Exception as e:
+            print(f"Error loading session {session_id}: {e}")
+            return {}
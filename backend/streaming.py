@@ -0,0 +1,161 @@
+"""
+Wire format of a streamed /chat reply, negotiated per request:
+
+    "stream_format": "ndjson" (default) | "compact"
+    "flush_ms":      send buffered text at least this often (0 = no time window)
+    "flush_tokens":  ... or as soon as this many tokens are buffered (1 = per token)
+
+Without the fields the stream is one NDJSON line per token, as before. With
+coalescing, consecutive token deltas are joined into one event; control
+events (info, usage) flush the buffered text first, so order is preserved.
+
+"compact" frames are a 1-byte tag + 4-byte big-endian length + payload:
+b"t" carries a raw UTF-8 text delta, b"j" a JSON control event. The server
+echoes the settings it used in the X-Lumino-Stream response header.
+"""
+import json
+import time
+import struct
+
+from backend import config
+
+FORMATS = ("ndjson", "compact")
+COMPACT_MIMETYPE = "application/x-lumino-stream"
+FRAME_HEADER = struct.Struct(">cI")
+TEXT_FRAME = b"t"
+JSON_FRAME = b"j"
+
+class StreamFormatError(ValueError):
+    pass
+
+def stream_settings(data):
+    """Negotiated framing from a /chat body: {"format", "flush_ms", "flush_tokens"}."""
+    params = config.DEFAULT_STREAM_PARAMS
+    fmt = data.get("stream_format") or "ndjson"
+    if fmt not in FORMATS:
+        raise StreamFormatError(f"stream_format harus salah satu dari {', '.join(FORMATS)}")
+    try:
+        flush_ms = float(data.get("flush_ms", params["flush_ms"]))
+        flush_tokens = int(data.get("flush_tokens", params["flush_tokens"]))
+    except (TypeError, ValueError):
+        raise StreamFormatError("flush_ms / flush_tokens harus angka")
+    return {
+        "format": fmt,
+        "flush_ms": min(max(flush_ms, 0.0), params["max_flush_ms"]), # Never hold text back for long
+        "flush_tokens": max(flush_tokens, 1),
+    }
+
+def describe(settings):
+    """Value of the X-Lumino-Stream response header."""
+    return f"{settings['format']}; flush_ms={settings['flush_ms']:g}; flush_tokens={settings['flush_tokens']}"
+
+class Coalescer:
+    """
+    Joins consecutive "content" events. add() returns the events that are
+    ready to send; the caller calls flush() once timeout() has passed.
+    """
+    def __init__(self, flush_ms=0, flush_tokens=1):
+        self.window = flush_ms / 1000
+        self.max_tokens = flush_tokens
+        self.parts = []
+        self.since = None # perf_counter of the oldest buffered token
+
+    @classmethod
+    def from_settings(cls, settings):
+        """None when the settings ask for per-token framing (nothing to coalesce)."""
+        if settings["flush_tokens"] <= 1 and settings["flush_ms"] <= 0:
+            return None
+        return cls(settings["flush_ms"], settings["flush_tokens"])
+
+    def add(self, event, now=None):
+        now = time.perf_counter() if now is None else now
+        if event["type"] != "content":
+            return self.flush() + [event]
+        if not self.parts:
+            self.since = now
+        self.parts.append(event["data"])
+        if len(self.parts) >= self.max_tokens or (self.window and now - self.since >= self.window):
+            return self.flush()
+        return []
+
+    def timeout(self, now=None):
+        """Seconds until the buffered text is due, None if nothing is buffered or no time window."""
+        if not self.parts or not self.window:
+            return None
+        now = time.perf_counter() if now is None else now
+        return max(0.0, self.since + self.window - now)
+
+    def flush(self):
+        if not self.parts:
+            return []
+        event = {"type": "content", "data": "".join(self.parts)}
+        self.parts = []
+        self.since = None
+        return [event]
+
+def coalesce(events, coalescer):
+    """
+    Sync counterpart of the async writer loop. `events` yields None when
+    nothing arrived for a while (Job.stream(poll=...)), which lets a
+    buffered chunk go out on time even while the decoder is quiet.
+    """
+    for event in events:
+        if event is None:
+            if coalescer.timeout() == 0:
+                yield from coalescer.flush()
+            continue
+        yield from coalescer.add(event)
+    yield from coalescer.flush()
+
+def poll_interval(settings):
+    """How often a sync stream wakes up to check the time window."""
+    if settings["flush_ms"] <= 0:
+        return None
+    return max(settings["flush_ms"] / 4000, 0.001)
+
+# ==================================================
+# ENCODING
+# ==================================================
+def to_wire(event):
+    """Engine event -> wire event (the NDJSON objects clients see)."""
+    if event["type"] == "content":
+        return {"type": "token", "content": event["data"]}
+    if event["type"] == "usage":
+        return {"type": "usage", "stats": event["data"]}
+    return event
+
+def encode_ndjson(wire):
+    return (json.dumps(wire) + "\n").encode('utf-8')
+
+def encode_compact(wire):
+    if wire["type"] == "token":
+        tag, payload = TEXT_FRAME, wire["content"].encode('utf-8')
+    else:
+        tag, payload = JSON_FRAME, json.dumps(wire).encode('utf-8')
+    return FRAME_HEADER.pack(tag, len(payload)) + payload
+
+def encoder(settings):
+    return encode_compact if settings["format"] == "compact" else encode_ndjson
+
+class FrameDecoder:
+    """Client side of "compact": feed() raw bytes as they arrive, get wire events back."""
+    def __init__(self):
+        self.buffer = bytearray()
+
+    def feed(self, data):
+        self.buffer += data
+        events = []
+        offset = 0
+        while len(self.buffer) - offset >= FRAME_HEADER.size:
+            tag, length = FRAME_HEADER.unpack_from(self.buffer, offset)
+            end = offset + FRAME_HEADER.size + length
+            if len(self.buffer) < end:
+                break # Frame not complete yet
+            payload = bytes(self.buffer[offset + FRAME_HEADER.size:end])
+            if tag == TEXT_FRAME:
+                events.append({"type": "token", "content": payload.decode('utf-8', errors='replace')})
+            elif tag == JSON_FRAME:
+                events.append(json.loads(payload))
+            offset = end
+        del self.buffer[:offset]
+        return events
@@ -0,0 +1,190 @@
+"""
+Opt-in per-request tracing in Chrome trace-event format (open in Perfetto or
+chrome://tracing).
+
+A request asks for it with "trace": true (or the X-Lumino-Trace header);
+"profile": true additionally samples the Python stack of the decode thread
+and adds it as a flame chart. Requests without the flag get NULL_TRACE,
+whose span() hands back one shared no-op context manager: nothing is timed,
+allocated or stored, and the per-token paths are not wrapped at all.
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import threading
+
+from backend import config
+
+def _now_us():
+    # perf_counter is CLOCK_MONOTONIC on Linux: comparable across worker processes
+    return time.perf_counter_ns() / 1000
+
+class _Span:
+    __slots__ = ("trace", "name", "args", "start")
+
+    def __init__(self, trace, name, args):
+        self.trace = trace
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        self.start = _now_us()
+        return self
+
+    def __exit__(self, *exc):
+        self.trace.complete(self.name, self.start, _now_us(), **self.args)
+        return False
+
+class Trace:
+    def __init__(self, name="chat"):
+        self.id = uuid.uuid4().hex[:8]
+        self.name = name
+        self.pid = os.getpid()
+        self.events = []
+        self.lock = threading.Lock()
+        self.path = config.TRACES_DIR / f"{time.strftime('%Y%m%d-%H%M%S')}-{name}-{self.id}.json"
+
+    def __bool__(self):
+        return True
+
+    def span(self, name, **args):
+        return _Span(self, name, args)
+
+    def complete(self, name, start_us, end_us, **args):
+        """Span with explicit start/end in microseconds (see at())."""
+        event = {
+            "name": name, "ph": "X", "ts": start_us, "dur": max(0.0, end_us - start_us),
+            "pid": self.pid, "tid": threading.get_ident(),
+        }
+        if args:
+            event["args"] = args
+        with self.lock:
+            self.events.append(event)
+
+    def instant(self, name, **args):
+        with self.lock:
+            self.events.append({
+                "name": name, "ph": "i", "s": "t", "ts": _now_us(),
+                "pid": self.pid, "tid": threading.get_ident(), "args": args,
+            })
+
+    @staticmethod
+    def at(perf_seconds):
+        """time.perf_counter() value -> trace timestamp."""
+        return perf_seconds * 1e6
+
+    def merge(self, events):
+        """Spans recorded in another process for this request (worker processes)."""
+        with self.lock:
+            self.events.extend(events)
+
+    def save(self):
+        """Write the trace to TRACES_DIR, returns the file path."""
+        os.makedirs(self.path.parent, exist_ok=True)
+        with self.lock:
+            events = list(self.events)
+        threads = {(e["pid"], e["tid"]) for e in events}
+        meta = [
+            {"name": "thread_name", "ph": "M", "pid": pid, "tid": tid,
+             "args": {"name": "sampled stack" if tid == StackSampler.TID else f"thread {tid}"}}
+            for pid, tid in threads
+        ]
+        with open(self.path, 'w', encoding='utf-8') as f:
+            json.dump({"traceEvents": meta + events, "displayTimeUnit": "ms"}, f)
+        return str(self.path)
+
+class _NullSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+class _NullTrace:
+    """Stand-in when tracing is off: every method is a no-op."""
+    _span = _NullSpan()
+
+    def __bool__(self):
+        return False
+
+    def span(self, name, **args):
+        return self._span
+
+    def complete(self, name, start_us, end_us, **args):
+        pass
+
+    def instant(self, name, **args):
+        pass
+
+    def merge(self, events):
+        pass
+
+NULL_TRACE = _NullTrace()
+
+class StackSampler:
+    """
+    Samples one thread's Python stack every `interval` seconds and turns the
+    samples into nested spans (a flame chart) on a separate track.
+    """
+    TID = 0 # Track id of the sampled stack lane
+
+    def __init__(self, trace, thread_id, interval=None):
+        self.trace = trace
+        self.thread_id = thread_id
+        self.interval = interval or config.DEFAULT_TRACE_PARAMS["sample_interval_ms"] / 1000
+        self.open = [] # [(frame label, start_us)], root first
+        self.samples = 0
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stopped.set()
+        self.thread.join()
+        self._close(0, _now_us())
+        return False
+
+    def _run(self):
+        while not self.stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                # No line numbers: consecutive samples of one function merge into one span
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)})")
+                frame = frame.f_back
+            stack.reverse()
+            self._record(stack)
+
+    def _record(self, stack):
+        now = _now_us()
+        self.samples += 1
+        common = 0
+        while common < len(self.open) and common < len(stack) and self.open[common][0] == stack[common]:
+            common += 1
+        self._close(common, now)
+        for label in stack[common:]:
+            self.open.append((label, now))
+
+    def _close(self, keep, now):
+        while len(self.open) > keep:
+            label, start = self.open.pop()
+            event = {"name": label, "ph": "X", "ts": start, "dur": now - start,
+                     "pid": self.trace.pid, "tid": self.TID, "cat": "sample"}
+            with self.trace.lock:
+                self.trace.events.append(event)
+
+def for_request(options):
+    """Trace for a request whose options ask for one, else NULL_TRACE."""
+    if options.get("trace") or options.get("profile"):
+        return Trace()
+    return NULL_TRACE
@@ -0,0 +1,224 @@
+"""
+Per-host tuning of llama_cpp init params.
+
+autotune() loads the model with a small context and sweeps, one after the
+other: batch threads (prompt eval speed), n_batch (prompt eval speed) and
+generation threads (decode speed). GPU layers and mlock are decided from
+what the host supports. The winner is stored in tuning.json, keyed by model
+hash + CPU fingerprint + thread budget, and ModelConfig.apply_tuning()
+picks it up on every later load.
+"""
+import os
+import json
+import time
+import hashlib
+import platform
+import threading
+
+from backend import config
+
+TUNED_KEYS = ("n_threads", "n_threads_batch", "n_batch", "n_gpu_layers", "use_mlock")
+HASH_WINDOW = 4 * 1024 * 1024 # Bytes hashed at the start and at the end of the GGUF
+
+_lock = threading.Lock()
+
+def cpu_fingerprint():
+    name = platform.processor() or platform.machine()
+    try:
+        with open("/proc/cpuinfo", encoding="utf-8") as f:
+            for line in f:
+                if line.startswith("model name"):
+                    name = line.split(":", 1)[1].strip()
+                    break
+    except OSError:
+        pass
+    raw = f"{platform.system()}|{name}|{os.cpu_count()}"
+    return hashlib.sha1(raw.encode('utf-8')).hexdigest()[:12]
+
+def _load_store():
+    path = config.TUNING_FILE
+    if not path.exists():
+        return {"files": {}, "tuned": {}}
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except Exception as e:
+        print(f"Error loading tuning file: {e}")
+        return {"files": {}, "tuned": {}}
+
+def _save_store(store):
+    path = config.TUNING_FILE
+    tmp_path = path.with_suffix(f".{os.getpid()}.tmp")
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(store, f, indent=2)
+    os.replace(tmp_path, path)
+
+def model_hash(path, store):
+    """
+    Hash of size + head + tail of the GGUF (hashing gigabytes on every load
+    would cost more than it saves). Cached per path while size/mtime match.
+    """
+    stat = os.stat(path)
+    cached = store["files"].get(path)
+    if cached and cached[0] == stat.st_size and cached[1] == stat.st_mtime_ns:
+        return cached[2]
+
+    h = hashlib.sha1(str(stat.st_size).encode('utf-8'))
+    with open(path, 'rb') as f:
+        h.update(f.read(HASH_WINDOW))
+        if stat.st_size > HASH_WINDOW:
+            f.seek(max(HASH_WINDOW, stat.st_size - HASH_WINDOW))
+            h.update(f.read(HASH_WINDOW))
+    digest = h.hexdigest()[:16]
+    store["files"][path] = [stat.st_size, stat.st_mtime_ns, digest]
+    return digest
+
+def file_hash(path):
+    """model_hash() for callers without a store (the hash is cached in tuning.json)."""
+    with _lock:
+        store = _load_store()
+        known = store["files"].get(path)
+        digest = model_hash(path, store)
+        if store["files"].get(path) != known:
+            _save_store(store)
+        return digest
+
+def _key(model_path, max_threads, store):
+    return f"{model_hash(model_path, store)}:{cpu_fingerprint()}:{max_threads}"
+
+def lookup(model_path, max_threads):
+    """Tuned params for this model/host/thread budget, or None."""
+    if not os.path.exists(model_path):
+        return None
+    with _lock:
+        store = _load_store()
+        entry = store["tuned"].get(_key(model_path, max_threads, store))
+        return {k: entry[k] for k in TUNED_KEYS if k in entry} if entry else None
+
+# ==================================================
+# MICROBENCHMARK
+# ==================================================
+def _thread_candidates(max_threads):
+    candidates = {max_threads, max(1, max_threads // 2), max(1, max_threads * 3 // 4)}
+    n = 1
+    while n < max_threads:
+        candidates.add(n)
+        n *= 2
+    return sorted(candidates)
+
+def _gpu_offload():
+    try:
+        import llama_cpp
+        return bool(llama_cpp.llama_supports_gpu_offload())
+    except Exception:
+        return False
+
+def _mlock_ok(model_path):
+    """mlock only if the memlock limit can hold the whole model."""
+    try:
+        import resource
+    except ImportError:
+        return False # Windows: VirtualLock often fails for big models, don't risk it
+    soft, _ = resource.getrlimit(resource.RLIMIT_MEMLOCK)
+    return soft == resource.RLIM_INFINITY or soft >= os.path.getsize(model_path)
+
+def _set_threads(model, n_threads, n_threads_batch):
+    """Change thread counts in place; False if this llama_cpp can't (then reload)."""
+    try:
+        import llama_cpp
+        llama_cpp.llama_set_n_threads(model._ctx.ctx, n_threads, n_threads_batch)
+        return True
+    except Exception:
+        return False
+
+def _prompt_tps(model, tokens):
+    model.reset()
+    start = time.perf_counter()
+    model.eval(tokens)
+    return len(tokens) / max(time.perf_counter() - start, 1e-9)
+
+def _decode_tps(model, tokens, n):
+    model.reset()
+    model.eval(tokens[:16])
+    start = time.perf_counter()
+    for i in range(n):
+        model.eval([tokens[16 + i % (len(tokens) - 16)]])
+    return n / max(time.perf_counter() - start, 1e-9)
+
+def autotune(model_config, max_threads, llama_class):
+    """Run the sweeps for `model_config` and store the result. Returns the tuned params."""
+    params = config.DEFAULT_TUNING_PARAMS
+    base = model_config.init_params.copy()
+    base.update(n_ctx=min(base["n_ctx"], params["n_ctx"]), use_mlock=False, verbose=False)
+    measured = {}
+
+    # 1. GPU layers: keep the configured offload if it loads, back off otherwise
+    gpu_layers = [0]
+    if _gpu_offload():
+        gpu_layers = [base.get("n_gpu_layers", 0), 32, 16, 0]
+    model = None
+    for n_gpu_layers in gpu_layers:
+        try:
+            base["n_gpu_layers"] = n_gpu_layers
+            model = llama_class(**dict(base, n_threads=max_threads, n_threads_batch=max_threads))
+            break
+        except Exception:
+            continue
+    if model is None:
+        raise RuntimeError("Autotune: model gagal di-load")
+
+    text = "Lumino menjelaskan arsitektur software dengan jelas dan akurat. "
+    tokens = model.tokenize(text.encode('utf-8'), add_bos=True, special=False)
+    tokens = (tokens * (params["prompt_tokens"] // len(tokens) + 1))[:params["prompt_tokens"]]
+
+    loaded = {"n_batch": base["n_batch"]}
+    def with_threads(model, n_threads, n_threads_batch, n_batch):
+        if n_batch == loaded["n_batch"] and _set_threads(model, n_threads, n_threads_batch):
+            return model
+        loaded["n_batch"] = n_batch
+        return llama_class(**dict(base, n_threads=n_threads, n_threads_batch=n_threads_batch, n_batch=n_batch))
+
+    # 2. Batch threads: best prompt eval speed
+    best_batch_threads, best = max_threads, 0.0
+    for n in _thread_candidates(max_threads):
+        model = with_threads(model, max_threads, n, base["n_batch"])
+        tps = _prompt_tps(model, tokens)
+        measured[f"prompt_tps@threads_batch={n}"] = round(tps, 1)
+        if tps > best:
+            best_batch_threads, best = n, tps
+
+    # 3. n_batch: context param, needs a reload per value
+    best_n_batch = base["n_batch"]
+    for n_batch in params["batch_sizes"]:
+        if n_batch > base["n_ctx"]:
+            continue
+        model = with_threads(model, max_threads, best_batch_threads, n_batch)
+        tps = _prompt_tps(model, tokens)
+        measured[f"prompt_tps@n_batch={n_batch}"] = round(tps, 1)
+        if tps > best:
+            best_n_batch, best = n_batch, tps
+
+    # 4. Generation threads: best single-token decode speed
+    best_threads, best = max_threads, 0.0
+    for n in _thread_candidates(max_threads):
+        model = with_threads(model, n, best_batch_threads, best_n_batch)
+        tps = _decode_tps(model, tokens, params["decode_tokens"])
+        measured[f"decode_tps@threads={n}"] = round(tps, 1)
+        if tps > best:
+            best_threads, best = n, tps
+    del model
+
+    tuned = {
+        "n_threads": best_threads,
+        "n_threads_batch": best_batch_threads,
+        "n_batch": best_n_batch,
+        "n_gpu_layers": base["n_gpu_layers"],
+        "use_mlock": _mlock_ok(model_config.path),
+    }
+    with _lock:
+        store = _load_store()
+        store["tuned"][_key(model_config.path, max_threads, store)] = dict(
+            tuned, model=model_config.filename, measured=measured, tuned_at=time.time()
+        )
+        _save_store(store)
+    return tuned
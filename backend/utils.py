@@ -1,53 +1,184 @@
 import os
 import re
-from backend.config import PROJECT_DIR
+import mmap
+import threading
+from array import array
+from collections import OrderedDict
+from backend.config import PROJECT_DIR, DEFAULT_READ_PARAMS
 
-def read_file_content(filename):
+# Regex untuk mencari pattern /read namafile (opsional range baris)
+# Contoh match: /read main.py, /read style.css, /read backend/core.py:120-200
+READ_PATTERN = re.compile(r"/read\s+([a-zA-Z0-9_\-\./]+)(?::(\d+)-(\d+))?")
+
+class CachedFile:
+    """Isi file + blok prompt yang sudah jadi, valid selama mtime/size sama."""
+    def __init__(self, path, stat):
+        self.path = path
+        self.mtime_ns = stat.st_mtime_ns
+        self.size = stat.st_size
+        self.text = None # Hanya untuk file kecil; file besar dibaca via mmap
+        self.blocks = {} # (model_key, max_tokens, line_range) -> (text, token ids array('i'), truncated)
+
+    def matches(self, stat):
+        return stat.st_mtime_ns == self.mtime_ns and stat.st_size == self.size
+
+class FileCache:
+    """
+    Cache untuk /read, key = path + mtime/size. File yang sama di banyak turn
+    cukup di-stat, tanpa baca disk dan tanpa tokenize ulang.
+    """
+    def __init__(self, max_entries=None, mmap_threshold=None):
+        self.max_entries = max_entries or DEFAULT_READ_PARAMS["cache_entries"]
+        self.mmap_threshold = mmap_threshold or DEFAULT_READ_PARAMS["mmap_threshold"]
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, path):
+        stat = os.stat(path)
+        with self.lock:
+            entry = self.entries.get(path)
+            if entry is not None and entry.matches(stat):
+                self.entries.move_to_end(path)
+                return entry
+
+            entry = CachedFile(path, stat)
+            if entry.size < self.mmap_threshold:
+                with open(path, 'r', encoding='utf-8') as f:
+                    entry.text = f.read()
+            self.entries[path] = entry
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+            return entry
+
+    def read_window(self, entry, line_range=None, max_bytes=None):
+        """
+        Teks file (atau potongan baris) tanpa memuat file besar utuh ke memori.
+        Returns (text, clipped): clipped = window yang dipilih lebih besar dari max_bytes.
+        """
+        if entry.text is not None:
+            text = entry.text
+            if line_range:
+                lines = text.splitlines(keepends=True)
+                text = "".join(lines[line_range[0] - 1:line_range[1]])
+            return text, False
+
+        with open(entry.path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+            start, end = 0, len(m)
+            if line_range:
+                start = _line_offset(m, line_range[0] - 1)
+                end = _line_offset(m, line_range[1], start, line_range[0] - 1)
+            clipped = max_bytes is not None and end - start > max_bytes
+            if clipped:
+                end = start + max_bytes
+            return m[start:end].decode('utf-8', errors='ignore'), clipped
+
+def _line_offset(m, line_index, offset=0, current=0):
+    """Byte offset awal baris ke-line_index (0-based) di dalam mmap."""
+    while current < line_index:
+        nl = m.find(b"\n", offset)
+        if nl == -1:
+            return len(m)
+        offset = nl + 1
+        current += 1
+    return offset
+
+file_cache = FileCache()
+
+def read_file_content(filename, tokenizer=None, model_key=None, max_tokens=None, line_range=None):
     """
     Membaca file lokal dari folder project secara aman.
+    Kalau `tokenizer` (tokenize/detokenize) diberikan, isi file dipotong agar
+    muat di `max_tokens` dan blok + token id-nya di-cache per model.
+    Returns (blok_teks, token_ids): token_ids = array('i') dari seluruh blok,
+    None tanpa tokenizer atau untuk pesan error.
     """
     # Gabungkan path project dengan nama file yang diminta
-    target_path = os.path.join(PROJECT_DIR, filename.strip())
-    
+    target_path = os.path.abspath(os.path.join(PROJECT_DIR, filename.strip()))
+
     # Keamanan: Pastikan file benar-benar ada di dalam PROJECT_DIR
     # (Mencegah request seperti /read ../../../windows/system32)
-    if not os.path.commonpath([PROJECT_DIR, os.path.abspath(target_path)]) == str(PROJECT_DIR):
-        return f"[SISTEM: Akses ditolak. File {filename} berada di luar folder projek.]"
+    if not os.path.commonpath([PROJECT_DIR, target_path]) == str(PROJECT_DIR):
+        return f"[SISTEM: Akses ditolak. File {filename} berada di luar folder projek.]", None
 
-    if not os.path.exists(target_path):
-        return f"[SISTEM: File {filename} tidak ditemukan.]"
+    if not os.path.isfile(target_path):
+        return f"[SISTEM: File {filename} tidak ditemukan.]", None
 
     try:
-        with open(target_path, 'r', encoding='utf-8') as f:
-            content = f.read()
-            # Format agar AI paham ini adalah isi file
-            return (
-                f"\n\n--- START OF FILE: {filename} ---\n"
-                f"```{filename.split('.')[-1]}\n"  # Hint extension untuk syntax highlighting
-                f"{content}\n"
-                f"```\n"
-                f"--- END OF FILE ---\n\n"
-            )
+        entry = file_cache.get(target_path)
+        key = (model_key, max_tokens, line_range)
+        cached = entry.blocks.get(key)
+        if cached is not None:
+            return cached[0], cached[1]
+
+        # File besar: cukup baca bagian awal yang mungkin muat di budget
+        max_bytes = max_tokens * 8 if max_tokens else None
+        content, truncated = file_cache.read_window(entry, line_range, max_bytes=max_bytes)
+
+        content_ids = None
+        if tokenizer is not None:
+            content_ids = tokenizer.tokenize(content)
+            if max_tokens and len(content_ids) > max_tokens:
+                content_ids = content_ids[:max_tokens]
+                content = tokenizer.detokenize(content_ids)
+                truncated = True
+
+        label = filename if not line_range else f"{filename}:{line_range[0]}-{line_range[1]}"
+        note = "[SISTEM: Isi file dipotong agar muat di context window.]\n" if truncated else ""
+        # Format agar AI paham ini adalah isi file
+        header = (
+            f"\n\n--- START OF FILE: {label} ---\n"
+            f"```{filename.split('.')[-1]}\n"  # Hint extension untuk syntax highlighting
+        )
+        footer = (
+            f"\n```\n"
+            f"{note}"
+            f"--- END OF FILE ---\n\n"
+        )
+        block = header + content + footer
+        if tokenizer is None:
+            return block, None
+
+        # Isi file ditokenize sekali; header/footer pendek di-tokenize terpisah
+        ids = array('i', tokenizer.tokenize(header))
+        ids += array('i', content_ids)
+        ids += array('i', tokenizer.tokenize(footer))
+        entry.blocks[key] = (block, ids, truncated)
+        return block, ids
     except Exception as e:
-        return f"[SISTEM: Gagal membaca file. Error: {str(e)}]"
+        return f"[SISTEM: Gagal membaca file. Error: {str(e)}]", None
 
-def process_input_commands(user_input):
+def expand_read_commands(user_input, tokenizer=None, model_key=None, max_tokens=None):
     """
     Mendeteksi command /read namafile.ext dan menggantinya dengan isi file asli.
+    Returns (processed_input, files_read, segments): segments = [(teks, token_ids)]
+    berurutan, token_ids dari file cache untuk blok file, None untuk teks ketikan.
     """
-    # Regex untuk mencari pattern /read namafile
-    # Contoh match: /read main.py, /read style.css
-    pattern = r"/read\s+([a-zA-Z0-9_\-\./]+)"
-    
-    matches = re.findall(pattern, user_input)
-    
-    processed_input = user_input
+    matches = list(READ_PATTERN.finditer(user_input))
+    segments = []
+    last_end = 0
     files_read = []
 
-    for filename in matches:
-        file_content = read_file_content(filename)
+    # Budget dibagi rata untuk semua file di pesan ini
+    budget = max_tokens // len(matches) if max_tokens and matches else None
+
+    for match in matches:
+        filename = match.group(1)
+        line_range = None
+        if match.group(2):
+            line_range = (max(1, int(match.group(2))), int(match.group(3)))
+        file_content, ids = read_file_content(filename, tokenizer, model_key, budget, line_range)
         # Ganti command /read main.py dengan ISI file tersebut di dalam prompt
-        processed_input = processed_input.replace(f"/read {filename}", file_content)
+        segments.append((user_input[last_end:match.start()], None))
+        segments.append((file_content, ids))
+        last_end = match.end()
         files_read.append(filename)
-    
-    return processed_input, files_read
\ No newline at end of file
+
+    segments.append((user_input[last_end:], None))
+    return "".join(text for text, _ in segments), files_read, segments
+
+def process_input_commands(user_input):
+    """
+    Mendeteksi command /read namafile.ext dan menggantinya dengan isi file asli.
+    """
+    processed_input, files_read, _ = expand_read_commands(user_input)
+    return processed_input, files_read
@@ -0,0 +1,300 @@
+import os
+import json
+import time
+import queue
+import hashlib
+import threading
+
+import numpy as np
+
+from backend import config
+from backend.index import project_index
+from backend.utils import file_cache
+
+# Row tags (uint8): 0 = deleted, lainnya = jenis konten
+TAG_DELETED = 0
+TAG_FILE = 1
+TAG_CHAT = 2
+
+def session_key(session_id):
+    return hashlib.sha1(session_id.encode('utf-8')).hexdigest()[:16]
+
+class VectorStore:
+    """
+    Append-only float32 matrix on disk (np.memmap), one row per chunk.
+    Metadata lives in meta.jsonl and is only read for the top-k rows, so
+    the store never materializes hundreds of thousands of Python objects.
+    """
+    def __init__(self, directory, dim, rows=0):
+        self.dir = directory
+        self.dim = dim
+        self.rows = rows
+        self.capacity = 0
+        self.vectors = None # (capacity, dim) float32
+        self.tags = None # (capacity,) uint8
+        self.offsets = None # (capacity,) int64, byte offset in meta.jsonl
+        self.lock = threading.RLock()
+        os.makedirs(directory, exist_ok=True)
+        self._map(max(self.rows, self._file_rows()))
+
+    def _file_rows(self):
+        path = self.dir / "tags.u8"
+        return os.path.getsize(path) if path.exists() else 0
+
+    def _map(self, capacity):
+        """(Re)map the three arrays with room for `capacity` rows."""
+        if capacity <= 0:
+            return
+        for name, width in (("vectors.f32", 4 * self.dim), ("tags.u8", 1), ("offsets.i64", 8)):
+            path = self.dir / name
+            with open(path, 'r+b' if path.exists() else 'w+b') as f:
+                if os.path.getsize(path) < capacity * width:
+                    f.truncate(capacity * width)
+        self.vectors = np.memmap(self.dir / "vectors.f32", dtype=np.float32, mode='r+', shape=(capacity, self.dim))
+        self.tags = np.memmap(self.dir / "tags.u8", dtype=np.uint8, mode='r+', shape=(capacity,))
+        self.offsets = np.memmap(self.dir / "offsets.i64", dtype=np.int64, mode='r+', shape=(capacity,))
+        self.capacity = capacity
+
+    def append(self, vectors, metas, tag):
+        """Returns the row numbers of the new vectors."""
+        with self.lock:
+            start = self.rows
+            end = start + len(vectors)
+            if end > self.capacity:
+                grow = config.DEFAULT_VECTOR_PARAMS["grow_rows"]
+                self._map(max(end, self.capacity * 2, grow))
+
+            with open(self.dir / "meta.jsonl", 'ab') as f:
+                for i, meta in enumerate(metas):
+                    self.offsets[start + i] = f.tell()
+                    f.write(json.dumps(meta).encode('utf-8') + b"\n")
+            self.vectors[start:end] = vectors
+            self.tags[start:end] = tag
+            self.vectors.flush()
+            self.tags.flush()
+            self.offsets.flush()
+            self.rows = end
+            return list(range(start, end))
+
+    def delete(self, rows):
+        if not rows:
+            return
+        with self.lock:
+            self.tags[np.asarray(rows, dtype=np.int64)] = TAG_DELETED
+            self.tags.flush()
+
+    def meta(self, row):
+        with open(self.dir / "meta.jsonl", 'rb') as f:
+            f.seek(int(self.offsets[row]))
+            return json.loads(f.readline())
+
+    def search(self, query, top_k, tag=None, block_rows=65536):
+        """Vectorized top-k dot product, block by block. Returns [(score, row)]."""
+        with self.lock:
+            best_scores = []
+            best_rows = []
+            for start in range(0, self.rows, block_rows):
+                end = min(start + block_rows, self.rows)
+                scores = self.vectors[start:end] @ query
+                tags = self.tags[start:end]
+                valid = tags != TAG_DELETED if tag is None else tags == tag
+                scores = np.where(valid, scores, -np.inf)
+                k = min(top_k, end - start)
+                idx = np.argpartition(-scores, k - 1)[:k]
+                best_scores.append(scores[idx])
+                best_rows.append(idx + start)
+
+        if not best_scores:
+            return []
+        scores = np.concatenate(best_scores)
+        rows = np.concatenate(best_rows)
+        order = np.argsort(-scores)[:top_k]
+        return [(float(scores[i]), int(rows[i])) for i in order if np.isfinite(scores[i])]
+
+class VectorIndex:
+    """
+    Semantic index over project chunks (the same chunks as the BM25 index)
+    and past conversation messages. Embeddings come from a GGUF in models/
+    loaded with embedding=True. New content is embedded in batches by a
+    background thread that pauses while the chat slots are busy.
+    """
+    def __init__(self, params=None):
+        self.params = params or config.DEFAULT_VECTOR_PARAMS
+        self.dir = config.INDEX_DIR / "vectors"
+        self.state_path = self.dir / "state.json"
+        self.state = {"model": None, "dim": 0, "rows": 0, "files": {}, "sessions": {}}
+        self.store = None
+        self.model = None
+        self.embed_lock = threading.Lock() # Llama contexts are not thread-safe
+        self.state_lock = threading.Lock()
+        self.todo = queue.Queue()
+        self.idle_check = None
+        self.thread = None
+        self.ready = False
+
+    def start(self, idle_check=None):
+        """Load the embedding model in the background. False if there is none."""
+        filename = self.params["model"] or next(iter(config.get_embedding_models()), None)
+        if filename is None or self.thread is not None:
+            return False
+        self.idle_check = idle_check
+        self.thread = threading.Thread(target=self._run, args=(filename,), daemon=True)
+        self.thread.start()
+        return True
+
+    # --- Public API --------------------------------------------------------
+    def embed(self, texts):
+        """Batch of texts -> (n, dim) float32, L2-normalized."""
+        with self.embed_lock:
+            vectors = self.model.embed(texts, normalize=True, truncate=True)
+        return np.asarray(vectors, dtype=np.float32).reshape(len(texts), -1)
+
+    def search(self, query, top_k=None, tag=None):
+        """Returns [(score, meta)] for the rows closest to `query`."""
+        if not self.ready:
+            return []
+        top_k = top_k or self.params["top_k"]
+        hits = self.store.search(self.embed([query])[0], top_k, tag)
+        return [(score, self.store.meta(row)) for score, row in hits]
+
+    def add_conversation(self, conversation):
+        """Queue the messages of `conversation` that are not embedded yet."""
+        if self.thread is None:
+            return
+        key = session_key(conversation.id)
+        with self.state_lock:
+            done = self.state["sessions"].get(key, 0)
+        new = [
+            (i, msg["role"], msg["content"])
+            for i, msg in enumerate(conversation.history[done:], start=done)
+        ]
+        if new:
+            self.todo.put((key, new))
+
+    def status(self):
+        with self.state_lock:
+            return {
+                "ready": self.ready,
+                "model": self.state["model"],
+                "rows": self.store.rows if self.store is not None else 0,
+                "files": len(self.state["files"]),
+                "pending": self.todo.qsize(),
+            }
+
+    # --- Background worker -------------------------------------------------
+    def _run(self, filename):
+        from llama_cpp import Llama
+        try:
+            self.model = Llama(
+                model_path=str(config.MODELS_DIR / filename),
+                embedding=True,
+                n_ctx=self.params["n_ctx"],
+                n_batch=self.params["n_ctx"],
+                n_ubatch=self.params["n_ctx"],
+                n_threads=self.params["n_threads"],
+                verbose=False,
+            )
+            self._load_state(filename, self.model.n_embd())
+        except Exception as e:
+            print(f"Error loading embedding model: {e}")
+            return
+        self.ready = True
+
+        last_sync = 0.0
+        while True:
+            try:
+                item = self.todo.get(timeout=self.params["rescan_interval"])
+            except queue.Empty:
+                item = None
+            try:
+                if item is not None:
+                    self._embed_messages(*item)
+                if time.time() - last_sync >= self.params["rescan_interval"]:
+                    project_index.refresh_async()
+                    self._sync_files()
+                    last_sync = time.time()
+            except Exception as e:
+                print(f"Error updating vector index: {e}")
+
+    def _load_state(self, filename, dim):
+        if self.state_path.exists():
+            with open(self.state_path, 'r', encoding='utf-8') as f:
+                state = json.load(f)
+            # Vectors of another model are meaningless: start over
+            if state.get("model") == filename and state.get("dim") == dim:
+                self.state = state
+        if self.state["model"] != filename:
+            for name in ("vectors.f32", "tags.u8", "offsets.i64", "meta.jsonl"):
+                path = self.dir / name
+                if path.exists():
+                    os.remove(path)
+            self.state = {"model": filename, "dim": dim, "rows": 0, "files": {}, "sessions": {}}
+        self.store = VectorStore(self.dir, dim, self.state["rows"])
+
+    def _save_state(self):
+        with self.state_lock:
+            self.state["rows"] = self.store.rows
+            payload = json.dumps(self.state)
+        tmp_path = self.state_path.with_suffix(".tmp")
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(payload)
+        os.replace(tmp_path, self.state_path)
+
+    def _wait_idle(self):
+        # Chat decoding has priority over background embedding
+        while self.idle_check is not None and not self.idle_check():
+            time.sleep(0.05)
+
+    def _embed_batches(self, texts, metas, tag):
+        rows = []
+        batch_size = self.params["batch_size"]
+        for i in range(0, len(texts), batch_size):
+            self._wait_idle()
+            vectors = self.embed(texts[i:i + batch_size])
+            rows.extend(self.store.append(vectors, metas[i:i + batch_size], tag))
+        return rows
+
+    def _sync_files(self):
+        """Bring file rows in line with the BM25 index (same chunks, same mtimes)."""
+        with project_index.lock:
+            current = {
+                rel_path: (info["mtime_ns"], [project_index.chunks[c][1:3] for c in info["chunks"]])
+                for rel_path, info in project_index.files.items()
+            }
+
+        known = self.state["files"]
+        for rel_path in [p for p in known if p not in current]:
+            self.store.delete(known[rel_path][1])
+            with self.state_lock:
+                del known[rel_path]
+
+        for rel_path, (mtime_ns, spans) in current.items():
+            if rel_path in known and known[rel_path][0] == mtime_ns:
+                continue
+            try:
+                entry = file_cache.get(os.path.join(project_index.root, rel_path))
+                texts = [f"{rel_path}\n{file_cache.read_window(entry, span)[0]}" for span in spans]
+            except (OSError, UnicodeDecodeError):
+                continue
+            metas = [{"path": rel_path, "start": s, "end": e} for s, e in spans]
+            rows = self._embed_batches(texts, metas, TAG_FILE)
+            if rel_path in known:
+                self.store.delete(known[rel_path][1])
+            with self.state_lock:
+                known[rel_path] = [mtime_ns, rows]
+            self._save_state()
+
+    def _embed_messages(self, key, messages):
+        with self.state_lock:
+            done = self.state["sessions"].get(key, 0)
+        messages = [m for m in messages if m[0] >= done]
+        if not messages:
+            return
+        texts = [f"{role}: {content}" for _, role, content in messages]
+        metas = [{"session": key, "index": i} for i, _, _ in messages]
+        self._embed_batches(texts, metas, TAG_CHAT)
+        with self.state_lock:
+            self.state["sessions"][key] = messages[-1][0] + 1
+        self._save_state()
+
+vector_index = VectorIndex()
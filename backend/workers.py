@@ -0,0 +1,316 @@
+"""
+Out-of-process inference: one worker process per warm model.
+
+ProcessScheduler has the same interface as core.Scheduler, but its
+InferenceSlots live in a child process (`python -m backend.workers`).
+Tokens stream back over a multiprocessing.connection channel, so the HTTP
+layer, JSON encoding and slow clients never compete with the decode loop
+for the GIL, and different models decode in parallel on their own cores.
+Weights are still mmap'ed, so the page cache is shared between processes.
+
+The parent stays the owner of every Conversation: each job ships the
+history to the child and gets back what the turn changed.
+"""
+import os
+import sys
+import secrets
+import threading
+import subprocess
+from multiprocessing.connection import Listener, Client
+
+from backend import config
+from backend import metrics
+from backend.response_cache import response_cache
+
+class ProcessScheduler:
+    def __init__(self, model_config, n_slots=None, n_cores=None, on_progress=None, cores=None):
+        params = config.DEFAULT_SCHEDULER_PARAMS
+        self.config = model_config
+        self.n_slots = config.scheduler_slots(model_config.init_params, n_slots)
+        self.pending = [] # Not shipped yet (their conversation is busy in the child)
+        self.inflight = {} # job_id -> (job, history length when shipped)
+        self.busy = set()
+        self.closed = False
+        self.cond = threading.Condition()
+        self.send_lock = threading.Lock()
+        self.next_id = 0
+
+        authkey = secrets.token_bytes(16)
+        # Default family: Unix socket / Windows named pipe (no Nagle delay per token)
+        listener = Listener(authkey=authkey)
+        env = dict(os.environ, LUMINO_WORKER="1") # Child must not build its own AIEngine
+        self.process = subprocess.Popen(
+            [sys.executable, "-m", "backend.workers", listener.address,
+             authkey.hex(), model_config.filename, str(self.n_slots),
+             str(n_cores or params["n_cores"]), ",".join(map(str, cores or []))],
+            cwd=str(config.ROOT_DIR), env=env,
+        )
+        try:
+            self.conn = self._accept(listener, authkey)
+        finally:
+            listener.close()
+
+        # Block until the child has loaded its slots, like Scheduler() does
+        while True:
+            msg = self.conn.recv()
+            if msg["op"] == "progress" and on_progress is not None:
+                on_progress(msg["done"], msg["total"])
+            elif msg["op"] == "error":
+                self.process.wait()
+                raise RuntimeError(msg["error"])
+            elif msg["op"] == "ready":
+                break
+
+        self.reader = threading.Thread(target=self._read, daemon=True)
+        self.reader.start()
+
+    def _accept(self, listener, authkey):
+        """listener.accept(), but a child that dies before connecting raises instead of hanging."""
+        connected = threading.Event()
+
+        def watch():
+            while not connected.wait(0.2):
+                if self.process.poll() is not None:
+                    try:
+                        Client(listener.address, authkey=authkey).close() # Wake accept() up
+                    except OSError:
+                        pass
+                    return
+
+        threading.Thread(target=watch, daemon=True).start()
+        try:
+            conn = listener.accept()
+        finally:
+            connected.set()
+        if self.process.poll() is not None:
+            conn.close()
+            raise RuntimeError(f"Worker process berhenti sebelum terhubung (exit code {self.process.returncode})")
+        return conn
+
+    @property
+    def queue_depth(self):
+        with self.cond:
+            return len(self.pending) + max(0, len(self.inflight) - self.n_slots)
+
+    def status(self):
+        with self.cond:
+            return {
+                "queue_depth": len(self.pending) + max(0, len(self.inflight) - self.n_slots),
+                "slots": self.n_slots,
+                "busy_slots": min(len(self.inflight), self.n_slots),
+                "pid": self.process.pid,
+            }
+
+    def submit(self, job):
+        job.model = self.config.filename
+        metrics.active_requests.inc()
+        with self.cond:
+            if self.closed:
+                job.put({"type": "content", "data": "Error: worker process sudah berhenti."})
+                job.finish()
+                return job
+            self.pending.append(job)
+            self._dispatch()
+        return job
+
+    def close(self):
+        """Stop accepting work. Running jobs finish in the child, queued ones are returned."""
+        with self.cond:
+            self.closed = True
+            leftover, self.pending = self.pending, []
+        try:
+            self._send({"op": "close"})
+        except OSError:
+            pass
+        return leftover
+
+    # --- Parent side internals ---------------------------------------------
+    def _send(self, msg):
+        with self.send_lock:
+            self.conn.send(msg)
+
+    def _dispatch(self):
+        """Ship every pending job whose conversation is not busy (cond held)."""
+        for job in list(self.pending):
+            if job.cancelled:
+                self.pending.remove(job)
+                job.finish()
+                continue
+            conversation = job.conversation
+            if conversation.id in self.busy:
+                continue
+            self.pending.remove(job)
+            self.busy.add(conversation.id)
+            job_id = self.next_id
+            self.next_id += 1
+            self.inflight[job_id] = (job, len(conversation.history))
+            self._send({
+                "op": "submit",
+                "job_id": job_id,
+                "conversation": {
+                    "id": conversation.id,
+                    "history": conversation.history,
+                    "context_start": conversation.context_start,
+                },
+                "user_input": job.user_input,
+                "options": self._ship_options(job.options),
+                "submitted_at": job.submitted_at,
+            })
+
+    @staticmethod
+    def _ship_options(options):
+        """The compiled grammar stays here (the child has its own cache), its usage info goes along."""
+        validated = options.get("_grammar")
+        if validated is None:
+            return options
+        options = {k: v for k, v in options.items() if k != "_grammar"}
+        options["_grammar_info"] = validated[1]
+        return options
+
+    def _read(self):
+        cancel_sent = set()
+        try:
+            while True:
+                msg = self.conn.recv()
+                if msg["op"] == "event":
+                    with self.cond:
+                        job, _ = self.inflight.get(msg["job_id"], (None, 0))
+                    if job is None:
+                        continue
+                    if job.cancelled and msg["job_id"] not in cancel_sent:
+                        cancel_sent.add(msg["job_id"])
+                        self._send({"op": "cancel", "job_id": msg["job_id"]})
+                    event = msg["event"]
+                    if event["type"] == "usage":
+                        # Cache lookups happen in the child: count them here for /cache and /metrics
+                        response_cache.record(event["data"].get("response_cache"))
+                    job.put(event)
+                elif msg["op"] == "done":
+                    cancel_sent.discard(msg["job_id"])
+                    self._finish(msg)
+        except (EOFError, OSError):
+            pass
+        except Exception as e:
+            # Nobody would read the child's events any more: stop it, fail its jobs below
+            print(f"Error in worker reader: {e}")
+            self.process.kill()
+
+        # Child exited (closed or crashed): fail whatever is still in flight
+        with self.cond:
+            self.closed = True
+            jobs = [job for job, _ in self.inflight.values()] + self.pending
+            self.inflight.clear()
+            self.pending = []
+        for job in jobs:
+            job.put({"type": "content", "data": "Error: worker process berhenti."})
+            job.finish()
+        self.process.wait()
+
+    def _finish(self, msg):
+        with self.cond:
+            job, shipped_len = self.inflight.pop(msg["job_id"])
+            conversation = job.conversation
+            # Apply what the turn changed: new messages, compacted old ones, window start
+            del conversation.history[shipped_len:]
+            conversation.history.extend(msg["tail"])
+            for index, compact in msg["compacts"].items():
+                conversation.history[index]["compact"] = compact
+            conversation.context_start = msg["context_start"]
+            job.trace.merge(msg.get("trace", [])) # Spans recorded in the child
+            self.busy.discard(conversation.id)
+            self._dispatch()
+        job.finish()
+
+# ==================================================
+# CHILD PROCESS
+# ==================================================
+class RemoteEvents:
+    """Job.events for the child: every put() is forwarded to the parent."""
+    def __init__(self, worker, job_id):
+        self.worker = worker
+        self.job_id = job_id
+
+    def put(self, event):
+        if event is not None: # End of job is reported by the "done" message
+            self.worker.send({"op": "event", "job_id": self.job_id, "event": event})
+
+class Worker:
+    def __init__(self, conn, filename, n_slots, n_cores):
+        from backend.core import Scheduler
+        from backend.config import ModelConfig
+        self.conn = conn
+        self.send_lock = threading.Lock()
+        self.jobs = {}
+        progress = lambda done, total: self.send({"op": "progress", "done": done, "total": total})
+        self.scheduler = Scheduler(ModelConfig(filename), n_slots=n_slots, n_cores=n_cores, on_progress=progress)
+
+    def send(self, msg):
+        with self.send_lock:
+            self.conn.send(msg)
+
+    def serve(self):
+        from backend.core import Job
+        from backend.sessions import Conversation
+        self.send({"op": "ready"})
+        while True:
+            try:
+                msg = self.conn.recv()
+            except (EOFError, OSError):
+                break
+            if msg["op"] == "submit":
+                data = msg["conversation"]
+                conversation = Conversation(data["id"], data["history"], data["context_start"])
+                compacted = {i for i, m in enumerate(conversation.history) if "compact" in m}
+                job = Job(
+                    conversation, msg["user_input"],
+                    on_finish=lambda conv, job_id=msg["job_id"], before=len(conversation.history), compacted=compacted:
+                        self._done(job_id, conv, before, compacted),
+                    events=RemoteEvents(self, msg["job_id"]),
+                    options=msg["options"],
+                )
+                job.submitted_at = msg["submitted_at"]
+                self.jobs[msg["job_id"]] = job
+                self.scheduler.submit(job)
+            elif msg["op"] == "cancel":
+                job = self.jobs.get(msg["job_id"])
+                if job is not None:
+                    job.cancelled = True
+            elif msg["op"] == "close":
+                break
+
+        # Let running jobs finish so their results reach the parent
+        self.scheduler.close()
+        for worker in self.scheduler.workers:
+            worker.join()
+
+    def _done(self, job_id, conversation, before, compacted):
+        job = self.jobs.pop(job_id, None)
+        history = conversation.history
+        self.send({
+            "trace": job.trace.events if job is not None and job.trace else [],
+            "op": "done",
+            "job_id": job_id,
+            "tail": history[before:],
+            "compacts": {
+                i: history[i]["compact"]
+                for i in range(min(before, len(history)))
+                if "compact" in history[i] and i not in compacted
+            },
+            "context_start": conversation.context_start,
+        })
+
+def main():
+    address, authkey, filename, n_slots, n_cores, cores = sys.argv[1:7]
+    conn = Client(address, authkey=bytes.fromhex(authkey))
+    if cores and hasattr(os, "sched_setaffinity"):
+        # Linux: keep this model on its own cores
+        os.sched_setaffinity(0, {int(c) for c in cores.split(",")})
+    try:
+        worker = Worker(conn, filename, int(n_slots), int(n_cores))
+    except Exception as e:
+        conn.send({"op": "error", "error": str(e)})
+        return
+    worker.serve()
+
+if __name__ == '__main__':
+    main()
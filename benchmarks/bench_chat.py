@@ -0,0 +1,303 @@
+"""
+Load benchmark for the /chat path: TTFT, inter-token latency, throughput, RSS.
+
+    # In-process engine, deterministic fake backend (no GGUF needed)
+    python -m benchmarks.bench_chat --fake --concurrency 4 --requests 32
+
+    # Same, through HTTP (server started in this process)
+    python -m benchmarks.bench_chat --fake --serve async --stream
+    python -m benchmarks.bench_chat --fake --serve flask --no-stream
+
+    # Coalesced / compact stream framing (itl_ms then measures time between frames)
+    python -m benchmarks.bench_chat --fake --serve async --stream-format compact --flush-ms 16 --flush-tokens 32
+
+    # Against a running server (pass its pid to sample its RSS)
+    python -m benchmarks.bench_chat --url http://127.0.0.1:5000 --server-pid 1234
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import atexit
+import shutil
+import argparse
+import tempfile
+import threading
+import urllib.request
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+
+WORDS = ("jelaskan cara kerja scheduler inference slot kv cache prompt token "
+         "streaming server konteks model memori").split()
+
+def make_prompt(n_words, seed):
+    return " ".join(WORDS[(seed + i) % len(WORDS)] for i in range(n_words))
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    k = (len(values) - 1) * p / 100
+    lo = int(k)
+    hi = min(lo + 1, len(values) - 1)
+    return values[lo] + (values[hi] - values[lo]) * (k - lo)
+
+# ==================================================
+# RSS SAMPLING
+# ==================================================
+def rss_mb(pid=None):
+    """Resident set size in MB (Linux /proc, falls back to peak RSS of this process)."""
+    try:
+        with open(f"/proc/{pid or 'self'}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    if pid is None:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / (1024 * 1024 if sys.platform == 'darwin' else 1024)
+    return 0.0
+
+class RssSampler:
+    def __init__(self, pid=None, interval=0.1):
+        self.pid = pid
+        self.interval = interval
+        self.start_mb = rss_mb(pid)
+        self.peak_mb = self.start_mb
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        while not self.stopped.wait(self.interval):
+            self.peak_mb = max(self.peak_mb, rss_mb(self.pid))
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+        return {"rss_start_mb": round(self.start_mb, 1), "rss_peak_mb": round(self.peak_mb, 1),
+                "rss_end_mb": round(rss_mb(self.pid), 1)}
+
+# ==================================================
+# DRIVERS (one request each, returns timings)
+# ==================================================
+def run_engine(engine, prompt, stream):
+    session_id = f"bench-{uuid.uuid4().hex}"
+    options = {"retrieve": False}
+    start = time.perf_counter()
+    stamps = []
+    usage = None
+    if stream:
+        for event in engine.generate_response(prompt, stream=True, session_id=session_id, options=options):
+            if event["type"] == "content":
+                stamps.append(time.perf_counter())
+            elif event["type"] == "usage":
+                usage = event["data"]
+    else:
+        result = engine.generate_response(prompt, stream=False, session_id=session_id, options=options)
+        stamps.append(time.perf_counter())
+        usage = result["usage"] if isinstance(result, dict) else None
+    return start, time.perf_counter(), stamps, usage
+
+def run_http(url, prompt, stream, stream_options=None):
+    payload = json.dumps({
+        "message": prompt,
+        "stream": stream,
+        "session_id": f"bench-{uuid.uuid4().hex}",
+        "retrieve": False,
+        **(stream_options or {}),
+    }).encode('utf-8')
+    req = urllib.request.Request(f"{url}/chat", data=payload, headers={"Content-Type": "application/json"})
+    start = time.perf_counter()
+    stamps = []
+    usage = None
+    with urllib.request.urlopen(req) as resp:
+        if stream and resp.headers.get("X-Lumino-Stream", "").startswith("compact"):
+            from backend.streaming import FrameDecoder
+            decoder = FrameDecoder()
+            while True:
+                data = resp.read1(65536)
+                if not data:
+                    break
+                for event in decoder.feed(data):
+                    if event["type"] == "token":
+                        stamps.append(time.perf_counter())
+                    elif event["type"] == "usage":
+                        usage = event["stats"]
+        elif stream:
+            for line in resp:
+                if not line.strip():
+                    continue
+                event = json.loads(line)
+                if event["type"] == "token":
+                    stamps.append(time.perf_counter())
+                elif event["type"] == "usage":
+                    usage = event["stats"]
+        else:
+            usage = json.loads(resp.read()).get("usage")
+            stamps.append(time.perf_counter())
+    return start, time.perf_counter(), stamps, usage
+
+# ==================================================
+# IN-PROCESS SERVER
+# ==================================================
+def serve_in_process(kind, port):
+    if kind == "async":
+        from backend import async_server
+        target = lambda: async_server.run(host='127.0.0.1', port=port)
+    else:
+        from main import app
+        target = lambda: app.run(host='127.0.0.1', port=port, debug=False, use_reloader=False)
+    threading.Thread(target=target, daemon=True).start()
+
+    url = f"http://127.0.0.1:{port}"
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            urllib.request.urlopen(f"{url}/ready", timeout=1).read() # 503 until a model is loaded
+            return url
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f"Server on port {port} did not come up")
+
+# ==================================================
+# REPORT
+# ==================================================
+def summarize(results, wall_s, stream):
+    ttft, itl, totals = [], [], []
+    completion_tokens = 0
+    drafted = accepted = 0
+    for start, end, stamps, usage in results:
+        totals.append((end - start) * 1000)
+        if stamps:
+            ttft.append((stamps[0] - start) * 1000)
+            itl.extend((b - a) * 1000 for a, b in zip(stamps, stamps[1:]))
+        if usage:
+            completion_tokens += usage.get("completion_tokens", 0)
+            drafted += usage.get("draft_tokens", 0)
+            accepted += usage.get("draft_accepted", 0)
+
+    def dist(values):
+        return {f"p{p}": round(percentile(values, p), 2) for p in (50, 95, 99)}
+
+    report = {
+        "requests": len(results),
+        "wall_s": round(wall_s, 3),
+        "requests_per_s": round(len(results) / wall_s, 2),
+        "completion_tokens": completion_tokens,
+        "tokens_per_s": round(completion_tokens / wall_s, 1),
+        "latency_ms": dist(totals),
+    }
+    if drafted:
+        report["draft_acceptance"] = round(accepted / drafted, 3)
+    if stream:
+        report["ttft_ms"] = dist(ttft)
+        report["itl_ms"] = dist(itl)
+    return report
+
+def print_report(report):
+    print(f"requests      {report['requests']} in {report['wall_s']}s "
+          f"({report['requests_per_s']} req/s)")
+    print(f"throughput    {report['tokens_per_s']} tok/s ({report['completion_tokens']} tokens)")
+    for key in ("ttft_ms", "itl_ms", "latency_ms"):
+        if key in report:
+            d = report[key]
+            print(f"{key:13} p50 {d['p50']:9.2f}   p95 {d['p95']:9.2f}   p99 {d['p99']:9.2f}")
+    if "draft_acceptance" in report:
+        print(f"drafting      {report['draft_acceptance'] * 100:.1f}% of drafted tokens accepted")
+    if "rss_peak_mb" in report:
+        print(f"server rss    start {report['rss_start_mb']} MB, peak {report['rss_peak_mb']} MB, "
+              f"end {report['rss_end_mb']} MB")
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--fake', action='store_true', help="Use benchmarks/fake_llama.py instead of llama_cpp")
+    parser.add_argument('--url', help="Benchmark a running server instead of the in-process engine")
+    parser.add_argument('--serve', choices=['flask', 'async'], help="Start the HTTP server in this process")
+    parser.add_argument('--port', type=int, default=5077)
+    parser.add_argument('--server-pid', type=int, help="Sample RSS of this pid (with --url)")
+    parser.add_argument('--stream', dest='stream', action='store_true', default=True)
+    parser.add_argument('--no-stream', dest='stream', action='store_false')
+    parser.add_argument('--stream-format', choices=['ndjson', 'compact'], default='ndjson')
+    parser.add_argument('--flush-ms', type=float, default=0, help="Coalesce stream tokens for up to this long")
+    parser.add_argument('--flush-tokens', type=int, default=1, help="... or until this many are buffered")
+    parser.add_argument('--concurrency', type=int, default=1)
+    parser.add_argument('--requests', type=int, default=16)
+    parser.add_argument('--warmup', type=int, default=1)
+    parser.add_argument('--prompt-words', type=int, default=64)
+    parser.add_argument('--max-tokens', type=int, default=128, help="Reply length")
+    parser.add_argument('--decode-tps', type=float, help="Fake backend decode speed")
+    parser.add_argument('--prompt-tps', type=float, help="Fake backend prompt eval speed")
+    parser.add_argument('--echo', action='store_true', help="Fake backend copies the prompt into the reply")
+    parser.add_argument('--draft', choices=['none', 'prompt_lookup'], help="Override the model's draft strategy")
+    parser.add_argument('--json', help="Write the report to this file")
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    if args.fake:
+        # Must happen before backend.core is imported; worker processes
+        # (LUMINO_PROCESS_WORKERS=1) inherit the same settings
+        os.environ["LUMINO_FAKE_LLAMA"] = "1"
+        os.environ["LUMINO_FAKE_TOKENS"] = str(args.max_tokens)
+        if args.decode_tps:
+            os.environ["LUMINO_FAKE_TPS"] = str(args.decode_tps)
+        if args.prompt_tps:
+            os.environ["LUMINO_FAKE_PROMPT_TPS"] = str(args.prompt_tps)
+        if args.echo:
+            os.environ["LUMINO_FAKE_ECHO"] = "1"
+    # Benchmark sessions must not end up in the real sessions/ folder
+    from backend import config
+    sessions_dir = tempfile.mkdtemp(prefix="lumino-bench-")
+    config.SESSIONS_DIR = Path(sessions_dir)
+    atexit.register(shutil.rmtree, sessions_dir, ignore_errors=True) # Runs after the engine's flush
+
+    stream_options = {"stream_format": args.stream_format, "flush_ms": args.flush_ms, "flush_tokens": args.flush_tokens}
+    sampler_pid = None
+    if args.url:
+        url = args.url.rstrip('/')
+        sampler_pid = args.server_pid
+        send = lambda prompt: run_http(url, prompt, args.stream, stream_options)
+    else:
+        from backend.core import engine
+        engine.start(wait=True)
+        if engine.active_config is None:
+            sys.exit("No model loaded (put a GGUF in models/ or use --fake)")
+        engine.active_config.gen_params["max_tokens"] = args.max_tokens
+        if args.draft:
+            # In-process slots only (worker processes keep their own config)
+            from backend.drafting import make_draft
+            engine.active_config.draft_params["strategy"] = None if args.draft == "none" else args.draft
+            for slot in getattr(engine.scheduler, "slots", []):
+                slot.draft = make_draft(engine.active_config, slot.model, type(slot.model), 1)
+                slot.model.draft_model = slot.draft
+        if args.serve:
+            url = serve_in_process(args.serve, args.port)
+            send = lambda prompt: run_http(url, prompt, args.stream, stream_options)
+        else:
+            send = lambda prompt: run_engine(engine, prompt, args.stream)
+
+    for i in range(args.warmup):
+        send(make_prompt(args.prompt_words, i))
+
+    sampler = RssSampler(sampler_pid) if (sampler_pid or not args.url) else None
+    prompts = [make_prompt(args.prompt_words, i) for i in range(args.requests)]
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        results = list(pool.map(send, prompts))
+    wall_s = time.perf_counter() - start
+
+    report = summarize(results, wall_s, args.stream)
+    report["config"] = {k: v for k, v in vars(args).items() if k != "json"}
+    if sampler is not None:
+        report.update(sampler.stop())
+    print_report(report)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+
+if __name__ == '__main__':
+    main()
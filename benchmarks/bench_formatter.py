@@ -0,0 +1,101 @@
+"""
+Micro-benchmark: StreamingCleaner vs the old regex chain of clean_markdown_text.
+
+    python -m benchmarks.bench_formatter --mb 4
+"""
+import re
+import time
+import random
+import argparse
+
+from frontend.formatter import StreamingCleaner, clean_markdown_text
+
+# --- Referensi: implementasi lama (rantai re.sub, tidak bisa streaming) ---
+LEGACY_REPLACEMENTS = {
+    r'\\times': '×', r'\\div': '÷', r'\\pm': '±', r'\\le': '≤', r'\\ge': '≥',
+    r'\\neq': '≠', r'\\approx': '≈', r'\\infty': '∞', r'\\pi': 'π', r'\\theta': 'θ',
+    r'\\alpha': 'α', r'\\beta': 'β', r'\\sum': '∑', r'\\prod': '∏', r'\\sqrt': '√',
+    r'\\int': '∫', r'\\rightarrow': '→', r'\*\*2': '²', r'\*\*3': '³',
+}
+
+def legacy_clean_markdown_text(text):
+    text = re.sub(r'<think>.*?</think>', '', text, flags=re.DOTALL)
+    text = text.replace('<think>', '').replace('</think>', '')
+    for latex, unicode_char in LEGACY_REPLACEMENTS.items():
+        text = re.sub(latex, unicode_char, text)
+    text = re.sub(r'(```\w*)\s*\n(#{1,6}\s)', r'\1\n```\n\n\2', text)
+    text = re.sub(r'(?<!\n)\n(#{1,6}\s)', r'\n\n\1', text)
+    text = re.sub(r'(\n\n|^)```\s*\n', r'\1```python\n', text)
+    text = re.sub(r'(```)\n(?!```)', r'\1\n\n', text)
+    text = re.sub(r'(\n)([*-] )', r'\1\n\2', text)
+    text = re.sub(r'(\n)(\d+\. )', r'\1\n\2', text)
+    text = re.sub(r'(?<!\|)\n(\|.*\|)', r'\n\n\1', text)
+    return text.strip()
+
+# --- Data uji ---
+BLOCKS = [
+    "<think>Pertama cek dulu asumsinya.\nLalu hitung.</think>\n",
+    "## Penjelasan\nNilai x**2 \\le 10 dan \\sqrt{x} \\approx 3, jadi \\alpha \\rightarrow \\beta.\n",
+    "- poin pertama\n- poin kedua\n1. langkah satu\n2. langkah dua\n",
+    "| kolom | nilai |\n|---|---|\n| a | 1 |\n| b | 2 |\n",
+    "```python\ndef f(x):\n    return x * 2\n```\nKode di atas mengalikan input.\n",
+    "Paragraf biasa yang cukup panjang untuk mensimulasikan jawaban model bahasa. " * 3 + "\n\n",
+]
+
+def make_text(size_bytes, seed=0):
+    rng = random.Random(seed)
+    parts, total = [], 0
+    while total < size_bytes:
+        block = rng.choice(BLOCKS)
+        parts.append(block)
+        total += len(block)
+    return "".join(parts)
+
+def chunked(text, seed=0):
+    """Potong seperti token stream: 1-12 karakter per chunk."""
+    rng = random.Random(seed)
+    i = 0
+    while i < len(text):
+        n = rng.randint(1, 12)
+        yield text[i:i + n]
+        i += n
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - start
+
+def run_streaming(chunks):
+    cleaner = StreamingCleaner()
+    out = [cleaner.feed(chunk) for chunk in chunks]
+    out.append(cleaner.finish())
+    return "".join(out)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--mb', type=float, default=4.0, help="Ukuran teks uji (MB)")
+    args = parser.parse_args()
+
+    text = make_text(int(args.mb * 1024 * 1024))
+    chunks = list(chunked(text))
+    mb = len(text.encode('utf-8')) / 1024 / 1024
+    print(f"Input: {mb:.2f} MB, {len(chunks)} stream chunks")
+
+    legacy, t_legacy = timed(legacy_clean_markdown_text, text)
+    full, t_full = timed(clean_markdown_text, text)
+    streamed, t_stream = timed(run_streaming, chunks)
+
+    print(f"{'legacy regex chain (full text)':34} {t_legacy:8.3f}s {mb / t_legacy:8.1f} MB/s")
+    print(f"{'StreamingCleaner (full text)':34} {t_full:8.3f}s {mb / t_full:8.1f} MB/s")
+    print(f"{'StreamingCleaner (streamed)':34} {t_stream:8.3f}s {mb / t_stream:8.1f} MB/s")
+    print(f"streamed == full text: {streamed == full}")
+
+    # The old function can only clean the complete text, so live rendering
+    # would have to re-run it on the whole prefix every frame
+    frames = 100
+    step = max(1, len(text) // frames)
+    _, t_frames = timed(lambda: [legacy_clean_markdown_text(text[:i]) for i in range(step, len(text) + 1, step)])
+    print(f"{'legacy, re-run per frame (x%d)' % frames:34} {t_frames:8.3f}s")
+
+if __name__ == '__main__':
+    main()
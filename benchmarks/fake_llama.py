@@ -0,0 +1,133 @@
+"""
+Deterministic stand-in for llama_cpp.Llama, used by the benchmarks.
+
+    LUMINO_FAKE_LLAMA=1 python main.py --async
+
+Tokens are bytes (id = byte + 3), prompt evaluation and decoding sleep at a
+fixed rate, and every reply is the same text. Timing differences between
+runs therefore come from the serving layer, not from the model.
+
+Rates come from the environment (or FAKE_PARAMS directly, in-process):
+    LUMINO_FAKE_PROMPT_TPS   prompt eval speed, tokens/s   (default 2000)
+    LUMINO_FAKE_TPS          decode speed, tokens/s        (default 50)
+    LUMINO_FAKE_TOKENS       reply length in tokens        (default 128)
+    LUMINO_FAKE_ECHO=1       reply copies the prompt (code-editing workload)
+"""
+import os
+import json
+import time
+
+import numpy as np
+
+FAKE_PARAMS = {
+    "prompt_tps": float(os.environ.get("LUMINO_FAKE_PROMPT_TPS", 2000)),
+    "tps": float(os.environ.get("LUMINO_FAKE_TPS", 50)),
+    "tokens": int(os.environ.get("LUMINO_FAKE_TOKENS", 128)),
+    "echo": os.environ.get("LUMINO_FAKE_ECHO") == "1",
+}
+
+REPLY_TEXT = (
+    "Ini adalah jawaban deterministik dari backend palsu untuk benchmark. "
+    "Setiap token dikirim dengan kecepatan tetap sehingga hasil pengukuran "
+    "hanya dipengaruhi oleh lapisan server, scheduler, dan streaming. "
+)
+
+BOS_ID = 1
+EOS_ID = 2
+OFFSET = 3
+
+class FakeLlama:
+    def __init__(self, model_path=None, n_ctx=512, **kwargs):
+        self.model_path = model_path
+        self._n_ctx = n_ctx
+        self.n_tokens = 0
+        self.input_ids = []
+        self.draft_model = kwargs.get("draft_model")
+        self.reply = REPLY_TEXT.encode('utf-8')
+
+    def n_ctx(self):
+        return self._n_ctx
+
+    def token_eos(self):
+        return EOS_ID
+
+    def tokenize(self, text, add_bos=True, special=False):
+        tokens = [b + OFFSET for b in text]
+        return [BOS_ID] + tokens if add_bos else tokens
+
+    def detokenize(self, tokens, prev_tokens=None, special=False):
+        return bytes(t - OFFSET for t in tokens if t >= OFFSET)
+
+    def n_vocab(self):
+        return 256 + OFFSET
+
+    def generate(self, tokens, reset=True, **kwargs):
+        if reset:
+            self.n_tokens = 0
+        sequence = self.input_ids[:self.n_tokens] + list(tokens)
+        # Prompt eval: one batch, proportional to the uncached tokens
+        time.sleep(len(tokens) / FAKE_PARAMS["prompt_tps"])
+        self.n_tokens += len(tokens)
+
+        if FAKE_PARAMS["echo"]:
+            # "Code editing": the reply copies a span of the prompt
+            middle = len(sequence) // 2
+            reply = [t for t in sequence[middle:] if t >= OFFSET]
+        else:
+            reply = [b + OFFSET for b in self.reply]
+
+        n = FAKE_PARAMS["tokens"]
+        delay = 1.0 / FAKE_PARAMS["tps"]
+        i = 0
+        draft = []
+        while i < n:
+            if i:
+                time.sleep(delay) # One forward pass: last token + the whole draft
+            # Drafted tokens that match are accepted in the same pass
+            for token in draft:
+                if i >= n or token != reply[i % len(reply)]:
+                    break
+                i += 1
+                sequence.append(token)
+                self.input_ids = sequence
+                yield token
+                self.n_tokens += 1
+            if i >= n:
+                break
+            token = reply[i % len(reply)]
+            i += 1
+            sequence.append(token)
+            self.input_ids = sequence
+            yield token
+            self.n_tokens += 1 # The sampled token is evaluated on the next step
+            if self.draft_model is not None:
+                draft = [int(t) for t in self.draft_model(np.asarray(sequence, dtype=np.intc))]
+        yield EOS_ID
+
+    # --- Used by backend/tuning.py -------------------------------------------
+    def reset(self):
+        self.n_tokens = 0
+
+    def eval(self, tokens):
+        rate = FAKE_PARAMS["prompt_tps"] if len(tokens) > 1 else FAKE_PARAMS["tps"]
+        time.sleep(len(tokens) / rate)
+        self.n_tokens += len(tokens)
+
+    def set_seed(self, seed):
+        pass # Replies are deterministic anyway
+
+class FakeGrammar:
+    """Stand-in for llama_cpp.LlamaGrammar: validates the source, constrains nothing."""
+    def __init__(self, text):
+        self.text = text
+
+    @classmethod
+    def from_string(cls, grammar, verbose=True):
+        if "root" not in grammar:
+            raise ValueError("grammar has no root rule")
+        return cls(grammar)
+
+    @classmethod
+    def from_json_schema(cls, json_schema, verbose=True):
+        json.loads(json_schema)
+        return cls(json_schema)
@@ -4,6 +4,7 @@ import time
 import os
 import json
 import random
+import uuid
 import msvcrt
 from datetime import datetime
 from rich.console import Console
@@ -20,6 +21,9 @@ from rich.layout import Layout
 from rich.table import Table
 from rich.syntax import Syntax
 
+from frontend.formatter import IncrementalMarkdown, FrameBudget
+from backend.streaming import FrameDecoder
+
 # --- 1. SETUP INPUT (SILENT FALLBACK) ---
 USE_PROMPT_TOOLKIT = False
 session = None
@@ -58,6 +62,11 @@ except Exception:
 API_URL = "http://127.0.0.1:5000/chat"
 MODELS_URL = "http://127.0.0.1:5000/models"
 SET_MODEL_URL = "http://127.0.0.1:5000/model/set"
+MODEL_STATUS_URL = "http://127.0.0.1:5000/model/status"
+READY_URL = "http://127.0.0.1:5000/ready"
+
+# Stream framing: length-prefixed text frames, tokens coalesced per ~frame (see backend/streaming.py)
+STREAM_OPTIONS = {"stream_format": "compact", "flush_ms": 16, "flush_tokens": 32}
 
 console = Console()
 
@@ -72,6 +81,22 @@ C_TEXT = "white"                # Text (#cdd6f4)
 
 # GLOBAL STATE
 CURRENT_MODEL = "Unknown"
+SESSION_ID = uuid.uuid4().hex # Own conversation on the server
+
+def read_stream(response):
+    """Wire events of a /chat stream, in whichever framing the server answered with."""
+    if response.headers.get("X-Lumino-Stream", "").startswith("compact"):
+        decoder = FrameDecoder()
+        for data in response.iter_content(chunk_size=None):
+            yield from decoder.feed(data)
+        return
+    # NDJSON (older servers, or compact not negotiated)
+    for line in response.iter_lines():
+        if line:
+            try:
+                yield json.loads(line.decode('utf-8'))
+            except json.JSONDecodeError:
+                pass
 
 def show_intro():
     # Aggressive Clear to wipe history
@@ -92,6 +117,29 @@ def show_intro():
     console.print(Align.center(Rule(style=f"dim {C_DIM}", characters="─")))
     console.print()
 
+def wait_until_ready(timeout=300):
+    """Poll /ready until the server has a model loaded (replaces the fixed startup sleep)."""
+    global CURRENT_MODEL
+    deadline = time.time() + timeout
+    with console.status("[dim]Starting server...[/]", spinner="dots", spinner_style=C_PRIMARY) as status:
+        while time.time() < deadline:
+            try:
+                info = requests.get(READY_URL, timeout=2).json()
+            except (requests.exceptions.RequestException, ValueError):
+                time.sleep(0.05) # Socket not listening yet
+                continue
+            if info.get("ready"):
+                CURRENT_MODEL = info["model"].replace(".gguf", "").title()
+                return True
+            if info.get("state") in ("error", "no_models"):
+                console.print(f"[{C_ERROR}]Model failed to load: {info.get('error') or 'no models found'}[/]")
+                return False
+            progress = int(info.get("progress", 0) * 100)
+            status.update(f"[dim]Loading {info.get('model')}... {progress}%[/]")
+            time.sleep(0.1)
+    console.print(f"[{C_ERROR}]Server not ready after {timeout}s[/]")
+    return False
+
 def handle_model_switch():
     """Interactive Model Switcher (Client-Side UI)"""
     global CURRENT_MODEL
@@ -174,9 +222,22 @@ def handle_model_switch():
         selected_model = available_models[selected_index]
         
         console.print()
-        with console.status(f"[dim]Switching to {selected_model}...[/]", spinner="dots", spinner_style=C_PRIMARY):
+        with console.status(f"[dim]Switching to {selected_model}...[/]", spinner="dots", spinner_style=C_PRIMARY) as status:
             resp = requests.post(SET_MODEL_URL, json={"model": selected_model})
             resp.raise_for_status()
+
+            # Cold model: server loads it in the background, poll until active
+            if resp.json().get("status") == "loading":
+                while True:
+                    time.sleep(0.25)
+                    info = requests.get(MODEL_STATUS_URL).json()
+                    if info.get("active") == selected_model:
+                        break
+                    model_info = info.get("models", {}).get(selected_model, {})
+                    if model_info.get("state") == "error":
+                        raise RuntimeError(model_info.get("error", "Failed to load model"))
+                    progress = int(model_info.get("progress", 0) * 100)
+                    status.update(f"[dim]Loading {selected_model}... {progress}%[/]")
             
         # Update Global State
         CURRENT_MODEL = selected_model.replace(".gguf", "").title()
@@ -258,39 +319,6 @@ def create_hud_panel(content, title=None, border_style=C_DIM, subtitle=None):
         subtitle_align="right"
     )
 
-def get_smart_tail(full_text, max_lines=30):
-    """
-    Mengambil N baris terakhir dari teks, tapi tetap menjaga konteks Markdown (Code Block).
-    """
-    lines = full_text.splitlines()
-    if len(lines) <= max_lines:
-        return full_text
-    
-    # Ambil tail
-    tail_lines = lines[-max_lines:]
-    prefix_lines = lines[:-max_lines]
-    prefix_text = "\n".join(prefix_lines)
-    
-    # Cek status Code Block di prefix
-    # Hitung jumlah ```
-    code_block_markers = prefix_text.count("```")
-    in_code_block = (code_block_markers % 2 != 0)
-    
-    if in_code_block:
-        # Kita ada di dalam code block yang terpotong.
-        # Cari bahasa dari block terakhir di prefix
-        last_marker_idx = prefix_text.rfind("```")
-        # Ambil baris setelah marker
-        marker_line_end = prefix_text.find("\n", last_marker_idx)
-        if marker_line_end == -1: marker_line_end = len(prefix_text)
-        
-        lang_tag = prefix_text[last_marker_idx+3 : marker_line_end].strip()
-        
-        # Tambahkan header block buatan di awal tail
-        return f"``` {lang_tag} (continued)...\n" + "\n".join(tail_lines)
-    else:
-        return "\n".join(tail_lines)
-
 def run():
     global USE_PROMPT_TOOLKIT, session 
     
@@ -326,56 +354,52 @@ def run():
             try:
                 start_time = time.time()
                 
-                payload = {"message": user_input, "stream": True}
+                payload = {"message": user_input, "stream": True, "session_id": SESSION_ID, **STREAM_OPTIONS}
                 
                 full_response = ""
                 files_read = []
+                context_read = []
                 token_stats = None
                 
                 with requests.post(API_URL, json=payload, stream=True) as response:
                     response.raise_for_status()
                     
-                    # OPTIMIZED: Token batching for better CPU efficiency
+                    # Incremental render: finished blocks are cached, only the
+                    # open tail is re-parsed; refresh is paced by frame time
+                    renderer = IncrementalMarkdown(code_theme="monokai")
+                    frames = FrameBudget()
                     with Live(create_hud_panel(Align.center(Text("Processing...", style=f"dim {C_PRIMARY}"))), 
                               console=console, 
-                              refresh_per_second=6,  # Balanced refresh rate
+                              auto_refresh=False,
                               vertical_overflow="visible",
                               screen=True) as live:
                         try:
-                            token_count = 0
-                            for line in response.iter_lines():
-                                if line:
-                                    try:
-                                        chunk = json.loads(line.decode('utf-8'))
+                            for chunk in read_stream(response):
+                                if chunk['type'] == 'token':
+                                    token = chunk['content']
+                                    full_response += token
+                                    renderer.feed(token)
+                                    
+                                    if frames.due():
+                                        render_start = time.perf_counter()
+                                        safe_height = console.height - 10 
+                                        if safe_height < 10: safe_height = 10
+                                        renderer.max_lines = safe_height
                                         
-                                        if chunk['type'] == 'token':
-                                            token = chunk['content']
-                                            full_response += token
-                                            token_count += 1
-                                            
-                                            # Update every 3 tokens for better performance
-                                            if token_count % 3 == 0:
-                                                safe_height = console.height - 10 
-                                                if safe_height < 10: safe_height = 10
-                                                
-                                                # Ambil Smart Tail
-                                                render_text = get_smart_tail(full_response, max_lines=safe_height)
-                                                
-                                                # Update Live Panel
-                                                live.update(create_hud_panel(
-                                                    Markdown(render_text, code_theme="monokai"),
-                                                    border_style=C_DIM,
-                                                    subtitle="[dim]▼ Auto-scrolling[/]" if len(full_response.splitlines()) > safe_height else None
-                                                ))
-                                            
-                                        elif chunk['type'] == 'usage':
-                                            token_stats = chunk.get('stats')
-                                            
-                                        elif chunk['type'] == 'info':
-                                            files_read = chunk.get('files', [])
-                                            
-                                    except json.JSONDecodeError:
-                                        pass
+                                        # Update Live Panel
+                                        live.update(create_hud_panel(
+                                            renderer,
+                                            border_style=C_DIM,
+                                            subtitle="[dim]▼ Auto-scrolling[/]" if renderer.line_count > safe_height else None
+                                        ), refresh=True)
+                                        frames.rendered(time.perf_counter() - render_start)
+                                    
+                                elif chunk['type'] == 'usage':
+                                    token_stats = chunk.get('stats')
+                                    
+                                elif chunk['type'] == 'info':
+                                    files_read = chunk.get('files', [])
+                                    context_read = chunk.get('context', [])
                         except KeyboardInterrupt:
                             full_response += f"\n\n[{C_ERROR}]Interrupted[/]"
                             pass
@@ -387,10 +411,16 @@ def run():
                     footer_parts = []
                     
                     if token_stats:
-                        t_out = token_stats.get('completion_tokens', 0)
-                        if t_out > 0 and (end_time - start_time) > 0:
-                            speed = t_out / (end_time - start_time)
+                        # Server-side timings (exclude network & rendering)
+                        speed = token_stats.get('decode_tps')
+                        if speed is None:
+                            t_out = token_stats.get('completion_tokens', 0)
+                            if t_out > 0 and (end_time - start_time) > 0:
+                                speed = t_out / (end_time - start_time)
+                        if speed:
                             footer_parts.append(f"{speed:.1f} t/s")
+                        if token_stats.get('ttft_ms') is not None:
+                            footer_parts.append(f"TTFT {token_stats['ttft_ms'] / 1000:.2f}s")
                         footer_parts.append(f"{token_stats.get('total_tokens', 0)} toks")
                     
                     footer = f"[dim]{' · '.join(footer_parts)}[/]" if footer_parts else None
@@ -405,6 +435,8 @@ def run():
                     if files_read:
                         file_list = ", ".join([f"'{f}'" for f in files_read])
                         console.print(f"   [{C_ACCENT}]📎[/][dim] {file_list}[/]")
+                    if context_read:
+                        console.print(f"   [{C_ACCENT}]🔎[/][dim] {', '.join(context_read)}[/]")
 
             except requests.exceptions.ConnectionError:
                 console.print(f"[{C_ERROR}]Server Unreachable[/]")
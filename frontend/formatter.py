@@ -1,5 +1,7 @@
 import re
+import time
 from rich.markdown import Markdown
+from rich.segment import Segment
 from rich.panel import Panel
 from rich import box
 from rich.console import Console
@@ -21,77 +23,293 @@ console = Console(theme=Theme(custom_styles), force_terminal=True, color_system=
 
 THEME_CODE_BLOCK = "monokai" 
 
+# Sisa-sisa LaTeX -> Unicode. Tidak ada key yang menjadi prefix key lain,
+# jadi satu alternation ter-compile cukup untuk semua (sekali jalan).
+LATEX_TO_UNICODE = {
+    '\\times': '×',
+    '\\div': '÷',
+    '\\pm': '±',
+    '\\le': '≤',
+    '\\ge': '≥',
+    '\\neq': '≠',
+    '\\approx': '≈',
+    '\\infty': '∞',
+    '\\pi': 'π',
+    '\\theta': 'θ',
+    '\\alpha': 'α',
+    '\\beta': 'β',
+    '\\sum': '∑',
+    '\\prod': '∏',
+    '\\sqrt': '√',
+    '\\int': '∫',
+    '\\rightarrow': '→',
+    '**2': '²',
+    '**3': '³',
+}
+LATEX_PATTERN = re.compile("|".join(
+    re.escape(key) for key in sorted(LATEX_TO_UNICODE, key=len, reverse=True)
+))
+
+THINK_OPEN = "<think>"
+THINK_CLOSE = "</think>"
+
+HEADER_PATTERN = re.compile(r'#{1,6}\s')
+LIST_PATTERN = re.compile(r'(?:[*-] |\d+\. )')
+
+def _prefixes(words):
+    return {word[:i] for word in words for i in range(1, len(word))}
+
+LATEX_PREFIXES = _prefixes(LATEX_TO_UNICODE)
+LATEX_MAX_LEN = max(len(key) for key in LATEX_TO_UNICODE)
+THINK_PREFIXES = _prefixes([THINK_OPEN, THINK_CLOSE])
+
+def _unresolved_tail(text, prefixes, max_len):
+    """Panjang suffix terpanjang dari text yang masih bisa tumbuh menjadi pattern."""
+    for i in range(max(0, len(text) - max_len + 1), len(text)):
+        if text[i:] in prefixes:
+            return len(text) - i
+    return 0
+
+def _latex_sub(match):
+    return LATEX_TO_UNICODE[match.group(0)]
+
 def replace_latex_with_unicode(text):
     """
     Mengubah sisa-sisa LaTeX menjadi Unicode agar cantik di Terminal.
     """
-    replacements = {
-        r'\\times': '×',
-        r'\\div': '÷',
-        r'\\pm': '±',
-        r'\\le': '≤',
-        r'\\ge': '≥',
-        r'\\neq': '≠',
-        r'\\approx': '≈',
-        r'\\infty': '∞',
-        r'\\pi': 'π',
-        r'\\theta': 'θ',
-        r'\\alpha': 'α',
-        r'\\beta': 'β',
-        r'\\sum': '∑',
-        r'\\prod': '∏',
-        r'\\sqrt': '√',
-        r'\\int': '∫',
-        r'\\rightarrow': '→',
-        r'\*\*2': '²', 
-        r'\*\*3': '³',
-    }
-    
-    for latex, unicode_char in replacements.items():
-        text = re.sub(latex, unicode_char, text)
-        
-    return text
+    return LATEX_PATTERN.sub(_latex_sub, text)
+
+class _ThinkFilter:
+    """Membuang <think>...</think> selagi teks masuk."""
+    def __init__(self):
+        self.buffer = ""
+        self.hidden = "" # Isi think yang belum ditutup
+        self.in_think = False
+
+    def feed(self, text):
+        buffer = self.buffer + text
+        out = []
+        pos = 0
+        while True:
+            if self.in_think:
+                end = buffer.find(THINK_CLOSE, pos)
+                if end == -1:
+                    hold = _unresolved_tail(buffer, THINK_PREFIXES, len(THINK_CLOSE))
+                    self.hidden += buffer[pos:max(pos, len(buffer) - hold)]
+                    pos = max(pos, len(buffer) - hold)
+                    break
+                self.hidden = ""
+                pos = end + len(THINK_CLOSE)
+                self.in_think = False
+                continue
+
+            start = buffer.find(THINK_OPEN, pos)
+            close = buffer.find(THINK_CLOSE, pos, start if start != -1 else len(buffer))
+            if close != -1:
+                # Closing tag yang bocor tanpa pembuka
+                out.append(buffer[pos:close])
+                pos = close + len(THINK_CLOSE)
+                continue
+            if start != -1:
+                out.append(buffer[pos:start])
+                pos = start + len(THINK_OPEN)
+                self.in_think = True
+                continue
+
+            hold = _unresolved_tail(buffer, THINK_PREFIXES, len(THINK_CLOSE))
+            end = max(pos, len(buffer) - hold)
+            out.append(buffer[pos:end])
+            pos = end
+            break
+        self.buffer = buffer[pos:]
+        return "".join(out)
+
+    def finish(self):
+        # <think> tanpa penutup: cuma tag-nya yang dibuang, isinya tetap
+        rest = self.hidden + self.buffer if self.in_think else self.buffer
+        self.buffer = self.hidden = ""
+        self.in_think = False
+        return rest.replace(THINK_OPEN, "").replace(THINK_CLOSE, "")
+
+class StreamingCleaner:
+    """
+    Versi streaming dari clean_markdown_text: satu kali scan per karakter,
+    bisa diberi potongan teks selagi model masih generate.
+
+    feed() mengembalikan teks bersih yang sudah pasti; yang ditahan hanya
+    suffix yang belum bisa diputuskan: tag <think> yang terpotong, prefix
+    LaTeX, whitespace di ujung, dan awal baris yang belum jelas jenisnya
+    (header / list / tabel / code fence). Aturan layout tidak diterapkan
+    di dalam code block, supaya kode (mis. `x**2`, `# komentar`) tidak rusak.
+    """
+    def __init__(self):
+        self.think = _ThinkFilter()
+        self.line = "" # Baris yang sedang berjalan (raw)
+        self.emitted = 0 # Jumlah karakter self.line yang sudah dikirim
+        self.kind = None # Jenis baris berjalan, None = belum diputuskan
+        self.blanks = 0 # Baris kosong yang ditahan
+        self.started = False # Sudah ada konten non-whitespace yang dikirim
+        self.prev = None # Jenis baris terakhir yang dikirim
+        self.prev_table_end = False # Baris terakhir diakhiri '|'
+        self.fence = None # Marker code fence yang sedang terbuka
+        self.fence_empty = False
+        self.after_fence = False # Baris sebelumnya menutup code fence
+        self.trailing = "" # Whitespace di ujung baris terakhir (dibuang kalau di akhir teks)
+
+    def feed(self, text):
+        return self._feed_lines(self.think.feed(text))
+
+    def finish(self):
+        out = self._feed_lines(self.think.finish())
+        return out + self._advance(complete=False, final=True)
+
+    def _feed_lines(self, text):
+        out = []
+        pos = 0
+        while pos < len(text):
+            nl = text.find("\n", pos)
+            if nl == -1:
+                self.line += text[pos:]
+                out.append(self._advance(complete=False))
+                break
+            self.line += text[pos:nl]
+            pos = nl + 1
+            out.append(self._advance(complete=True))
+        return "".join(out)
+
+    # --- Line handling -------------------------------------------------
+    def _classify(self, line, complete):
+        """Jenis baris, atau None kalau masih perlu karakter berikutnya."""
+        if self.fence:
+            if self.fence_empty and HEADER_PATTERN.match(line):
+                return "header" # Fence kosong langsung diikuti header (artefak)
+            if line[:1] == self.fence[0] or (self.fence_empty and line[:1] == "#"):
+                if not complete:
+                    return None
+                stripped = line.strip()
+                if stripped.startswith(self.fence) and not stripped.strip(self.fence[0]):
+                    return "fence_close"
+            return "code"
+
+        if not line.strip():
+            return "blank" if complete else None
+
+        first = line[0]
+        if first in "`~|" and not complete:
+            return None
+        if first in "`~" and line.startswith(first * 3):
+            return "fence_open"
+        if first == "|":
+            return "table" if line.count("|") >= 2 else "plain"
+        if first == "#":
+            if HEADER_PATTERN.match(line):
+                return "header"
+            if not complete and not line.strip("#"):
+                return None
+            return "plain"
+        if first in "*-" or first.isdigit():
+            if LIST_PATTERN.match(line):
+                return "list"
+            if not complete and (len(line) < 2 or (first.isdigit() and line.rstrip(".").isdigit())):
+                return None
+        return "plain"
+
+    def _open_line(self, kind):
+        """Separator + baris kosong sebelum baris baru, sesuai aturan layout."""
+        if kind == "blank":
+            self.blanks += 1
+            return ""
+
+        prefix, self.trailing = self.trailing, ""
+        if self.fence and self.fence_empty and kind == "header":
+            # 1. Hapus artefak: code fence kosong sebelum header -> tutup dulu
+            prefix += "\n```"
+            self.fence = None
+            self.blanks = max(self.blanks, 1)
+            self.prev = "fence_close"
+
+        blanks = self.blanks
+        if self.started and not self.fence:
+            prev_open = self.prev not in (None, "blank") and blanks == 0
+            if kind == "header" and prev_open:
+                blanks = 1 # 2. Header selalu punya jarak
+            elif kind == "list" and prev_open:
+                blanks = 1 # 5. Rapikan list
+            elif kind == "table" and prev_open and not self.prev_table_end:
+                blanks = 1 # 6. Rapikan tabel
+            elif self.after_fence and kind != "fence_open" and blanks == 0:
+                blanks = 1 # 4. Jarak setelah penutup code block
+
+        self.blanks = 0
+        self.after_fence = False
+        if not self.started:
+            return prefix
+        return prefix + "\n" * (blanks + 1)
+
+    def _advance(self, complete, final=False):
+        line = self.line
+        if not self.started and self.kind is None:
+            line = self.line = line.lstrip() # 7. Trim whitespace awal
+
+        out = ""
+        if self.kind is None:
+            kind = self._classify(line, complete or final)
+            if kind is None:
+                return ""
+            if kind == "blank" or (final and not line):
+                if complete:
+                    self._open_line("blank")
+                    self.line = ""
+                return ""
+            if kind == "fence_open" and line.strip() == "```" and (not self.started or self.blanks):
+                line = self.line = "```python" # 3. Auto-inject python
+            out = self._open_line(kind)
+            self.kind = kind
+            self.started = True
+
+        # Kirim isi baris yang sudah pasti
+        pending = line[self.emitted:]
+        if final:
+            pending = pending.rstrip()
+        hold = len(pending) - len(pending.rstrip())
+        if not complete and not final and self.kind not in ("code", "fence_open", "fence_close"):
+            hold = max(hold, _unresolved_tail(pending, LATEX_PREFIXES, LATEX_MAX_LEN))
+        chunk = pending[:len(pending) - hold]
+        self.emitted += len(chunk)
+        if self.kind not in ("code", "fence_open", "fence_close") and ("\\" in chunk or "*" in chunk):
+            chunk = replace_latex_with_unicode(chunk)
+        out += chunk
+
+        if complete:
+            self.trailing = line[self.emitted:]
+            self._close_line()
+        return out
+
+    def _close_line(self):
+        kind, line = self.kind, self.line
+        if kind == "fence_open":
+            stripped = line.strip()
+            marker = stripped[0]
+            self.fence = marker * (len(stripped) - len(stripped.lstrip(marker)))
+            self.fence_empty = True
+        elif kind == "fence_close":
+            self.fence = None
+            self.after_fence = True
+        elif kind == "code":
+            self.fence_empty = False
+        self.prev = kind
+        self.prev_table_end = line.rstrip().endswith("|")
+        self.line = ""
+        self.emitted = 0
+        self.kind = None
 
 def clean_markdown_text(text):
     """
     Membersihkan format teks AI dengan logika PINTAR.
+    (Satu kali jalan lewat StreamingCleaner; untuk stream pakai class-nya langsung.)
     """
-
-    # --- [FITUR BARU] HAPUS THINKING PROCESS DEEPSEEK ---
-    # Menghapus apapun yang ada di dalam <think>...</think>
-    # flags=re.DOTALL penting agar titik (.) bisa memakan baris baru (enter)
-    text = re.sub(r'<think>.*?</think>', '', text, flags=re.DOTALL)
-    
-    # Hapus sisa tag jika ada yang bocor (misal closing tag doang)
-    text = text.replace('<think>', '').replace('</think>', '')
-    # ----------------------------------------------------
-    
-    # 0. Konversi LaTeX ke Unicode
-    text = replace_latex_with_unicode(text)
-
-    # 1. HAPUS ARTIFAK SEBELUM HEADER
-    text = re.sub(r'(```\w*)\s*\n(#{1,6}\s)', r'\1\n```\n\n\2', text)
-
-    # 2. PASTIKAN HEADER PUNYA JARAK
-    text = re.sub(r'(?<!\n)\n(#{1,6}\s)', r'\n\n\1', text)
-
-    # 3. AUTO-INJECT PYTHON (Hanya jika belum ada lang)
-    text = re.sub(r'(\n\n|^)```\s*\n', r'\1```python\n', text)
-
-    # 4. BERSIHKAN PENUTUP CODE BLOCK
-    text = re.sub(r'(```)\n(?!```)', r'\1\n\n', text)
-    
-    # 5. RAPIKAN LIST (Bullet & Numbering)
-    text = re.sub(r'(\n)([*-] )', r'\1\n\2', text)
-    text = re.sub(r'(\n)(\d+\. )', r'\1\n\2', text)
-    
-    # 6. RAPIKAN TABEL
-    text = re.sub(r'(?<!\|)\n(\|.*\|)', r'\n\n\1', text)
-    
-    # 7. TRIM WHITESPACE AWAL (Biar gak ada spasi kosong di atas panel)
-    text = text.strip()
-
-    return text
+    cleaner = StreamingCleaner()
+    return cleaner.feed(text) + cleaner.finish()
 
 def create_styled_panel(text, title="Lumino"):
     """
@@ -117,4 +335,116 @@ def create_styled_panel(text, title="Lumino"):
         expand=True 
     )
 
-    return panel
\ No newline at end of file
+    return panel
+
+class IncrementalMarkdown:
+    """
+    Renderable untuk response yang sedang di-stream.
+
+    Teks dipecah menjadi blok yang sudah selesai (paragraf, tabel, list yang
+    ditutup baris kosong, code fence yang sudah ditutup) dan satu blok
+    terakhir yang masih terbuka. Blok selesai di-render sekali lalu disimpan
+    sebagai baris Segment; tiap frame hanya blok terakhir yang di-parse ulang.
+    Hanya `max_lines` baris terakhir yang ditampilkan (auto-scroll).
+    """
+    def __init__(self, max_lines=30, code_theme=THEME_CODE_BLOCK):
+        self.max_lines = max_lines
+        self.code_theme = code_theme
+        self.blocks = [] # Finished markdown blocks (source)
+        self.tail = "" # Open trailing block
+        self.line_count = 0 # Lines produced by the last render
+
+        self._scan = 0 # Offset in tail of the first line not yet classified
+        self._fence = None # Marker of the open code fence (``` / ~~~), if any
+        self._lines = [] # Cached rendered lines of self.blocks
+        self._rendered_blocks = 0
+        self._width = None
+
+    def feed(self, text):
+        self.tail += text
+        self._split()
+
+    def _cut(self, end):
+        block = self.tail[:end]
+        self.tail = self.tail[end:]
+        if block.strip():
+            self.blocks.append(block)
+
+    def _split(self):
+        pos = self._scan
+        while True:
+            nl = self.tail.find("\n", pos)
+            if nl == -1:
+                break
+            stripped = self.tail[pos:nl].strip()
+            next_pos = nl + 1
+
+            if self._fence:
+                # Closing fence: only fence chars, at least as long as the opener
+                if stripped.startswith(self._fence) and not stripped.strip(self._fence[0]):
+                    self._fence = None
+                    self._cut(next_pos)
+                    next_pos = 0
+            elif stripped.startswith("```") or stripped.startswith("~~~"):
+                marker = stripped[0]
+                self._fence = marker * (len(stripped) - len(stripped.lstrip(marker)))
+            elif not stripped:
+                # Blank line ends a paragraph / table / list
+                self._cut(next_pos)
+                next_pos = 0
+            pos = next_pos
+        self._scan = pos
+
+    def _render_lines(self, console, options, source):
+        md = Markdown(source, code_theme=self.code_theme)
+        return console.render_lines(md, options, pad=False)
+
+    def __rich_console__(self, console, options):
+        if options.max_width != self._width:
+            # Terminal resized: cached lines no longer fit, render everything again
+            self._width = options.max_width
+            self._lines = []
+            self._rendered_blocks = 0
+
+        for block in self.blocks[self._rendered_blocks:]:
+            if self._lines:
+                self._lines.append([])
+            self._lines.extend(self._render_lines(console, options, block))
+        self._rendered_blocks = len(self.blocks)
+
+        tail_lines = []
+        if self.tail.strip():
+            tail_lines = self._render_lines(console, options, self.tail)
+            if self._lines:
+                tail_lines.insert(0, [])
+
+        self.line_count = len(self._lines) + len(tail_lines)
+        visible = tail_lines[-self.max_lines:]
+        missing = self.max_lines - len(visible)
+        if missing > 0 and self._lines:
+            visible = self._lines[-missing:] + visible
+
+        for line in visible:
+            yield from line
+            yield Segment.line()
+
+class FrameBudget:
+    """
+    Menentukan kapan Live perlu di-refresh berdasarkan waktu, bukan jumlah
+    token. Interval ikut melebar kalau render lambat, supaya terminal tidak
+    pernah tertinggal dari model.
+    """
+    def __init__(self, min_interval=1 / 20, max_interval=0.5, load=0.3):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.load = load # Max fraction of wall time spent rendering
+        self.interval = min_interval
+        self.last = 0.0
+
+    def due(self):
+        return time.perf_counter() - self.last >= self.interval
+
+    def rendered(self, render_seconds):
+        self.last = time.perf_counter()
+        wanted = render_seconds / self.load
+        self.interval = min(self.max_interval, max(self.min_interval, wanted))
@@ -5,6 +5,7 @@ import logging
 import os
 import json
 import io
+import argparse
 
 # FORCE UTF-8 ENCODING (Fix for Windows 'charmap' error)
 if sys.platform == 'win32':
@@ -17,7 +18,7 @@ import flask.cli
 flask.cli.show_server_banner = lambda *args: None
 
 # Matikan log startup Werkzeug (* Running on http://...)
-from werkzeug.serving import BaseWSGIServer
+from werkzeug.serving import BaseWSGIServer, make_server
 def silent_startup(self): pass # Fungsi kosong
 BaseWSGIServer.log_startup = silent_startup
 
@@ -28,9 +29,15 @@ log.disabled = True
 # ----------------------------------------------------------------
 
 # --- IMPORT LAINNYA ---
-from frontend import client 
-from backend.core import engine
-from backend.utils import process_input_commands
+from backend.core import engine, request_options
+from backend.grammar import grammar_cache, GrammarError
+from backend.response_cache import response_cache
+from backend.batch import run_batch, parse_jsonl
+from backend.registry import model_registry
+from backend import metrics
+from backend import tracing
+from backend import streaming
+from backend.tracing import Trace
 from backend import config
 from flask import Flask, request, jsonify, Response, stream_with_context
 from flask_cors import CORS
@@ -39,45 +46,96 @@ from flask_cors import CORS
 app = Flask(__name__)
 CORS(app)
 
+def serialize_event(event, encode=streaming.encode_ndjson):
+    """Engine event -> one frame of the /chat stream (an NDJSON line by default)."""
+    if not isinstance(event, dict):
+        # Fallback for legacy string yields (safety)
+        event = {"type": "content", "data": event}
+    return encode(streaming.to_wire(event))
+
+def traced_stream(trace, events, encode=streaming.encode_ndjson):
+    """Same frames as the plain stream, with a span per wait / serialize / write."""
+    events = iter(events)
+    while True:
+        with trace.span("wait_event"):
+            event = next(events, None)
+        if event is None:
+            break
+        with trace.span("serialize"):
+            frame = serialize_event(event, encode)
+        with trace.span("write"):
+            yield frame # Resumes once the server has written the frame
+    yield encode({"type": "trace", "file": trace.save()})
+
 @app.route('/chat', methods=['POST'])
 def chat():
+    t_parse = time.perf_counter()
     data = request.json
     user_message = data.get('message', '')
     stream_mode = data.get('stream', False)
+    session_id = data.get('session_id')
+    options = request_options(data) # retrieve / temperature / seed / trace / profile / json_schema / grammar
+    if request.headers.get('X-Lumino-Trace'):
+        options["trace"] = True
+    trace = tracing.for_request(options) # NULL_TRACE unless asked for
+    if trace:
+        trace.complete("parse_json", Trace.at(t_parse), Trace.at(time.perf_counter()))
 
     if not user_message:
         return jsonify({"error": "Message is required"}), 400
+    try:
+        # Bad schema -> 400 now, not an error event mid-stream
+        grammar = grammar_cache.get(options)
+        settings = streaming.stream_settings(data) # stream_format / flush_ms / flush_tokens
+    except (GrammarError, streaming.StreamFormatError) as e:
+        return jsonify({"error": str(e)}), 400
+    if grammar[0] is not None:
+        options["_grammar"] = grammar # (grammar, usage info): the slot uses this compile
 
-    # Process message (simple pass-through for now)
+    # /read commands are expanded by the engine (cached, token-budgeted)
     processed_msg = user_message
     
     if stream_mode:
+        coalescer = streaming.Coalescer.from_settings(settings) # None: one frame per token
+        events = engine.generate_response(
+            processed_msg, stream=True, session_id=session_id, options=options, trace=trace,
+            poll=streaming.poll_interval(settings) if coalescer else None,
+        )
+        if coalescer:
+            events = streaming.coalesce(events, coalescer)
+        encode = streaming.encoder(settings)
+        mimetype = streaming.COMPACT_MIMETYPE if settings["format"] == "compact" else 'application/json'
+        headers = {"X-Lumino-Stream": streaming.describe(settings)}
+        if trace:
+            return Response(stream_with_context(traced_stream(trace, events, encode)), mimetype=mimetype, headers=headers)
+
         def generate():
             # Stream the response
-            for event in engine.generate_response(processed_msg, stream=True):
-                if isinstance(event, dict):
-                    if event["type"] == "content":
-                        yield json.dumps({"type": "token", "content": event["data"]}) + "\n"
-                    elif event["type"] == "usage":
-                        yield json.dumps({"type": "usage", "stats": event["data"]}) + "\n"
-                else:
-                    # Fallback for legacy string yields (safety)
-                    yield json.dumps({"type": "token", "content": event}) + "\n"
+            for event in events:
+                yield serialize_event(event, encode)
         
-        return Response(stream_with_context(generate()), mimetype='application/json')
+        return Response(stream_with_context(generate()), mimetype=mimetype, headers=headers)
     else:
-        result = engine.generate_response(processed_msg, stream=False)
+        result = engine.generate_response(processed_msg, stream=False, session_id=session_id, options=options, trace=trace)
         
         # Handle legacy string response
         if isinstance(result, str):
              return jsonify({"response": result, "files_read": []})
              
         # Handle new dict response
-        return jsonify({
+        body = {
             "response": result["content"],
             "usage": result.get("usage"),
-            "files_read": []
-        })
+            "files_read": result.get("files_read", []),
+            "context": result.get("context", [])
+        }
+        if not trace:
+            return jsonify(body)
+        body["trace_file"] = str(trace.path)
+        with trace.span("serialize"):
+            response = jsonify(body)
+        trace.save()
+        return response
 
 @app.route('/model/set', methods=['POST'])
 def set_model():
@@ -86,15 +144,22 @@ def set_model():
     if not model_name:
         return jsonify({"error": "Model name required"}), 400
         
+    if model_name not in config.get_available_models():
+        return jsonify({"error": f"Model {model_name} not found"}), 404
+
     try:
-        success = engine.switch_model(model_name)
-        if success:
+        # Non-blocking: cold models load in the background, poll /model/status
+        state = engine.switch_model(model_name)
+        if state == "ready":
             return jsonify({"status": "success", "message": f"Switched to {model_name}"})
-        else:
-            return jsonify({"error": "Failed to load model"}), 500
+        return jsonify({"status": "loading", "message": f"Loading {model_name}"}), 202
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+@app.route('/model/status', methods=['GET'])
+def model_status():
+    return jsonify(engine.model_status())
+
 @app.route('/reset', methods=['POST'])
 def reset_model():
     """Legacy endpoint - redirects to default behavior or error"""
@@ -102,24 +167,136 @@ def reset_model():
 
 @app.route('/models', methods=['GET'])
 def list_models():
-    return jsonify({"models": config.get_available_models()})
+    # Served from the GGUF header cache: no model file is opened unless it changed
+    return jsonify({"models": config.get_available_models(), "details": model_registry.describe()})
+
+@app.route('/scheduler', methods=['GET'])
+def scheduler_status():
+    if engine.scheduler is None:
+        return jsonify({"error": "Neural Core not active"}), 503
+    return jsonify(engine.scheduler.status())
+
+@app.route('/sessions', methods=['GET'])
+def sessions_status():
+    return jsonify(engine.sessions.status())
+
+@app.route('/health', methods=['GET'])
+def health():
+    """Liveness: the process is up and serving HTTP (model may still be loading)."""
+    return jsonify({"status": "ok", "uptime": round(time.time() - engine.started_at, 2)})
+
+@app.route('/ready', methods=['GET'])
+def ready():
+    """Readiness: 200 once a model can take requests, 503 with load progress before."""
+    info = engine.readiness()
+    return jsonify(info), (200 if info["ready"] else 503)
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Prometheus text format (scrape target)."""
+    return Response(metrics.registry.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/cache', methods=['GET'])
+def cache_status():
+    return jsonify({**response_cache.status(), "grammar": grammar_cache.status()})
+
+@app.route('/batch', methods=['POST'])
+def batch():
+    """
+    Independent prompts, no session history. Body: {"items": [...]} or JSONL.
+    Results stream back as JSONL in completion order (not input order).
+    """
+    data = request.get_json(silent=True)
+    if isinstance(data, dict):
+        items = data.get('items', [])
+    elif isinstance(data, list):
+        items = data
+    else:
+        items = parse_jsonl(request.get_data(as_text=True).splitlines())
 
-def run_server():
-    # use_reloader=False itu WAJIB agar patch di atas bekerja
-    app.run(host='127.0.0.1', port=5000, debug=False, use_reloader=False)
+    if not items or not isinstance(items, list):
+        return jsonify({"error": "Items are required"}), 400
+    if engine.scheduler is None:
+        return jsonify({"error": "Neural Core not active"}), 503
+
+    def generate():
+        for result in run_batch(engine, items):
+            yield json.dumps(result) + "\n"
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+def run_batch_file(input_path, output_path=None):
+    """main.py --batch: run a JSONL file through the engine, no server and no UI."""
+    with open(input_path, 'r', encoding='utf-8') as f:
+        items = parse_jsonl(f)
+    out = open(output_path, 'w', encoding='utf-8') if output_path else sys.stdout
+    start = time.perf_counter()
+    done = errors = tokens = 0
+    try:
+        for result in run_batch(engine, items):
+            out.write(json.dumps(result, ensure_ascii=False) + "\n")
+            out.flush()
+            done += 1
+            if "error" in result:
+                errors += 1
+            elif result.get("usage"):
+                tokens += result["usage"].get("completion_tokens", 0)
+    finally:
+        if output_path:
+            out.close()
+    elapsed = time.perf_counter() - start
+    print(f"Batch: {done} items ({errors} errors), {tokens} tokens in {elapsed:.1f}s "
+          f"({tokens / max(elapsed, 1e-9):.1f} tok/s)", file=sys.stderr)
+    return 1 if errors else 0
+
+def run_server(use_async=False):
+    if use_async:
+        # Asyncio mode: SSE/WebSocket streaming, many concurrent streams
+        from backend import async_server
+        async_server.run(host='127.0.0.1', port=5000)
+        return
+
+    # Bind the socket first, then load the model in the background:
+    # /health answers immediately and /ready reports the load progress
+    server = make_server('127.0.0.1', 5000, app, threaded=True)
+    engine.start()
+    server.serve_forever()
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Lumino Intelligence")
+    parser.add_argument('--async', dest='use_async', action='store_true',
+                        help="Serve with the asyncio (aiohttp) server instead of Flask")
+    parser.add_argument('--headless', action='store_true',
+                        help="Server only: no terminal client (for services)")
+    parser.add_argument('--batch', metavar='INPUT_JSONL',
+                        help="Run every prompt in a JSONL file ({\"id\", \"message\"} per line) and exit")
+    parser.add_argument('--output', metavar='OUTPUT_JSONL',
+                        help="Where --batch writes results (default: stdout)")
+    return parser.parse_args()
 
 if __name__ == '__main__':
-    # 1. Intro Visual (Removed legacy intro import)
-    
-    # 2. Jalankan Server (Sekarang benar-benar hening)
-    server_thread = threading.Thread(target=run_server, daemon=True)
-    server_thread.start()
+    args = parse_args()
+
+    if args.batch:
+        engine.start(wait=True)
+        sys.exit(run_batch_file(args.batch, args.output))
 
-    # 3. Delay
-    time.sleep(2) 
+    if args.headless:
+        # Service mode: the client (rich, prompt_toolkit, msvcrt) is never imported
+        try:
+            run_server(args.use_async)
+        except KeyboardInterrupt:
+            pass
+        sys.exit(0)
+
+    # 1. Jalankan Server (Sekarang benar-benar hening)
+    server_thread = threading.Thread(target=run_server, args=(args.use_async,), daemon=True)
+    server_thread.start()
 
-    # 4. Jalankan UI Client
+    # 2. Jalankan UI Client (menunggu /ready, bukan sleep)
+    from frontend import client
     try:
+        client.wait_until_ready()
         client.run() 
     except KeyboardInterrupt:
         sys.exit(0)